@@ -0,0 +1,63 @@
+# -------------------------------------------------------------------------------
+# Name:        fleet_export.py
+# Purpose:     Export archived or freshly fetched sensor-data to CF NetCDF or CSV
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import argparse
+import logging
+from datetime import timedelta, timezone
+from lib.api_functions import SOFAR_API_URL
+from lib.decode import DECODERS
+from lib.export import export_batches, exporter_for_path, iter_api_batches, EXPORTERS, DEFAULT_EXPORT_WINDOW
+from lib.local_store import LocalStore
+from lib.timestamps import convert_to_iso8601, parse_timestamp, to_datetime64
+
+# Configure logging (this is a basic configuration, adjust as needed)
+logging.basicConfig(level=logging.INFO)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export sensor-data from a local store or the Sofar API to CF NetCDF or CSV.')
+    parser.add_argument('output_path', type=str, help='File to write, .nc for NetCDF or .csv for CSV')
+    parser.add_argument('--store', type=str, help='SQLite database written by fleet_ingest_daemon.py to export from')
+    parser.add_argument('--api_token', type=str, help='API Token, to export straight from the sensor-data API instead of a store')
+    parser.add_argument('--spotter_ids', type=str, nargs='+', help='Spotter IDs to export (default: every Spotter in the store)')
+    parser.add_argument('--system', choices=list(DECODERS), default='beta2', help='Decoder for API exports (default: beta2)')
+    parser.add_argument('-s', '--start_date', type=convert_to_iso8601, help='Start date (required for API exports)')
+    parser.add_argument('-e', '--end_date', type=convert_to_iso8601, help='End date (optional)')
+    parser.add_argument('-f', '--format', choices=list(EXPORTERS), help='Output format (default: from the file extension)')
+    parser.add_argument('--window_days', type=float, default=DEFAULT_EXPORT_WINDOW.days, help='Days fetched per API request')
+    parser.add_argument('--base_url', type=str, default=SOFAR_API_URL, help='sensor-data endpoint, e.g. a local mock server')
+    args = parser.parse_args()
+
+    if bool(args.store) == bool(args.api_token):
+        parser.error("Give exactly one of --store or --api_token")
+    if args.api_token and not (args.spotter_ids and args.start_date):
+        parser.error("API exports need --spotter_ids and --start_date")
+    if args.start_date and args.end_date and to_datetime64(args.start_date) > to_datetime64(args.end_date):
+        parser.error("--start_date must not be after --end_date")
+
+    exporter = exporter_for_path(args.output_path, args.format)
+    store = None
+    if args.store:
+        store = LocalStore(args.store)
+        # Inclusive bounds, compared to the stored timestamps as parsed times
+        batches = store.iter_sensor_data(args.spotter_ids, args.start_date, args.end_date)
+    else:
+        start_date, end_date = (parse_timestamp(date).replace(tzinfo=timezone.utc) if date else None
+                                for date in (args.start_date, args.end_date))
+        batches = iter_api_batches(args.spotter_ids, args.api_token, args.system, start_date, end_date,
+                                   timedelta(days=args.window_days), args.base_url)
+    n_rows = export_batches(batches, exporter)
+    if store is not None:
+        store.close()
+    print(f"Exported {n_rows} rows to {args.output_path}")
+
+
+if __name__ == "__main__":
+    main()
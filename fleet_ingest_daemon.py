@@ -0,0 +1,45 @@
+# -------------------------------------------------------------------------------
+# Name:        fleet_ingest_daemon.py
+# Purpose:     Poll sensor-data for a fleet of Spotters into a local SQLite store
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+from datetime import timedelta
+from lib.api_functions import SOFAR_API_URL
+from lib.decode import DECODERS
+from lib.ingest_daemon import IngestDaemon, DEFAULT_POLL_INTERVAL, DEFAULT_FETCH_CONCURRENCY
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Continuously ingest sensor-data for a fleet of Spotters into a local SQLite store.')
+    parser.add_argument('api_token', type=str, help='API Token')
+    parser.add_argument('store_path', type=str, help='Path of the SQLite database to write to')
+    parser.add_argument('spotter_ids', type=str, nargs='+', help='Spotter IDs to poll')
+    parser.add_argument('--system', choices=list(DECODERS), default='beta2', help='Decoder to use for all Spotters (default: beta2)')
+    parser.add_argument('--poll_interval', type=float, default=DEFAULT_POLL_INTERVAL.total_seconds() / 60,
+                        help='Minutes between polls of each Spotter')
+    parser.add_argument('--fetch_concurrency', type=int, default=DEFAULT_FETCH_CONCURRENCY, help='Maximum API requests in flight')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Decode worker processes (default: CPU count)')
+    parser.add_argument('--base_url', type=str, default=SOFAR_API_URL, help='sensor-data endpoint, e.g. a local mock server')
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(
+        [(spotter_id, args.system) for spotter_id in args.spotter_ids],
+        args.api_token,
+        args.store_path,
+        poll_interval=timedelta(minutes=args.poll_interval),
+        fetch_concurrency=args.fetch_concurrency,
+        workers=args.workers,
+        base_url=args.base_url,
+    )
+    asyncio.run(daemon.run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# -------------------------------------------------------------------------------
+# Name:        fleet_position_query.py
+# Purpose:     Find archived sensor positions near a point and within a time range
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import argparse
+from lib.local_store import LocalStore
+from lib.timestamps import convert_to_iso8601, to_datetime64
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the positions archived by fleet_ingest_daemon.py.')
+    parser.add_argument('store_path', type=str, help='Path of the SQLite database written by fleet_ingest_daemon.py')
+    parser.add_argument('latitude', type=float, help='Latitude of the query point')
+    parser.add_argument('longitude', type=float, help='Longitude of the query point')
+    parser.add_argument('radius_km', type=float, help='Search radius in km')
+    parser.add_argument('-s', '--start_date', type=convert_to_iso8601, help='Start date (optional)')
+    parser.add_argument('-e', '--end_date', type=convert_to_iso8601, help='End date (optional)')
+    args = parser.parse_args()
+    if args.start_date and args.end_date and to_datetime64(args.start_date) > to_datetime64(args.end_date):
+        parser.error("--start_date must not be after --end_date")
+
+    store = LocalStore(args.store_path)
+    index = store.get_position_index()
+    store.close()
+    result = index.query_radius(args.latitude, args.longitude, args.radius_km, args.start_date, args.end_date)
+    print(f"Found {len(result['timestamp'])} of {len(index)} positions within {args.radius_km} km.")
+    for spotter_id, key, timestamp, distance in zip(result['spotter_id'], result['sensor_key'], result['timestamp'], result['distance_km']):
+        print(f"{timestamp}\t{spotter_id}\tsensor {key}\t{distance:.3f} km")
+
+
+if __name__ == "__main__":
+    main()
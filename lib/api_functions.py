@@ -9,28 +9,34 @@
 # -------------------------------------------------------------------------------
 
 import json
-import re
+import numpy as np
 import requests
 
 from lib.beta2_data import group_sensor_data, format_data_for_plotting, format_soft_data_for_plotting
 from lib.binary_decoder import decode_payload_to_structs, DVT1_DATA_CHANNELS, DVT1_STRUCT_DESCRIPTION
+from lib.records import compact_record
+from lib.segments import get_segment_tables
+from lib.timestamps import parse_timestamps, validate_iso_8601_timestamp
+from lib.topology import get_sensor_index, get_topology, detect_sensor_type, decode_records
+from lib.parallel_decode import use_parallel, parallel_decode_sensor_data
 
+SOFAR_API_URL = "https://api.sofarocean.com/api/sensor-data"
 
-def validate_iso_8601_timestamp(timestamp):
-    """Validate if a given string is a valid ISO-8601 timestamp."""
-    pattern = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z$'
-    return re.match(pattern, timestamp) is not None
 
+def fetch_sensor_data(spotter_id, api_token, start_date=None, end_date=None, base_url=SOFAR_API_URL, session=None):
+    """
+    Fetch sensor-data from Sofar API.
 
-def fetch_sensor_data(spotter_id, api_token, start_date=None, end_date=None):
-    """Fetch sensor-data from Sofar API."""
+    Parameters:
+    - base_url (str): sensor-data endpoint, override to point at a mirror or a local mock server.
+    - session (requests.Session): optional session so repeated polls reuse HTTP connections.
+    """
 
     if start_date and not validate_iso_8601_timestamp(start_date):
         raise ValueError("Invalid start_date format. Must be ISO-8601.")
     if end_date and not validate_iso_8601_timestamp(end_date):
         raise ValueError("Invalid end_date format. Must be ISO-8601.")
 
-    base_url = "https://api.sofarocean.com/api/sensor-data"
     params = {
         "token": api_token,
         "spotterId": spotter_id
@@ -41,16 +47,48 @@ def fetch_sensor_data(spotter_id, api_token, start_date=None, end_date=None):
         params["endDate"] = end_date
 
     try:
-        response = requests.get(base_url, params=params)
+        response = (session or requests).get(base_url, params=params)
         response.raise_for_status()
         return response.json()
     except requests.RequestException as e:
         raise Exception(f"API request failed: {e}")
 
 
-def fetch_and_decode_sensor_data(spotter_id, api_token, start_date=None, end_date=None):
-    api_response = fetch_sensor_data(spotter_id, api_token, start_date, end_date)
-    for payload in api_response.get('data', []):
+def index_dataset(dataset, group_field, sensor_types=None):
+    """
+    Build the one-time indexes of a decoded dataset: the categorical sensor index,
+    the per-sensor segment tables and the sensor topology. They are kept in
+    lib.dataset_cache, so the dataset itself stays JSON-serializable.
+
+    Parameters:
+    - dataset (dict): decoded sensor-data with a 'data' list in time order.
+    - group_field (str): payload field identifying the sensor, 'sensorPosition' or 'bristlemouth_node_id'.
+    - sensor_types (list of str): Sensor type of each record, detected if not given.
+
+    Returns:
+    dict: The input dataset, unchanged.
+    """
+    get_sensor_index(dataset, group_field)
+    get_segment_tables(dataset, group_field)
+    get_topology(dataset, sensor_types)
+    return dataset
+
+
+def decode_sensor_data(api_response, workers=1, compact=False):
+    """
+    Decode the DVT1 hex payloads of a sensor-data response in place.
+
+    Parameters:
+    - workers (int): Worker processes for large responses, None for the CPU count. 1 decodes serially.
+    -- see lib.parallel_decode.parallel_decode_sensor_data
+    - compact (bool): Replace the payload dicts with dict-compatible lib.records records,
+    -- each as soon as it is decoded, so the decoded dicts of the whole response never coexist.
+    """
+    if workers != 1 and use_parallel(len(api_response.get('data', [])), workers):
+        parallel_decode_sensor_data(api_response, workers, compact=compact)
+        return index_dataset(api_response, 'bristlemouth_node_id')
+    data = api_response.get('data', [])
+    for i, payload in enumerate(data):
         hex_value = payload.get('value', '')
         timestamp = payload.get('timestamp', 'Unknown')
         try:
@@ -59,28 +97,72 @@ def fetch_and_decode_sensor_data(spotter_id, api_token, start_date=None, end_dat
             payload['decoded_value'] = decoded_value
         except AssertionError as e:
             print(f"Unexpected units type '{payload.get('units', None)}' for payload at time {payload.get('timestamp', 'Unknown')} is not type 'hex'. Skipping decoding.")
-            continue
         except ValueError as ve:
             print(f"Failed to decode hex value {hex_value} at timestamp {timestamp}: {ve}")
-            continue
-    return api_response
+        if compact:
+            data[i] = compact_record(payload)
+    return index_dataset(api_response, 'bristlemouth_node_id')
+
+
+def decode_beta2_data(api_response, compact=False):
+    """
+    Group and format a Beta 2 sensor-data response.
+    With compact, the grouped data and their decoded values are built as dict-compatible lib.records records.
+
+    Formatting stays in one process: reading the sample values and writing the channel dicts
+    is the whole cost, so handing the arithmetic to workers is slower than the serial loop.
+    """
+    grouped_location_data = group_sensor_data(api_response['data'], compact)
+    formatted_data = format_data_for_plotting(grouped_location_data, compact)
+    return index_dataset({"data": formatted_data}, 'sensorPosition')
+
+
+def decode_soft_data(api_response, compact=False):
+    """Group and format a SOFT sensor-data response, see decode_beta2_data."""
+    grouped_location_data = group_sensor_data(api_response['data'], compact)
+    formatted_data = format_soft_data_for_plotting(grouped_location_data, compact)
+    return index_dataset({"data": formatted_data}, 'sensorPosition')
+
+
+def decode_mixed_data(api_response, compact=False):
+    """
+    Decode a sensor-data response carrying several sensor types (Beta 2 Aanderaa and SOFT
+    sample values, DVT1 Aanderaa or RBR Coda hex payloads, ...) in a single pass.
+
+    Hex payloads are complete records and are kept as they are; the Beta 2 sample values
+    are grouped into located data (see lib.beta2_data.group_sensor_data). Each record is
+    then decoded with the decoder of its detected sensor type, in time order.
+    New module types only need to be declared in lib.sensor_registry.
+    """
+    payloads, sample_values = [], []
+    for record in api_response['data']:
+        (payloads if record.get('units') == 'hex' else sample_values).append(record)
+    records = payloads + group_sensor_data(sample_values, compact)
+    order = np.argsort(parse_timestamps([record['timestamp'] for record in records]), kind='stable')
+    records = [records[i] for i in order.tolist()]
+    sensor_types = [detect_sensor_type(record) for record in records]
+    decode_records(records, sensor_types, compact)
+    return index_dataset({"data": records}, 'sensorPosition', sensor_types)
+
+
+def fetch_and_decode_sensor_data(spotter_id, api_token, start_date=None, end_date=None, workers=1, compact=False):
+    api_response = fetch_sensor_data(spotter_id, api_token, start_date, end_date)
+    return decode_sensor_data(api_response, workers, compact)
 
 
-def fetch_and_group_beta2_data(spotter_id, api_token, start_date=None, end_date=None):
+def fetch_and_group_beta2_data(spotter_id, api_token, start_date=None, end_date=None, compact=False):
     api_response = fetch_sensor_data(spotter_id, api_token, start_date, end_date)
-    return group_sensor_data(api_response['data'])
+    return group_sensor_data(api_response['data'], compact)
 
 
-def fetch_and_decode_beta2_data(spotter_id, api_token, start_date=None, end_date=None):
-    grouped_location_data = fetch_and_group_beta2_data(spotter_id, api_token, start_date, end_date)
-    formatted_data = format_data_for_plotting(grouped_location_data)
-    return {"data": formatted_data}
+def fetch_and_decode_beta2_data(spotter_id, api_token, start_date=None, end_date=None, compact=False):
+    api_response = fetch_sensor_data(spotter_id, api_token, start_date, end_date)
+    return decode_beta2_data(api_response, compact)
 
 
-def fetch_and_decode_soft_data(spotter_id, api_token, start_date=None, end_date=None):
-    grouped_location_data = fetch_and_group_beta2_data(spotter_id, api_token, start_date, end_date)
-    formatted_data = format_soft_data_for_plotting(grouped_location_data)
-    return {"data": formatted_data}
+def fetch_and_decode_soft_data(spotter_id, api_token, start_date=None, end_date=None, compact=False):
+    api_response = fetch_sensor_data(spotter_id, api_token, start_date, end_date)
+    return decode_soft_data(api_response, compact)
 
 
 if __name__ == "__main__":
@@ -10,13 +10,18 @@
 
 from itertools import groupby
 import logging
-from math import degrees
 from operator import itemgetter
 
+import numpy as np
+
+from lib.records import compact_decoded_value, LocatedDatum
+from lib.timestamps import parse_timestamps
+from lib.sensor_registry import SENSOR_TYPES, SENSOR_TYPE_AANDERAA, SENSOR_TYPE_SOFT
+
 # Configure logging (this is a basic configuration, adjust as needed)
 logging.basicConfig(level=logging.INFO)
 
-def group_sensor_data(data):
+def group_sensor_data(data, compact=False):
     """
        Group Beta 2 sensor-data response by location datum (latitude, longitude, timestamp, and sensorPosition).
 
@@ -25,6 +30,8 @@ def group_sensor_data(data):
                             sensor data with keys like latitude, longitude, timestamp,
                             sensorPosition, units, value, unit_type, and data_type_name.
                             See docs/example_beta2_sensor-data_payload.json for expected input structure.
+       compact (bool): Return lib.records.LocatedDatum records with array-backed sample values
+                       and shared metadata instead of dicts. They are read like the dicts.
 
        Returns:
        list of dict: A list of dictionaries, each containing the keys 'latitude',
@@ -35,13 +42,32 @@ def group_sensor_data(data):
     for entry in data:
         entry.setdefault('bristlemouth_node_id', None)
 
-    # Sort the data by the keys you want to group by
-    data.sort(key=itemgetter('timestamp', 'latitude', 'longitude', 'sensorPosition'))
+    # Sort and group on the parsed time, so the same instant written differently
+    # (2024-01-21T20:20:08Z, 2024-01-21T20:20:08.000Z) forms one datum in time order.
+    # Each datum keeps the timestamp string of its first sample value.
+    times = parse_timestamps([entry['timestamp'] for entry in data]).astype(np.int64)
+    location = [np.fromiter((entry[key] for entry in data), dtype=np.float64, count=len(data))
+                for key in ('sensorPosition', 'longitude', 'latitude')]
+    order = np.lexsort(location + [times])
+    data[:] = [data[i] for i in order.tolist()]
+    times = times[order].tolist()
+    group_key = itemgetter('latitude', 'longitude', 'sensorPosition', 'bristlemouth_node_id')
+    groups = groupby(zip(times, data), key=lambda pair: (pair[0],) + group_key(pair[1]))
+
+    if compact:
+        grouped_data = []
+        for (_, latitude, longitude, sensorPosition, bristlemouth_node_id), pairs in groups:
+            items = [item for _, item in pairs]
+            grouped_data.append(
+                LocatedDatum(items[0]['timestamp'], latitude, longitude, sensorPosition, bristlemouth_node_id, items))
+        return grouped_data
 
     # Use groupby to group data
-    grouped_data = [
-        {
-            "timestamp": timestamp,
+    grouped_data = []
+    for (_, latitude, longitude, sensorPosition, bristlemouth_node_id), pairs in groups:
+        items = [item for _, item in pairs]
+        grouped_data.append({
+            "timestamp": items[0]["timestamp"],
             "latitude": latitude,
             "longitude": longitude,
             "sensorPosition": sensorPosition,
@@ -55,14 +81,24 @@ def group_sensor_data(data):
                 }
                 for item in items
             ]
-        }
-        for (timestamp, latitude, longitude, sensorPosition, bristlemouth_node_id), items in
-        groupby(data, key=itemgetter('timestamp', 'latitude', 'longitude', 'sensorPosition', 'bristlemouth_node_id'))
-    ]
+        })
 
     return grouped_data
 
-def format_data_for_plotting(data):
+def format_located_datum(located_datum):
+    """
+    Format the sample values of one grouped Beta 2 datum into Aanderaa channel data.
+
+    Parameters:
+    located_datum (dict): one element of the output of group_sensor_data
+
+    Returns:
+    list of dict: the 'decoded_value' channel list, or None if the sensor is horizontal
+                  or reported no tilt data.
+    """
+    return SENSOR_TYPES[SENSOR_TYPE_AANDERAA].format_datum(located_datum)
+
+def format_data_for_plotting(data, compact=False):
     """
     Format sensor data for plotting purposes.
 
@@ -72,6 +108,7 @@ def format_data_for_plotting(data):
 
     Parameters:
     data (list of dict): output of group_sensor_data
+    compact (bool): Store each 'decoded_value' as lib.records.ChannelValue records.
 
     Returns:
     list of dict: The input list with modified dictionaries containing 'decoded_value'
@@ -79,83 +116,26 @@ def format_data_for_plotting(data):
     """
     for located_datum in data:
         try:
-            sample_values_dict = {}
-            for sample_value in located_datum['sample_values']:
-                sample_values_dict[sample_value['data_type_name']] = sample_value
-
-            if (
-                "aanderaa_abs_speed_mean_15bits" not in sample_values_dict
-                and "aanderaa_abs_tilt_mean_8bits" in sample_values_dict
-                and degrees(sample_values_dict["aanderaa_abs_tilt_mean_8bits"]["value"])
-                > 75.0
-            ):
-                print(f"Sensor {located_datum['sensorPosition']} horizontal at {located_datum['timestamp']}")
-                continue
-            elif "aanderaa_abs_tilt_mean_8bits" not in sample_values_dict:
-                position, timestamp = located_datum["sensorPosition"], located_datum["timestamp"]
-                print(f"Sensor {position} has no tilt data at {timestamp}")
-                continue
-
-            located_datum['decoded_value'] = [
-                 {
-                    "data": {
-                        "sample_count": sample_values_dict['aanderaa_reading_count_10bits']['value'],
-                        "mean": sample_values_dict['aanderaa_abs_speed_mean_15bits']['value'],
-                        "stdev": sample_values_dict['aanderaa_abs_speed_std_15bits']['value']
-                    },
-                    "channel_name": "Abs Speed[cm/s]"
-                },
-                {
-                    "data": {
-                        "sample_count": sample_values_dict['aanderaa_reading_count_10bits']['value'],
-                        "mean": degrees(sample_values_dict['aanderaa_abs_tilt_mean_8bits']['value']),
-                        "stdev": degrees(sample_values_dict['aanderaa_std_tilt_mean_8bits']['value'])
-                    },
-                    "channel_name": "Abs Tilt[Deg]"
-                },
-                {
-                    "data": {
-                        "sample_count": sample_values_dict['aanderaa_reading_count_10bits']['value'],
-                        "mean": degrees(sample_values_dict['aanderaa_direction_circ_mean_13bits']['value']),
-                        "stdev": degrees(sample_values_dict['aanderaa_direction_circ_std_13bits']['value'])
-                    },
-                    "channel_name": "Direction[Deg.M]"
-                },
-                {
-                    "data": {
-                        "sample_count": sample_values_dict['aanderaa_reading_count_10bits']['value'],
-                        "mean": sample_values_dict['aanderaa_temperature_mean_13bits']['value']
-                    },
-                    "channel_name": "Temperature[ºC]"
-                }
-            ]
+            decoded_value = format_located_datum(located_datum)
+            if decoded_value is not None:
+                located_datum['decoded_value'] = compact_decoded_value(decoded_value) if compact else decoded_value
         except Exception as e:
             print(f"Could not format data for sensor {located_datum['sensorPosition']}, at {located_datum['timestamp']}")
             logging.error(f"Error: {e}", exc_info = True)
             continue
     return data
 
-def format_soft_data_for_plotting(data):
-    """Format SOFT module data for plotting purposes."""
+def format_soft_located_datum(located_datum):
+    """Format the sample values of one grouped datum into SOFT channel data, or None if it has no SOFT temperature."""
+    return SENSOR_TYPES[SENSOR_TYPE_SOFT].format_datum(located_datum)
+
+def format_soft_data_for_plotting(data, compact=False):
+    """Format SOFT module data for plotting purposes, see format_data_for_plotting."""
     for located_datum in data:
         try:
-            sample_values_dict = {}
-            for sample_value in located_datum["sample_values"]:
-                sample_values_dict[sample_value["data_type_name"]] = sample_value
-
-            if "bm_soft_temperature_mean_13bits" not in sample_values_dict:
-                continue
-
-            located_datum["decoded_value"] = [
-                {
-                    "data": {
-                        "mean": sample_values_dict["bm_soft_temperature_mean_13bits"][
-                            "value"
-                        ],
-                    },
-                    "channel_name": "Temperature[ºC]",
-                }
-            ]
+            decoded_value = format_soft_located_datum(located_datum)
+            if decoded_value is not None:
+                located_datum["decoded_value"] = compact_decoded_value(decoded_value) if compact else decoded_value
         except Exception as e:
             print(
                 f"Could not format data for sensor {located_datum['sensorPosition']}, at {located_datum['timestamp']}"
@@ -9,6 +9,7 @@
 # -------------------------------------------------------------------------------
 
 import struct
+import numpy as np
 
 # Struct description for Aanderaa Adapter DVT1 Firmware
 DVT1_STRUCT_DESCRIPTION = [
@@ -40,6 +41,25 @@ BETA_2_DATA_CHANNELS = [
     "Abs Tilt[Deg]"
 ]
 
+# Feb '24 DVT SOFT module Data Channels
+SOFT_DATA_CHANNELS = [
+    "Temperature[ºC]",
+]
+
+# Struct description for Feb '24 DVT RBR Coda modules
+RBR_CODA_STRUCT_DESCRIPTION = [
+    ("uint16_t", "sample_count"),
+    ("double", "min"),
+    ("double", "max"),
+    ("double", "mean"),
+    ("double", "stdev"),
+]
+
+# Feb '24 DVT RBR Coda Data Channels
+RBR_CODA_DATA_CHANNELS = [
+    "Temperature[ºC] or Pressure[dbar]",
+]
+
 # Sample Hex Payload
 SAMPLE_HEX_DATA = (
     "b1005abdf33fae96cb43b261f042f4199442b100784ecc3bf7acb343b71f48432059e042"
@@ -87,6 +107,31 @@ def hex_to_struct(hex_data, struct_description):
 
     return result
 
+def struct_description_to_dtype(struct_description):
+    """Return a packed little-endian numpy dtype matching a struct description."""
+    numpy_types = {'uint16_t': '<u2', 'float': '<f4', 'double': '<f8'}
+    fields = []
+    for data_type, name in struct_description:
+        if data_type not in numpy_types:
+            raise ValueError(f"Unsupported data type: {data_type}")
+        fields.append((name, numpy_types[data_type]))
+    return np.dtype(fields)
+
+def payload_to_struct_bytes(hex_payload, n_channels, struct_description):
+    """
+    Validate a hex payload like decode_payload_to_structs and return the raw bytes of its first n_channels structs.
+    Used by bulk decoders that unpack many payloads at once with struct_description_to_dtype.
+    """
+    struct_size_bytes = get_struct_size_bytes(struct_description)
+    struct_hex_len = 2 * struct_size_bytes
+    hex_payload_trimmed = hex_payload.replace(" ", "").replace("\n", "")
+    if len(hex_payload_trimmed) % struct_hex_len != 0:
+        raise ValueError(f"struct hex length {struct_hex_len} does not evenly divide into hex payload {hex_payload_trimmed}")
+    byte_data = bytes.fromhex(hex_payload_trimmed[:n_channels * struct_hex_len])
+    if len(byte_data) != n_channels * struct_size_bytes:
+        raise ValueError(f"Expected {n_channels * struct_size_bytes} bytes, but got {len(byte_data)} bytes")
+    return byte_data
+
 def print_decoded_struct(decoded_data):
     """Pretty prints decoded structured data."""
     for data_channel in decoded_data:
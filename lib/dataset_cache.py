@@ -0,0 +1,64 @@
+# -------------------------------------------------------------------------------
+# Name:        dataset_cache.py
+# Purpose:     Side cache of the indexes built over decoded sensor-data lists
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from collections import OrderedDict
+
+# Indexes kept at once, least recently used dropped first
+MAX_CACHED_INDEXES = 32
+
+_index_cache = OrderedDict()
+
+
+def cached_index(kind, data, fingerprint, build):
+    """
+    Return the index of a data list, building it only if the data changed since it was cached.
+
+    Indexes are kept here rather than in the decoded dataset so that the dataset stays
+    plain JSON-shaped data. Each index is stored with the fingerprint it was built from,
+    the record fields it depends on, so sorting, filtering or editing the data in place
+    rebuilds it, and a new list that happens to reuse an old id() cannot get a stale index.
+
+    Parameters:
+    - kind (tuple): What is indexed, e.g. ('sensor_index', 'sensorPosition').
+    - data (list): The records indexed.
+    - fingerprint: The values of data the index depends on, compared with ==.
+    - build (function): build() -> the index.
+
+    Returns:
+    The cached or newly built index.
+    """
+    key = (kind, id(data))
+    entry = _index_cache.get(key)
+    if entry is not None and entry[0] == fingerprint:
+        _index_cache.move_to_end(key)
+        return entry[1]
+    index = build()
+    store_index(kind, data, fingerprint, index)
+    return index
+
+
+def store_index(kind, data, fingerprint, index):
+    """Cache an index of data built elsewhere, see cached_index."""
+    key = (kind, id(data))
+    _index_cache[key] = (fingerprint, index)
+    _index_cache.move_to_end(key)
+    while len(_index_cache) > MAX_CACHED_INDEXES:
+        _index_cache.popitem(last=False)
+
+
+def release_indexes(data):
+    """Drop every cached index of a data list, e.g. once a decoded response has been flattened and discarded."""
+    for key in [key for key in _index_cache if key[1] == id(data)]:
+        del _index_cache[key]
+
+
+def clear_index_cache():
+    """Drop every cached index."""
+    _index_cache.clear()
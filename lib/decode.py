@@ -0,0 +1,47 @@
+# -------------------------------------------------------------------------------
+# Name:        decode.py
+# Purpose:     Decode sensor-data responses into store rows, for ingest and export
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from lib.api_functions import decode_sensor_data, decode_beta2_data, decode_soft_data, decode_mixed_data
+from lib.dataset_cache import release_indexes
+from lib.local_store import flatten_decoded_data
+from lib.quality_control import apply_qc_flags
+from lib.timestamps import max_timestamp
+from lib.topology import get_topology
+
+DECODERS = {
+    "beta1": decode_sensor_data,
+    "beta2": decode_beta2_data,
+    "soft": decode_soft_data,
+    "mixed": decode_mixed_data,
+}
+
+
+def decode_to_rows(spotter_id, system, api_response):
+    """
+    Decode, QC and flatten a sensor-data response into store rows.
+
+    Runs in the ingest daemon's worker pool, so it must stay a picklable module level function.
+    The decoded response is dropped once flattened, so its cached indexes are released
+    and memory stays bounded by one response across a long ingest or export.
+
+    Parameters:
+    - spotter_id (str): Spotter the response belongs to.
+    - system (str): Decoder, a key of DECODERS.
+    - api_response (dict): sensor-data response.
+
+    Returns:
+    tuple: (rows, latest_timestamp, topology_entries) where latest_timestamp is None when the response was empty.
+    """
+    decoded = apply_qc_flags(DECODERS[system](api_response))
+    rows = flatten_decoded_data(spotter_id, decoded.get('data', []))
+    latest_timestamp = max_timestamp(payload.get('timestamp') for payload in api_response.get('data', []))
+    topology_entries = get_topology(decoded).entries
+    release_indexes(decoded.get('data', []))
+    return rows, latest_timestamp, topology_entries
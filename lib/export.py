@@ -0,0 +1,358 @@
+# -------------------------------------------------------------------------------
+# Name:        export.py
+# Purpose:     Streaming export of decoded sensor-data to CF NetCDF and CSV
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import csv
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import requests
+
+from lib.api_functions import fetch_sensor_data, SOFAR_API_URL
+from lib.decode import decode_to_rows
+from lib.local_store import SENSOR_DATA_COLUMNS
+from lib.quality_control import QC_FLAG_NAMES
+from lib.timestamps import parse_timestamps, API_QUERY_FORMAT
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+DEFAULT_EXPORT_WINDOW = timedelta(days=7)
+DEFAULT_OBS_CHUNK = 4096
+DEFAULT_COMPLEVEL = 4
+
+# Channel data fields exported as NetCDF variables, with their CF cell_methods
+EXPORT_FIELDS = {
+    "mean": "time: mean",
+    "min": "time: minimum",
+    "max": "time: maximum",
+    "stdev": "time: standard_deviation",
+    "sample_count": None,
+    "qc_flags": None,
+}
+
+# Units in channel names (e.g. 'Abs Speed[cm/s]') -> UDUNITS units
+CHANNEL_UNITS = {
+    "cm/s": "cm s-1",
+    "Deg.M": "degree",
+    "Deg": "degree",
+    "ºC": "degree_Celsius",
+    "dbar": "dbar",
+}
+
+# CF standard names of channel means
+STANDARD_NAMES = {
+    "Abs Speed[cm/s]": "sea_water_speed",
+    "Direction[Deg.M]": "direction_of_sea_water_velocity",
+    "North[cm/s]": "northward_sea_water_velocity",
+    "East[cm/s]": "eastward_sea_water_velocity",
+    "Temperature[ºC]": "sea_water_temperature",
+}
+
+QC_FLAGS_FILL_VALUE = 255
+
+_COLUMN = {name: i for i, name in enumerate(SENSOR_DATA_COLUMNS)}
+
+
+def channel_variable_name(channel_name):
+    """Return the NetCDF variable name prefix of a channel, e.g. 'Abs Speed[cm/s]' -> 'abs_speed'."""
+    name = re.sub(r"\[[^\]]*\]", "", channel_name)
+    return re.sub(r"[^0-9a-zA-Z]+", "_", name).strip("_").lower() or "channel"
+
+
+def channel_units(channel_name):
+    """Return the UDUNITS units of a channel, or None if its name gives none or several."""
+    units = re.findall(r"\[([^\]]*)\]", channel_name)
+    if len(units) != 1:
+        return None
+    return CHANNEL_UNITS.get(units[0])
+
+
+class CsvExporter:
+    """
+    Stream sensor_data rows to a CSV file, one row per sample and channel.
+
+    Parameters:
+    - path (str): Output file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(SENSOR_DATA_COLUMNS)
+        self.n_rows = 0
+
+    def write_rows(self, rows):
+        """Append a batch of rows ordered as lib.local_store.SENSOR_DATA_COLUMNS."""
+        self.writer.writerows(rows)
+        self.n_rows += len(rows)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NetCDFExporter:
+    """
+    Stream sensor_data rows into a CF-1.8 timeSeries NetCDF file.
+
+    Uses the CF incomplete multidimensional representation: every variable is
+    (sensor, obs), with a per-sensor 'time' auxiliary coordinate, so Spotters
+    reporting at different times stay dense. Both dimensions are unlimited and
+    variables are chunked (1, obs_chunk) and compressed, so each batch appends
+    to the end of its sensors' rows and memory stays bounded by the batch size.
+
+    Rows of each sensor must arrive in time order across batches, as produced by
+    lib.local_store.LocalStore.iter_sensor_data and iter_api_batches.
+
+    Parameters:
+    - path (str): Output file.
+    - obs_chunk (int): Chunk length along the obs dimension.
+    - complevel (int): zlib compression level, 0 to disable compression.
+    """
+
+    def __init__(self, path, obs_chunk=DEFAULT_OBS_CHUNK, complevel=DEFAULT_COMPLEVEL):
+        if netCDF4 is None:
+            raise ImportError("NetCDF export requires the netCDF4 package: pip install netCDF4")
+        self.path = path
+        self.obs_chunk = obs_chunk
+        self.complevel = complevel
+        self.dataset = netCDF4.Dataset(path, "w", format="NETCDF4")
+        self.dataset.setncatts({
+            "Conventions": "CF-1.8",
+            "featureType": "timeSeries",
+            "title": "Spotter Bristlemouth sensor-data",
+            "source": "Sofar Ocean sensor-data API",
+            "history": f"{datetime.now(timezone.utc).strftime(API_QUERY_FORMAT)} created by lib.export",
+        })
+        # variable name -> [sensors, obs] extent written so far
+        self.extents = {}
+        self.dataset.createDimension("sensor", None)
+        self.dataset.createDimension("obs", None)
+
+        sensor_id = self.dataset.createVariable("sensor_id", str, ("sensor",))
+        sensor_id.setncatts({"cf_role": "timeseries_id", "long_name": "spotter_id/sensor_key"})
+        self.dataset.createVariable("spotter_id", str, ("sensor",)).long_name = "Spotter ID"
+        self.dataset.createVariable("sensor_key", str, ("sensor",)).long_name = "Bristlemouth node id or sensorPosition"
+        self._create_variable("time", np.float64, np.nan, {
+            "standard_name": "time", "long_name": "time", "units": "milliseconds since 1970-01-01 00:00:00", "calendar": "standard",
+        })
+        self._create_variable("latitude", np.float64, np.nan, {"standard_name": "latitude", "units": "degrees_north"})
+        self._create_variable("longitude", np.float64, np.nan, {"standard_name": "longitude", "units": "degrees_east"})
+
+        # (spotter_id, sensor_key) -> [sensor index, obs written, last timestamp in ms]
+        self.sensors = {}
+        self.n_rows = 0
+
+    def _create_variable(self, name, dtype, fill_value, attributes):
+        variable = self.dataset.createVariable(
+            name, dtype, ("sensor", "obs"), fill_value=fill_value,
+            zlib=self.complevel > 0, complevel=self.complevel or 1, shuffle=True, chunksizes=(1, self.obs_chunk))
+        variable.setncatts(attributes)
+        self.extents[name] = [0, 0]
+        return variable
+
+    def _write_block(self, variable, index, lo, block):
+        variable[index, lo:lo + len(block)] = block
+        extent = self.extents[variable.name]
+        extent[0] = max(extent[0], index + 1)
+        extent[1] = max(extent[1], lo + len(block))
+
+    def _channel_variable(self, channel_name, field):
+        name = f"{channel_variable_name(channel_name)}_{field}"
+        if name in self.dataset.variables:
+            return self.dataset.variables[name]
+        attributes = {"long_name": f"{channel_name} {field}", "coordinates": "time latitude longitude"}
+        if field == "qc_flags":
+            attributes.update({
+                "flag_masks": np.array(list(QC_FLAG_NAMES), dtype=np.uint8),
+                "flag_meanings": " ".join(QC_FLAG_NAMES.values()),
+            })
+            return self._create_variable(name, np.uint8, QC_FLAGS_FILL_VALUE, attributes)
+        if field == "sample_count":
+            attributes["units"] = "1"
+        else:
+            units = channel_units(channel_name)
+            if units:
+                attributes["units"] = units
+            if EXPORT_FIELDS[field]:
+                attributes["cell_methods"] = EXPORT_FIELDS[field]
+            if field == "mean" and channel_name in STANDARD_NAMES:
+                attributes["standard_name"] = STANDARD_NAMES[channel_name]
+        return self._create_variable(name, np.float32, np.float32(np.nan), attributes)
+
+    def _sensor(self, spotter_id, key):
+        sensor = self.sensors.get((spotter_id, key))
+        if sensor is None:
+            index = len(self.sensors)
+            self.dataset.variables["sensor_id"][index] = f"{spotter_id}/{key}"
+            self.dataset.variables["spotter_id"][index] = str(spotter_id)
+            self.dataset.variables["sensor_key"][index] = str(key)
+            sensor = self.sensors[(spotter_id, key)] = [index, 0, None]
+        return sensor
+
+    def write_rows(self, rows):
+        """Append a batch of rows ordered as lib.local_store.SENSOR_DATA_COLUMNS."""
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        sensor_codes = {}
+        codes = np.fromiter(
+            (sensor_codes.setdefault(sensor, len(sensor_codes))
+             for sensor in zip(columns[_COLUMN["spotter_id"]], columns[_COLUMN["sensor_key"]])),
+            dtype=np.int64, count=len(rows))
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(sensor_codes) + 1))
+
+        timestamps = parse_timestamps(columns[_COLUMN["timestamp"]]).astype(np.int64)[order]
+        latitudes = np.array(columns[_COLUMN["latitude"]], dtype=np.float64)[order]
+        longitudes = np.array(columns[_COLUMN["longitude"]], dtype=np.float64)[order]
+        channel_names = np.array(columns[_COLUMN["channel_name"]], dtype=object)[order]
+        values = {field: np.array(columns[_COLUMN[field]], dtype=np.float64)[order] for field in EXPORT_FIELDS}
+
+        for code, (spotter_id, key) in enumerate(sensor_codes):
+            rows_slice = slice(bounds[code], bounds[code + 1])
+            self._write_sensor(self._sensor(spotter_id, key), timestamps[rows_slice], latitudes[rows_slice],
+                               longitudes[rows_slice], channel_names[rows_slice],
+                               {field: field_values[rows_slice] for field, field_values in values.items()})
+        self.n_rows += len(rows)
+
+    def _write_sensor(self, sensor, timestamps, latitudes, longitudes, channel_names, values):
+        index, n_obs, last_timestamp = sensor
+        previous = np.concatenate(([timestamps[0] if last_timestamp is None else last_timestamp], timestamps[:-1]))
+        if np.any(timestamps < previous):
+            raise ValueError(f"Rows of sensor {self.dataset.variables['sensor_id'][index]} are not in time order")
+        # Rows sharing a timestamp are channels of the same observation
+        new_obs = timestamps != previous
+        if last_timestamp is None:
+            new_obs[0] = True
+        obs = n_obs - 1 + np.cumsum(new_obs)
+        first = obs[0]
+
+        obs_rows = np.flatnonzero(np.concatenate(([True], obs[1:] != obs[:-1])))
+        for name, column in (("time", timestamps.astype(np.float64)), ("latitude", latitudes), ("longitude", longitudes)):
+            self._write_block(self.dataset.variables[name], index, first, column[obs_rows])
+
+        for channel_name in dict.fromkeys(channel_names.tolist()):
+            mask = channel_names == channel_name
+            channel_obs = obs[mask]
+            lo, hi = channel_obs[0], channel_obs[-1] + 1
+            for field, field_values in values.items():
+                channel_values = field_values[mask]
+                if np.all(np.isnan(channel_values)):
+                    continue
+                variable = self._channel_variable(channel_name, field)
+                if field == "qc_flags":
+                    block = np.full(hi - lo, QC_FLAGS_FILL_VALUE, dtype=np.uint8)
+                    block[channel_obs - lo] = np.where(np.isnan(channel_values), QC_FLAGS_FILL_VALUE, channel_values)
+                else:
+                    block = np.full(hi - lo, np.nan, dtype=np.float32)
+                    block[channel_obs - lo] = channel_values
+                self._write_block(variable, index, lo, block)
+
+        sensor[1] = obs[-1] + 1
+        sensor[2] = timestamps[-1]
+
+    def close(self):
+        # netCDF-C returns uninitialised memory, not the fill value, when reading past the extent a
+        # variable was written to along an unlimited dimension; write its fill value in the last cell
+        n_sensors = len(self.sensors)
+        n_obs = max((sensor[1] for sensor in self.sensors.values()), default=0)
+        for name, (written_sensors, written_obs) in self.extents.items():
+            if n_sensors and (written_sensors < n_sensors or written_obs < n_obs):
+                variable = self.dataset.variables[name]
+                variable[n_sensors - 1, n_obs - 1] = variable._FillValue
+        self.dataset.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+EXPORTERS = {
+    "csv": CsvExporter,
+    "netcdf": NetCDFExporter,
+}
+
+
+def exporter_for_path(path, export_format=None):
+    """Open the exporter for export_format, or guess it from the file extension (.nc or .csv)."""
+    if export_format is None:
+        export_format = "netcdf" if path.endswith((".nc", ".nc4")) else "csv"
+    return EXPORTERS[export_format](path)
+
+
+def iter_api_batches(spotter_ids, api_token, system, start_date, end_date=None, window=DEFAULT_EXPORT_WINDOW,
+                     base_url=SOFAR_API_URL):
+    """
+    Fetch, decode and QC sensor-data window by window and yield it as sensor_data rows.
+
+    Only one window of one Spotter is held in memory at a time: a window's response is
+    dropped once decoded and its rows once the consumer resumes. The API bounds are
+    inclusive, so consecutive windows both return the samples at their shared boundary;
+    rows at or before the latest timestamp already yielded for a Spotter are dropped.
+
+    Parameters:
+    - spotter_ids (list of str): Spotters to export.
+    - api_token (str): API Token.
+    - system (str): Decoder, a key of lib.decode.DECODERS.
+    - start_date, end_date (datetime): Time range, end_date defaults to now.
+    - window (timedelta): Time span fetched per request.
+
+    Yields:
+    list of tuple: Rows ordered as lib.local_store.SENSOR_DATA_COLUMNS.
+    """
+    end_date = end_date or datetime.now(timezone.utc)
+    with requests.Session() as session:
+        for spotter_id in spotter_ids:
+            window_start = start_date
+            last_timestamp = None
+            while window_start < end_date:
+                window_end = min(window_start + window, end_date)
+                rows = _fetch_window_rows(spotter_id, api_token, system, window_start, window_end, base_url, session)
+                if rows:
+                    timestamps = parse_timestamps([row[_COLUMN["timestamp"]] for row in rows])
+                    if last_timestamp is not None:
+                        rows = [rows[i] for i in np.flatnonzero(timestamps > last_timestamp).tolist()]
+                    last_timestamp = max(timestamps.max(), last_timestamp) if last_timestamp is not None else timestamps.max()
+                    timestamps = None
+                logging.info(f"Exporting {len(rows)} rows for {spotter_id} from {window_start} to {window_end}")
+                if rows:
+                    yield rows
+                rows = None
+                window_start = window_end
+
+
+def _fetch_window_rows(spotter_id, api_token, system, window_start, window_end, base_url, session):
+    """Fetch and decode one window into sensor_data rows; the response is released on return."""
+    api_response = fetch_sensor_data(
+        spotter_id, api_token, window_start.astimezone(timezone.utc).strftime(API_QUERY_FORMAT),
+        window_end.astimezone(timezone.utc).strftime(API_QUERY_FORMAT), base_url=base_url, session=session)
+    rows, _, _ = decode_to_rows(spotter_id, system, api_response)
+    return rows
+
+
+def export_batches(batches, exporter):
+    """Write every batch of rows to exporter and close it. Returns the number of rows written."""
+    with exporter:
+        for rows in batches:
+            exporter.write_rows(rows)
+    return exporter.n_rows
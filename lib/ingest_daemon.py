@@ -0,0 +1,244 @@
+# -------------------------------------------------------------------------------
+# Name:        ingest_daemon.py
+# Purpose:     Long-running asyncio service polling a fleet of Spotters into a local store
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import asyncio
+import logging
+import random
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from lib.api_functions import fetch_sensor_data, SOFAR_API_URL
+from lib.decode import decode_to_rows, DECODERS
+from lib.local_store import LocalStore
+from lib.timestamps import max_timestamp, parse_timestamp, API_QUERY_FORMAT
+
+# Configure logging (this is a basic configuration, adjust as needed)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_POLL_INTERVAL = timedelta(minutes=30)
+DEFAULT_INITIAL_LOOKBACK = timedelta(days=1)
+DEFAULT_FETCH_CONCURRENCY = 16
+DEFAULT_MAX_PENDING_BATCHES = 64
+DEFAULT_WRITE_BATCH_ROWS = 5000
+DEFAULT_FLUSH_INTERVAL = timedelta(seconds=5)
+
+_thread_local = threading.local()
+
+
+def _session():
+    """Return a requests.Session owned by the calling fetch thread."""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def _fetch(spotter_id, api_token, start_date, base_url):
+    return fetch_sensor_data(spotter_id, api_token, start_date, None, base_url=base_url, session=_session())
+
+
+def api_start_date(timestamp):
+    """Convert a stored API timestamp (e.g. 2024-01-21T20:20:08.000Z) to the second resolution the API accepts."""
+    return parse_timestamp(timestamp).strftime(API_QUERY_FORMAT)
+
+
+class IngestDaemon:
+    """
+    Poll the sensor-data API for a fleet of Spotters and batch-write decoded data to a LocalStore.
+
+    Each Spotter gets its own poller task. Fetches run in a thread pool (bounded by
+    fetch_concurrency) and decoding runs in a process pool, so the event loop only
+    schedules work. Decoded batches go through a bounded queue to a single writer;
+    when the writer falls behind the queue fills and pollers wait before fetching again.
+    A Spotter's poll cursor only advances once its batch is committed, and if the writer
+    itself fails the pollers are cancelled and run() raises its error.
+
+    Parameters:
+    - spotters (list of tuple): (spotter_id, system) pairs, where system is a key of lib.decode.DECODERS.
+    - api_token (str): Sofar API token.
+    - store_path (str): Path of the SQLite database.
+    - poll_interval (timedelta): Time between polls of the same Spotter.
+    - initial_lookback (timedelta): How far back to fetch for a Spotter with no ingested data.
+    - fetch_concurrency (int): Maximum number of API requests in flight.
+    - workers (int): Number of decode processes, defaults to the CPU count.
+    - max_pending_batches (int): Size of the queue between decoders and the writer.
+    - write_batch_rows (int): Number of rows the writer accumulates before committing.
+    - flush_interval (timedelta): Maximum time a decoded row waits before being committed.
+    - base_url (str): sensor-data endpoint, point at a local mock server for testing.
+    """
+
+    def __init__(self, spotters, api_token, store_path,
+                 poll_interval=DEFAULT_POLL_INTERVAL,
+                 initial_lookback=DEFAULT_INITIAL_LOOKBACK,
+                 fetch_concurrency=DEFAULT_FETCH_CONCURRENCY,
+                 workers=None,
+                 max_pending_batches=DEFAULT_MAX_PENDING_BATCHES,
+                 write_batch_rows=DEFAULT_WRITE_BATCH_ROWS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 base_url=SOFAR_API_URL):
+        for spotter_id, system in spotters:
+            if system not in DECODERS:
+                raise ValueError(f"Unknown system '{system}' for spotter {spotter_id}. Must be one of {list(DECODERS)}.")
+        self.spotters = list(spotters)
+        self.api_token = api_token
+        self.store_path = store_path
+        self.poll_interval = poll_interval
+        self.initial_lookback = initial_lookback
+        self.fetch_concurrency = fetch_concurrency
+        self.workers = workers
+        self.max_pending_batches = max_pending_batches
+        self.write_batch_rows = write_batch_rows
+        self.flush_interval = flush_interval
+        self.base_url = base_url
+
+        self._stop = None
+        self._queue = None
+        self._last_timestamps = {}
+
+    def request_shutdown(self):
+        """Stop polling, then drain pending batches into the store before run() returns."""
+        if self._stop is not None:
+            self._stop.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._queue = asyncio.Queue(maxsize=self.max_pending_batches)
+
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, self.request_shutdown)
+
+        # The store connection lives on a single dedicated thread so commits never block the loop.
+        store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="store")
+        fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_concurrency, thread_name_prefix="fetch")
+        decode_executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            store = await loop.run_in_executor(store_executor, LocalStore, self.store_path, False)
+            self._last_timestamps = await loop.run_in_executor(store_executor, store.get_poll_state)
+
+            writer = asyncio.create_task(self._write_batches(store, store_executor))
+            pollers = [
+                asyncio.create_task(self._poll_spotter(spotter_id, system, fetch_executor, decode_executor))
+                for spotter_id, system in self.spotters
+            ]
+            logging.info(f"Ingesting {len(pollers)} spotters into {self.store_path}")
+
+            # The writer only returns after the pollers are done. If it stops first it has failed, and
+            # the pollers would block forever on the full queue, so cancel them and raise its error.
+            polling = asyncio.gather(*pollers)
+            if await self._until_writer_done(polling, writer):
+                await self._until_writer_done(self._queue.put(None), writer)
+            else:
+                polling.cancel()
+                await asyncio.gather(polling, return_exceptions=True)
+            try:
+                await writer
+            except Exception as e:
+                logging.error(f"Writer to {self.store_path} failed, stopped polling: {e}")
+                raise
+            finally:
+                await loop.run_in_executor(store_executor, store.close)
+        finally:
+            if threading.current_thread() is threading.main_thread():
+                for sig in (signal.SIGINT, signal.SIGTERM):
+                    loop.remove_signal_handler(sig)
+            fetch_executor.shutdown(wait=True)
+            decode_executor.shutdown(wait=True)
+            store_executor.shutdown(wait=True)
+        logging.info("Ingest daemon stopped")
+
+    async def _until_writer_done(self, awaitable, writer):
+        """Await awaitable unless the writer task finishes first. Returns True if awaitable completed."""
+        task = asyncio.ensure_future(awaitable)
+        await asyncio.wait([task, writer], return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            task.result()
+            return True
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return False
+
+    async def _poll_spotter(self, spotter_id, system, fetch_executor, decode_executor):
+        loop = asyncio.get_running_loop()
+        # Spread the first polls over the interval so a large fleet does not hit the API at once.
+        if await self._sleep(random.uniform(0, self.poll_interval.total_seconds())):
+            return
+
+        while not self._stop.is_set():
+            last_timestamp = self._last_timestamps.get(spotter_id)
+            if last_timestamp:
+                start_date = api_start_date(last_timestamp)
+            else:
+                start_date = (datetime.now(timezone.utc) - self.initial_lookback).strftime(API_QUERY_FORMAT)
+
+            try:
+                api_response = await loop.run_in_executor(
+                    fetch_executor, _fetch, spotter_id, self.api_token, start_date, self.base_url)
+                rows, latest_timestamp, topology_entries = await loop.run_in_executor(
+                    decode_executor, decode_to_rows, spotter_id, system, api_response)
+            except Exception as e:
+                logging.error(f"Failed to ingest spotter {spotter_id}: {e}")
+            else:
+                if latest_timestamp:
+                    # Blocks while the writer is behind, which throttles further fetches. The writer
+                    # advances the poll cursor once the batch is committed.
+                    await self._queue.put((spotter_id, rows, latest_timestamp, topology_entries))
+
+            if await self._sleep(self.poll_interval.total_seconds()):
+                return
+
+    async def _sleep(self, seconds):
+        """Sleep unless shutdown is requested first. Returns True if shutting down."""
+        try:
+            await asyncio.wait_for(self._stop.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _write_batches(self, store, store_executor):
+        loop = asyncio.get_running_loop()
+        rows = []
+        last_timestamps = {}
+        topology_entries = {}
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval.total_seconds())
+            except asyncio.TimeoutError:
+                item = False
+
+            if item is None:
+                done = True
+            elif item:
+                spotter_id, batch_rows, latest_timestamp, batch_topology = item
+                rows.extend(batch_rows)
+                topology_entries.setdefault(spotter_id, []).extend(batch_topology)
+                last_timestamps[spotter_id] = max_timestamp([latest_timestamp, last_timestamps.get(spotter_id)])
+                if len(rows) < self.write_batch_rows:
+                    continue
+
+            if rows or last_timestamps:
+                try:
+                    await loop.run_in_executor(store_executor, store.write_batch, rows, last_timestamps, topology_entries)
+                    logging.info(f"Wrote {len(rows)} rows for {len(last_timestamps)} spotters")
+                except Exception as e:
+                    # The poll cursor is left where it was, so the lost range is fetched again next cycle.
+                    logging.error(f"Failed to write batch to {self.store_path}: {e}", exc_info=True)
+                else:
+                    for spotter_id, latest_timestamp in last_timestamps.items():
+                        self._last_timestamps[spotter_id] = max_timestamp(
+                            [latest_timestamp, self._last_timestamps.get(spotter_id)])
+                rows = []
+                last_timestamps = {}
+                topology_entries = {}
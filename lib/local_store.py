@@ -0,0 +1,433 @@
+# -------------------------------------------------------------------------------
+# Name:        local_store.py
+# Purpose:     Local SQLite time-series store for decoded sensor-data
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import sqlite3
+
+import numpy as np
+
+from lib.segments import segment_bounds, DEFAULT_GAP_THRESHOLD
+from lib.spatial_query import PositionIndex, DEFAULT_CELL_SIZE_DEG
+from lib.timestamps import max_timestamp, text_bounds, timestamp_ms, to_datetime64
+from lib.topology import sensor_key
+
+SENSOR_DATA_COLUMNS = (
+    "spotter_id",
+    "sensor_key",
+    "timestamp",
+    "sensor_position",
+    "bristlemouth_node_id",
+    "latitude",
+    "longitude",
+    "channel_name",
+    "sample_count",
+    "mean",
+    "min",
+    "max",
+    "stdev",
+    "qc_flags",
+)
+
+DEFAULT_READ_BATCH_ROWS = 50000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sensor_data (
+    spotter_id TEXT NOT NULL,
+    sensor_key TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    sensor_position INTEGER,
+    bristlemouth_node_id TEXT,
+    latitude REAL,
+    longitude REAL,
+    channel_name TEXT NOT NULL,
+    sample_count REAL,
+    mean REAL,
+    min REAL,
+    max REAL,
+    stdev REAL,
+    qc_flags INTEGER,
+    PRIMARY KEY (spotter_id, sensor_key, channel_name, timestamp)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS segments (
+    spotter_id TEXT NOT NULL,
+    sensor_key TEXT NOT NULL,
+    start_timestamp TEXT NOT NULL,
+    end_timestamp TEXT NOT NULL,
+    n_samples INTEGER NOT NULL,
+    PRIMARY KEY (spotter_id, sensor_key, start_timestamp)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS topology (
+    spotter_id TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    bristlemouth_node_id TEXT,
+    sensor_position INTEGER,
+    sensor_type TEXT NOT NULL,
+    valid_from TEXT NOT NULL,
+    valid_to TEXT NOT NULL,
+    PRIMARY KEY (spotter_id, slot, valid_from)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS poll_state (
+    spotter_id TEXT PRIMARY KEY,
+    last_timestamp TEXT NOT NULL
+);
+"""
+
+
+def flatten_decoded_data(spotter_id, data):
+    """
+    Flatten decoded sensor-data into rows for the sensor_data table.
+
+    Parameters:
+    - spotter_id (str): Spotter the data was retrieved for.
+    - data (list of dict): payloads with 'decoded_value's.
+    -- see lib.api_functions.decode_sensor_data and lib.api_functions.decode_beta2_data
+
+    Returns:
+    list of tuple: One row per payload and channel, ordered as SENSOR_DATA_COLUMNS.
+    """
+    rows = []
+    for payload in data:
+        decoded_value = payload.get('decoded_value')
+        if not decoded_value:
+            continue
+        key = sensor_key(payload)
+        for channel in decoded_value:
+            channel_stats = channel['data']
+            rows.append((
+                spotter_id,
+                key,
+                payload['timestamp'],
+                payload.get('sensorPosition'),
+                payload.get('bristlemouth_node_id'),
+                payload.get('latitude'),
+                payload.get('longitude'),
+                channel['channel_name'],
+                channel_stats.get('sample_count'),
+                channel_stats.get('mean'),
+                channel_stats.get('min'),
+                channel_stats.get('max'),
+                channel_stats.get('stdev'),
+                channel_stats.get('qc_flags'),
+            ))
+    return rows
+
+
+def _later_timestamp(timestamp, other):
+    return max_timestamp([timestamp, other])
+
+
+def time_range_condition(start_date=None, end_date=None, column="timestamp"):
+    """
+    SQL condition and parameters keeping rows whose column lies between inclusive time bounds.
+
+    Timestamps are stored as the API returns them, with or without fractional seconds,
+    so the bounds are compared as parsed times (the timestamp_ms function of a LocalStore
+    connection), behind a text pre-filter that lets SQLite skip most rows without calling it.
+
+    Parameters:
+    - start_date, end_date: Optional bounds, ISO-8601 strings, datetimes or datetime64.
+    - column (str): Timestamp column.
+
+    Returns:
+    tuple: (condition, params), condition being '' or starting with ' AND '.
+    """
+    start, end = to_datetime64(start_date), to_datetime64(end_date)
+    lower, upper = text_bounds(start, end)
+    condition = ""
+    params = []
+    if start is not None:
+        condition += f" AND {column} >= ? AND timestamp_ms({column}) >= ?"
+        params += [lower, int(start.astype(np.int64))]
+    if end is not None:
+        condition += f" AND {column} < ? AND timestamp_ms({column}) <= ?"
+        params += [upper, int(end.astype(np.int64))]
+    return condition, params
+
+
+class LocalStore:
+    """
+    SQLite backed store of decoded sensor-data.
+
+    The database runs in WAL mode so readers (plotting, exports) are not blocked
+    while the ingest daemon is writing. Rows are keyed by spotter, sensor, channel
+    and timestamp, so re-ingesting an overlapping time range is idempotent.
+    Each write also updates the segments table, the contiguous runs of every sensor
+    split at gaps longer than gap_threshold, see lib.segments.
+
+    Timestamps are kept as the API returns them and compared as parsed times through
+    the timestamp_ms and later_timestamp SQL functions, see lib.timestamps.
+    """
+
+    def __init__(self, path, check_same_thread=True, gap_threshold=DEFAULT_GAP_THRESHOLD):
+        self.path = path
+        self.gap_threshold = gap_threshold
+        self.connection = sqlite3.connect(path, check_same_thread=check_same_thread)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.create_function("timestamp_ms", 1, timestamp_ms, deterministic=True)
+        self.connection.create_function("later_timestamp", 2, _later_timestamp, deterministic=True)
+        self.connection.executescript(SCHEMA)
+        self._committed_batches = 0
+        # cell_size_deg -> (ingest watermark, PositionIndex)
+        self._position_indexes = {}
+
+    def write_rows(self, rows):
+        """Insert or replace a batch of sensor_data rows in a single transaction."""
+        self.write_batch(rows, {})
+
+    def write_batch(self, rows, last_timestamps, topology_entries=None):
+        """
+        Write a batch of rows, update the segments of the sensors it covers and advance
+        the poll state of its spotters in a single transaction.
+
+        Parameters:
+        - rows (list of tuple): sensor_data rows, see flatten_decoded_data.
+        - last_timestamps (dict): spotter_id -> latest timestamp contained in the batch.
+        - topology_entries (dict): spotter_id -> SensorTopology entries seen in the batch, see lib.topology.
+        """
+        placeholders = ", ".join("?" for _ in SENSOR_DATA_COLUMNS)
+        with self.connection:
+            new_samples = self._new_sample_timestamps(rows)
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO sensor_data ({', '.join(SENSOR_DATA_COLUMNS)}) VALUES ({placeholders})",
+                rows
+            )
+            self.connection.executemany(
+                "INSERT INTO poll_state (spotter_id, last_timestamp) VALUES (?, ?) "
+                "ON CONFLICT(spotter_id) DO UPDATE SET last_timestamp = later_timestamp(last_timestamp, excluded.last_timestamp)",
+                list(last_timestamps.items())
+            )
+            for (spotter_id, key), timestamps in new_samples.items():
+                self._update_segments(spotter_id, key, timestamps)
+            for spotter_id, entries in (topology_entries or {}).items():
+                for entry in entries:
+                    self._update_topology(spotter_id, entry)
+        self._committed_batches += 1
+
+    def _update_topology(self, spotter_id, entry):
+        """Extend the latest topology entry of the slot if the same sensor is still there, otherwise start a new one."""
+        latest = self.connection.execute(
+            "SELECT bristlemouth_node_id, sensor_type, valid_from, valid_to FROM topology "
+            "WHERE spotter_id = ? AND slot = ? ORDER BY timestamp_ms(valid_to) DESC LIMIT 1",
+            (spotter_id, entry['slot'])
+        ).fetchone()
+        node_id = None if entry['bristlemouth_node_id'] is None else str(entry['bristlemouth_node_id'])
+        if latest is not None and latest[0] == node_id and latest[1] == entry['sensor_type']:
+            self.connection.execute(
+                "UPDATE topology SET valid_to = later_timestamp(valid_to, ?) WHERE spotter_id = ? AND slot = ? AND valid_from = ?",
+                (entry['valid_to'], spotter_id, entry['slot'], latest[2])
+            )
+        else:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO topology (spotter_id, slot, bristlemouth_node_id, sensor_position, sensor_type, valid_from, valid_to) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (spotter_id, entry['slot'], node_id, entry['sensorPosition'], entry['sensor_type'], entry['valid_from'], entry['valid_to'])
+            )
+
+    def read_topology(self, spotter_id):
+        """Return the stored topology entries of a spotter in time order, see lib.topology.SensorTopology."""
+        rows = self.connection.execute(
+            "SELECT slot, bristlemouth_node_id, sensor_position, sensor_type, valid_from, valid_to FROM topology "
+            "WHERE spotter_id = ? ORDER BY timestamp_ms(valid_from)", (spotter_id,)
+        ).fetchall()
+        return [
+            {'slot': slot, 'bristlemouth_node_id': node_id, 'sensorPosition': sensor_position,
+             'sensor_type': sensor_type, 'valid_from': valid_from, 'valid_to': valid_to}
+            for slot, node_id, sensor_position, sensor_type, valid_from, valid_to in rows
+        ]
+
+    def _tail_segment(self, spotter_id, key):
+        """Return the (start_timestamp, end_timestamp, n_samples) of a sensor's latest segment, or None."""
+        return self.connection.execute(
+            "SELECT start_timestamp, end_timestamp, n_samples FROM segments WHERE spotter_id = ? AND sensor_key = ? "
+            "ORDER BY timestamp_ms(start_timestamp) DESC LIMIT 1",
+            (spotter_id, key)
+        ).fetchone()
+
+    def _new_sample_timestamps(self, rows):
+        """
+        Return (spotter_id, sensor_key) -> sorted timestamps of the samples in rows that are not stored yet.
+
+        Samples after a sensor's latest segment are new by definition; earlier ones, like the
+        sample at the poll boundary that every poll fetches again, are looked up by primary key.
+        """
+        samples = {}
+        for row in rows:
+            samples.setdefault((row[0], row[1]), {}).setdefault(row[2], set()).add(row[7])
+        new_samples = {}
+        for (spotter_id, key), channel_names in samples.items():
+            tail = self._tail_segment(spotter_id, key)
+            tail_end = timestamp_ms(tail[1]) if tail is not None else None
+            new_samples[(spotter_id, key)] = sorted(
+                (timestamp for timestamp, names in channel_names.items()
+                 if tail is None or timestamp_ms(timestamp) > tail_end or not self._sample_stored(spotter_id, key, timestamp, names)),
+                key=timestamp_ms
+            )
+        return new_samples
+
+    def _sample_stored(self, spotter_id, key, timestamp, channel_names):
+        """Whether any of the channels of a sample is stored, looked up by primary key."""
+        return any(self.connection.execute(
+            "SELECT 1 FROM sensor_data WHERE spotter_id = ? AND sensor_key = ? AND channel_name = ? AND timestamp = ?",
+            (spotter_id, key, channel_name, timestamp)
+        ).fetchone() for channel_name in channel_names)
+
+    def _update_segments(self, spotter_id, key, timestamps):
+        """
+        Add newly stored samples to the segments of a sensor.
+
+        Samples after the latest segment extend it or start new segments, without reading
+        the sensor's history. A late sample inside an existing segment only adds to its count;
+        one landing in a gap recomputes the segments from the segment before it.
+
+        Parameters:
+        - timestamps (list of str): Sorted timestamps of samples that were not stored before.
+        """
+        if not timestamps:
+            return
+        tail = self._tail_segment(spotter_id, key)
+        if tail is None:
+            self._insert_segments(spotter_id, key, segment_bounds(timestamps, self.gap_threshold))
+            return
+        tail_start, tail_end, _ = tail
+        tail_end_ms = timestamp_ms(tail_end)
+        for timestamp in timestamps:
+            if timestamp_ms(timestamp) > tail_end_ms:
+                break
+            segment = self.connection.execute(
+                "SELECT start_timestamp, end_timestamp FROM segments WHERE spotter_id = ? AND sensor_key = ? "
+                "AND timestamp_ms(start_timestamp) <= ? ORDER BY timestamp_ms(start_timestamp) DESC LIMIT 1",
+                (spotter_id, key, timestamp_ms(timestamp))
+            ).fetchone()
+            if segment is None or timestamp_ms(timestamp) > timestamp_ms(segment[1]):
+                self._rebuild_segments(spotter_id, key, segment[0] if segment else None)
+                return
+            self.connection.execute(
+                "UPDATE segments SET n_samples = n_samples + 1 WHERE spotter_id = ? AND sensor_key = ? AND start_timestamp = ?",
+                (spotter_id, key, segment[0])
+            )
+        timestamps = [timestamp for timestamp in timestamps if timestamp_ms(timestamp) > tail_end_ms]
+        if not timestamps:
+            return
+        bounds = segment_bounds([tail_end] + timestamps, self.gap_threshold)
+        _, end_timestamp, n_samples = bounds[0]
+        self.connection.execute(
+            "UPDATE segments SET end_timestamp = ?, n_samples = n_samples + ? WHERE spotter_id = ? AND sensor_key = ? AND start_timestamp = ?",
+            (end_timestamp, n_samples - 1, spotter_id, key, tail_start)
+        )
+        self._insert_segments(spotter_id, key, bounds[1:])
+
+    def _rebuild_segments(self, spotter_id, key, resume):
+        """Recompute the segments of a sensor from the stored samples at or after resume (None for all of them)."""
+        resume_ms = timestamp_ms(resume) if resume is not None else None
+        timestamps = [timestamp for (timestamp,) in self.connection.execute(
+            "SELECT DISTINCT timestamp FROM sensor_data WHERE spotter_id = ? AND sensor_key = ? "
+            "AND (? IS NULL OR timestamp_ms(timestamp) >= ?) ORDER BY timestamp_ms(timestamp)",
+            (spotter_id, key, resume_ms, resume_ms)
+        )]
+        self.connection.execute(
+            "DELETE FROM segments WHERE spotter_id = ? AND sensor_key = ? AND (? IS NULL OR timestamp_ms(start_timestamp) >= ?)",
+            (spotter_id, key, resume_ms, resume_ms)
+        )
+        self._insert_segments(spotter_id, key, segment_bounds(timestamps, self.gap_threshold))
+
+    def _insert_segments(self, spotter_id, key, bounds):
+        self.connection.executemany(
+            "INSERT INTO segments (spotter_id, sensor_key, start_timestamp, end_timestamp, n_samples) VALUES (?, ?, ?, ?, ?)",
+            [(spotter_id, key) + tuple(segment) for segment in bounds]
+        )
+
+    def read_positions(self, start_date=None, end_date=None):
+        """Return distinct (spotter_id, sensor_key, timestamp, latitude, longitude) rows of every archived sample."""
+        condition, params = time_range_condition(start_date, end_date)
+        query = ("SELECT spotter_id, sensor_key, timestamp, latitude, longitude FROM sensor_data WHERE latitude IS NOT NULL"
+                 f"{condition} GROUP BY spotter_id, sensor_key, timestamp")
+        return self.connection.execute(query, params).fetchall()
+
+    def ingest_watermark(self):
+        """
+        Return a marker that changes whenever a batch is committed to the store, through
+        this LocalStore or another connection (e.g. the ingest daemon in another process).
+        """
+        data_version, = self.connection.execute("PRAGMA data_version").fetchone()
+        return data_version, self._committed_batches
+
+    def get_position_index(self, cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        """
+        Return a lib.spatial_query.PositionIndex of every archived position.
+
+        The index is cached and only rebuilt once the ingest watermark moved, so repeated
+        queries against an unchanged store skip the full position scan. Query time ranges
+        with the index's start_date / end_date arguments.
+        """
+        watermark = self.ingest_watermark()
+        cached = self._position_indexes.get(cell_size_deg)
+        if cached is None or cached[0] != watermark:
+            cached = self._position_indexes[cell_size_deg] = (
+                watermark, PositionIndex.from_store(self, cell_size_deg=cell_size_deg))
+        return cached[1]
+
+    def read_segments(self, spotter_id, sensor_key=None):
+        """Return (sensor_key, start_timestamp, end_timestamp, n_samples) rows of a spotter's segments in time order."""
+        query = "SELECT sensor_key, start_timestamp, end_timestamp, n_samples FROM segments WHERE spotter_id = ?"
+        params = [spotter_id]
+        if sensor_key is not None:
+            query += " AND sensor_key = ?"
+            params.append(sensor_key)
+        query += " ORDER BY sensor_key, timestamp_ms(start_timestamp)"
+        return self.connection.execute(query, params).fetchall()
+
+    def get_poll_state(self):
+        """Return a dict of spotter_id -> last ingested timestamp."""
+        return dict(self.connection.execute("SELECT spotter_id, last_timestamp FROM poll_state"))
+
+    def read_sensor_data(self, spotter_id, start_date=None, end_date=None):
+        """
+        Return sensor_data rows for a spotter ordered by sensor, channel and time,
+        between optional inclusive bounds (ISO-8601 strings, datetimes or datetime64).
+        """
+        condition, time_params = time_range_condition(start_date, end_date)
+        query = (f"SELECT {', '.join(SENSOR_DATA_COLUMNS)} FROM sensor_data WHERE spotter_id = ?{condition} "
+                 "ORDER BY sensor_key, channel_name, timestamp_ms(timestamp)")
+        return self.connection.execute(query, [spotter_id] + time_params).fetchall()
+
+    def iter_sensor_data(self, spotter_ids=None, start_date=None, end_date=None, batch_rows=DEFAULT_READ_BATCH_ROWS):
+        """
+        Stream sensor_data rows in batches of at most batch_rows, without loading the whole range.
+
+        Rows are ordered by spotter, sensor and timestamp, the channels of a sample kept together,
+        see lib.export.
+
+        Parameters:
+        - spotter_ids (list of str): Spotters to read, defaults to every archived spotter.
+        - start_date, end_date: Optional inclusive time bounds, ISO-8601 strings, datetimes or datetime64.
+        - batch_rows (int): Rows per yielded batch.
+
+        Yields:
+        list of tuple: Rows ordered as SENSOR_DATA_COLUMNS.
+        """
+        if spotter_ids is None:
+            spotter_ids = [spotter_id for spotter_id, in self.connection.execute(
+                "SELECT DISTINCT spotter_id FROM sensor_data ORDER BY spotter_id")]
+        condition, time_params = time_range_condition(start_date, end_date)
+        query = (f"SELECT {', '.join(SENSOR_DATA_COLUMNS)} FROM sensor_data WHERE spotter_id = ?{condition} "
+                 "ORDER BY sensor_key, timestamp_ms(timestamp), channel_name")
+        for spotter_id in spotter_ids:
+            cursor = self.connection.execute(query, [spotter_id] + time_params)
+            while True:
+                rows = cursor.fetchmany(batch_rows)
+                if not rows:
+                    break
+                yield rows
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,363 @@
+# -------------------------------------------------------------------------------
+# Name:        overview_plot.py
+# Purpose:     Single-figure overview of many sensors from per-pixel aggregates
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from datetime import timedelta
+
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+
+from lib.plotting_functions import (
+    channels_from_topology,
+    group_by_node_id,
+    group_by_sensor_position,
+    plot_sensor_figure,
+    PLOT_WINDOW_HSIZE,
+    PLOT_WINDOW_VSIZE,
+)
+from lib.quality_control import sensor_channel_arrays
+from lib.script_functions import OVERVIEW_LAYOUTS
+from lib.segments import SegmentTable, DEFAULT_GAP_THRESHOLD, get_segment_tables
+
+# Fraction of the overview time span shown by the detail figure opened on click
+DETAIL_WINDOW_FRACTION = 0.05
+
+# Sensors per 'grid' figure, more sensors are paged over several figures
+MAX_GRID_COLUMNS = 6
+
+
+def pixel_envelope(timestamps, values, start, end, n_bins, gap_threshold_duration=DEFAULT_GAP_THRESHOLD):
+    """
+    Aggregate samples into n_bins equal time bins (one per horizontal pixel) between start and end.
+
+    Parameters:
+    - timestamps (np.ndarray): datetime64 sample times, ascending.
+    - values (np.ndarray): float sample values, NaN samples are ignored.
+    - start, end (np.datetime64): Time span of the plot.
+    - n_bins (int): Number of bins, typically the axes width in pixels.
+    - gap_threshold_duration (timedelta): Consecutive non-empty bins further apart than this are separated by NaN.
+
+    Returns:
+    dict: 'time' (datetime64[ms] mean sample time of each non-empty bin), float64 'min', 'mean', 'max'
+          and int64 'count' arrays, of at most n_bins (plus gap breaks) entries whatever the number of samples.
+    """
+    times = np.asarray(timestamps, dtype='datetime64[ms]').astype(np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    keep = ~np.isnan(values)
+    times, values = times[keep], values[keep]
+    if not len(times):
+        return {"time": np.empty(0, dtype='datetime64[ms]'), "min": np.empty(0), "mean": np.empty(0),
+                "max": np.empty(0), "count": np.empty(0, dtype=np.int64)}
+
+    start = np.datetime64(start, 'ms').astype(np.int64)
+    span = max(1, np.datetime64(end, 'ms').astype(np.int64) - start + 1)
+    bins = np.clip((times - start) * n_bins // span, 0, n_bins - 1)
+    starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    count = np.diff(np.append(starts, len(bins)))
+    envelope = {
+        "time": np.add.reduceat(times, starts) // count,
+        "min": np.minimum.reduceat(values, starts),
+        "mean": np.add.reduceat(values, starts) / count,
+        "max": np.maximum.reduceat(values, starts),
+        "count": count,
+    }
+
+    # Break lines across gaps, like lib.plotting_functions.extract_channel_data, but only where
+    # a bin is empty: bins wider than the threshold would otherwise break between every pixel
+    threshold = np.timedelta64(gap_threshold_duration).astype('timedelta64[ms]').astype(np.int64)
+    breaks = np.flatnonzero((np.diff(envelope["time"]) > threshold) & (np.diff(bins[starts]) > 1)) + 1
+    for key in ("min", "mean", "max"):
+        envelope[key] = np.insert(envelope[key], breaks, np.nan)
+    envelope["count"] = np.insert(envelope["count"], breaks, 0)
+    envelope["time"] = np.insert(envelope["time"], breaks, envelope["time"][breaks - 1]).astype('datetime64[ms]')
+    return envelope
+
+
+class OverviewPlot:
+    """
+    One figure summarizing every sensor of a dataset.
+
+    Each channel of each sensor is reduced to a min / mean / max envelope per horizontal
+    pixel of its axes before anything is drawn, so the number of plotted points depends on
+    the axes width, not on the length of the time span. Zooming, panning or resizing
+    recomputes the envelopes of the visible span from the gathered samples. The 'shared'
+    layout overlays all sensors on one axes per channel; the 'grid' layout draws small
+    multiples with a row per channel and a column per sensor, at most MAX_GRID_COLUMNS
+    sensors per figure. Clicking a point opens the full detail figure of that sensor
+    (see lib.plotting_functions.plot_sensor_figure) for a window around the clicked time;
+    only that window's samples are plotted.
+
+    Parameters:
+    - grouped_data (dict): Data grouped by node ID or sensor position, see lib.plotting_functions.group_by_node_id.
+    - channel_names (list): Channels to plot, or a dict of group key -> channels.
+    - layout (str): 'shared' or 'grid'.
+    - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - plot_min_max (bool): Passed to the detail figures.
+    - qc_mask (int): QC flag bits of samples to leave out of the envelopes.
+    - plot_flagged (bool): Mark flagged samples in the detail figures.
+    - segment_tables (dict): Precomputed SegmentTable per group key, see lib.segments.get_segment_tables.
+    """
+
+    def __init__(self, grouped_data, channel_names, layout='shared', gap_threshold_duration=DEFAULT_GAP_THRESHOLD,
+                 plot_min_max=True, qc_mask=0, plot_flagged=False, segment_tables=None):
+        if layout not in OVERVIEW_LAYOUTS:
+            raise ValueError(f"Unknown overview layout '{layout}'. Must be one of {OVERVIEW_LAYOUTS}.")
+        self.layout = layout
+        self.gap_threshold_duration = gap_threshold_duration
+        self.plot_min_max = plot_min_max
+        self.qc_mask = qc_mask
+        self.plot_flagged = plot_flagged
+
+        channel_names_by_sensor = channel_names if isinstance(channel_names, dict) else None
+        self.sensors = {}
+        for sensor_key, data_group in grouped_data.items():
+            sensor_channels = channel_names_by_sensor.get(sensor_key) if channel_names_by_sensor is not None else channel_names
+            if not sensor_channels or not any(payload.get('decoded_value') for payload in data_group):
+                continue
+            segments = (segment_tables or {}).get(sensor_key)
+            if segments is None or len(segments) != len(data_group):
+                segments = SegmentTable.from_payloads(data_group)
+            self.sensors[sensor_key] = {"data": data_group, "channels": list(sensor_channels), "segments": segments}
+        self.channel_names = list(dict.fromkeys(
+            channel_name for sensor in self.sensors.values() for channel_name in sensor["channels"]))
+
+        self.figures = []
+        self.axes = {}
+        self.series = {}
+        self.envelopes = {}
+        self.detail_figures = []
+        self._artists = {}
+        self._views = {}
+
+    def _time_span(self):
+        starts = [sensor["segments"].timestamps[0] for sensor in self.sensors.values() if len(sensor["segments"])]
+        ends = [sensor["segments"].timestamps[-1] for sensor in self.sensors.values() if len(sensor["segments"])]
+        return min(starts), max(ends)
+
+    def _channel_values(self, sensor, arrays):
+        values = arrays["mean"]
+        if self.qc_mask and len(values):
+            flags = np.array([channel_stats.get('qc_flags', 0) for channel_stats in arrays["stats"]], dtype=np.int64)
+            values = np.where(flags & self.qc_mask, np.nan, values)
+        return sensor["segments"].timestamps[arrays["index"]], values
+
+    def channel_series(self):
+        """
+        Gather the (timestamps, values) of every (channel, sensor) once, so envelopes can be
+        recomputed on zoom without scanning the payloads again.
+        """
+        if not self.series:
+            for sensor_key, sensor in self.sensors.items():
+                gathered = sensor_channel_arrays(sensor["data"], sensor["channels"])
+                for channel_name in sensor["channels"]:
+                    if channel_name in gathered:
+                        self.series[(channel_name, sensor_key)] = self._channel_values(sensor, gathered[channel_name])
+        return self.series
+
+    def compute_envelope(self, channel_name, sensor_key, start, end, n_bins):
+        """Envelope of one (channel, sensor) between start and end in n_bins bins, None if the sensor lacks the channel."""
+        series = self.channel_series().get((channel_name, sensor_key))
+        if series is None:
+            return None
+        timestamps, values = series
+        lo = np.searchsorted(timestamps, start, 'left')
+        hi = np.searchsorted(timestamps, end, 'right')
+        envelope = pixel_envelope(timestamps[lo:hi], values[lo:hi], start, end, n_bins, self.gap_threshold_duration)
+        self.envelopes[(channel_name, sensor_key)] = envelope
+        return envelope
+
+    def compute_envelopes(self, n_bins):
+        """Aggregate every (channel, sensor) into envelopes of n_bins bins over the common time span."""
+        self.start, self.end = self._time_span()
+        for channel_name, sensor_key in self.channel_series():
+            self.compute_envelope(channel_name, sensor_key, self.start, self.end, n_bins)
+        return self.envelopes
+
+    def _visible_span(self, ax):
+        x0, x1 = ax.get_xlim()
+        return (np.datetime64(mdates.num2date(x0).replace(tzinfo=None), 'ms'),
+                np.datetime64(mdates.num2date(x1).replace(tzinfo=None), 'ms'))
+
+    def plot_axes(self, ax):
+        """(Re)draw the envelopes of one axes over its visible time span, with one bin per horizontal pixel."""
+        channel_name, sensor_key = self.axes[ax]
+        start, end = self._visible_span(ax)
+        n_bins = max(1, int(ax.get_window_extent().width))
+        if self._views.get(ax) == (start, end, n_bins):
+            return
+        self._views[ax] = (start, end, n_bins)
+
+        for artist in self._artists.pop(ax, []):
+            artist.remove()
+        artists = []
+        for key in (self.sensors if sensor_key is None else [sensor_key]):
+            envelope = self.compute_envelope(channel_name, key, start, end, n_bins)
+            if envelope is None:
+                continue
+            color = self._colors[key]
+            artists.append(ax.fill_between(envelope["time"], envelope["min"], envelope["max"], color=color, alpha=0.25,
+                                           linewidth=0))
+            artists.extend(ax.plot(envelope["time"], envelope["mean"], color=color, linewidth=1, label=f'Sensor {key}'))
+        self._artists[ax] = artists
+
+    def on_xlim_changed(self, ax):
+        """Recompute the envelopes of the zoomed or panned axes and of the axes sharing its time axis."""
+        for sibling in ax.get_shared_x_axes().get_siblings(ax):
+            if sibling in self.axes:
+                self.plot_axes(sibling)
+
+    def on_resize(self, event):
+        """Recompute the envelopes of a resized figure for its new pixel widths."""
+        for ax in event.canvas.figure.axes:
+            if ax in self.axes:
+                self.plot_axes(ax)
+
+    def draw(self):
+        """
+        Draw the envelopes of every sensor, one figure for the 'shared' layout and one per
+        MAX_GRID_COLUMNS sensors for the 'grid' layout. Returns the list of figures.
+        """
+        self.start, self.end = self._time_span()
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        self._colors = {sensor_key: colors[i % len(colors)] for i, sensor_key in enumerate(self.sensors)}
+        sensor_keys = list(self.sensors)
+        if self.layout == 'grid':
+            pages = [sensor_keys[i:i + MAX_GRID_COLUMNS] for i in range(0, len(sensor_keys), MAX_GRID_COLUMNS)]
+        else:
+            pages = [sensor_keys]
+        for page, page_keys in enumerate(pages):
+            title = 'Overview (min / mean / max per pixel), click for detail'
+            if len(pages) > 1:
+                title += f' ({page + 1}/{len(pages)})'
+            self.figures.append(self._draw_figure(page_keys, title))
+        return self.figures
+
+    def _draw_figure(self, sensor_keys, title):
+        n_rows = len(self.channel_names)
+        n_cols = len(sensor_keys) if self.layout == 'grid' else 1
+        figure, axes = plt.subplots(n_rows, n_cols, figsize=(PLOT_WINDOW_HSIZE, PLOT_WINDOW_VSIZE),
+                                    sharex=True, sharey='row' if self.layout == 'grid' else False, squeeze=False)
+        axes[0][0].set_xlim(mdates.date2num(self.start.astype(object)), mdates.date2num(self.end.astype(object)))
+
+        for row, channel_name in enumerate(self.channel_names):
+            if self.layout == 'grid':
+                for col, sensor_key in enumerate(sensor_keys):
+                    self.axes[axes[row][col]] = (channel_name, sensor_key)
+                    if row == 0:
+                        axes[row][col].set_title(f'Sensor {sensor_key}', fontsize=10)
+            else:
+                self.axes[axes[row][0]] = (channel_name, None)
+            axes[row][0].set_ylabel(channel_name)
+
+        for ax in axes[-1]:
+            ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M - %m/%d'))
+            ax.tick_params(axis='x', labelrotation=30)
+        for ax in axes.flat:
+            ax.grid(which='both', linestyle='--', linewidth=0.5, alpha=0.6)
+            self.plot_axes(ax)
+        if self.layout == 'shared':
+            handles, labels = axes[0][0].get_legend_handles_labels()
+            figure.legend(handles, labels, loc='upper right', bbox_to_anchor=(1, 1))
+
+        figure.suptitle(title, fontsize=14)
+        figure.tight_layout(rect=(0, 0, 0.9 if self.layout == 'shared' else 1, 1))
+        # The layout changes the axes widths the envelopes were first computed for
+        for ax in axes.flat:
+            self.plot_axes(ax)
+            ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+        figure.canvas.mpl_connect('resize_event', self.on_resize)
+        figure.canvas.mpl_connect('button_press_event', self.on_click)
+        return figure
+
+    def _nearest_sensor(self, channel_name, time_ms, y):
+        """Sensor whose mean line passes closest to y at time_ms, among sensors with data around that time."""
+        best_key, best_distance = None, np.inf
+        for sensor_key in self.sensors:
+            envelope = self.envelopes.get((channel_name, sensor_key))
+            if envelope is None or not len(envelope["time"]):
+                continue
+            times = envelope["time"].astype(np.int64)
+            if not times[0] <= time_ms <= times[-1]:
+                continue
+            valid = ~np.isnan(envelope["mean"])
+            distance = abs(np.interp(time_ms, times[valid], envelope["mean"][valid]) - y)
+            if distance < best_distance:
+                best_key, best_distance = sensor_key, distance
+        return best_key
+
+    def on_click(self, event):
+        """Open the detail figure of the clicked sensor around the clicked time."""
+        if event.inaxes not in self.axes or event.xdata is None:
+            return
+        channel_name, sensor_key = self.axes[event.inaxes]
+        clicked = np.datetime64(mdates.num2date(event.xdata).replace(tzinfo=None), 'ms')
+        if sensor_key is None:
+            sensor_key = self._nearest_sensor(channel_name, clicked.astype(np.int64), event.ydata)
+            if sensor_key is None:
+                return
+        fig = self.plot_detail(sensor_key, clicked)
+        if fig is not None:
+            fig.show()
+
+    def plot_detail(self, sensor_key, center):
+        """
+        Plot the full detail figure of one sensor for DETAIL_WINDOW_FRACTION of the overview span around center.
+
+        Returns:
+        matplotlib.figure.Figure: The detail figure, or None if the window holds no samples.
+        """
+        sensor = self.sensors[sensor_key]
+        half_window = max((self.end - self.start) * DETAIL_WINDOW_FRACTION / 2,
+                          np.timedelta64(self.gap_threshold_duration).astype('timedelta64[ms]'))
+        timestamps = sensor["segments"].timestamps
+        lo = np.searchsorted(timestamps, center - half_window, 'left')
+        hi = np.searchsorted(timestamps, center + half_window, 'right')
+        if hi <= lo:
+            return None
+        window = sensor["data"][lo:hi]
+        title = f'Sensor {sensor_key}, {timestamps[lo].astype(object):%m/%d %H:%M} to {timestamps[hi - 1].astype(object):%m/%d %H:%M}'
+        fig = plot_sensor_figure(sensor_key, window, sensor["channels"], self.gap_threshold_duration, self.plot_min_max,
+                                 self.qc_mask, self.plot_flagged, SegmentTable(timestamps[lo:hi]), title)
+        self.detail_figures.append(fig)
+        return fig
+
+
+def plot_overview(grouped_data, channel_names, layout='shared', gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD,
+                  plot_min_max: bool = True, qc_mask: int = 0, plot_flagged: bool = False, segment_tables: dict = None):
+    """Draw the OverviewPlot of grouped data in a single figure and show it. Returns the OverviewPlot."""
+    overview = OverviewPlot(grouped_data, channel_names, layout, gap_threshold_duration, plot_min_max, qc_mask,
+                            plot_flagged, segment_tables)
+    if overview.sensors:
+        overview.draw()
+        plt.show()
+    return overview
+
+
+def plot_json_overview(data: dict, channel_names: list, layout='shared', gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD,
+                       qc_mask: int = 0, plot_flagged: bool = False):
+    """
+    Overview counterpart of lib.plotting_functions.plot_json_channels for DVT1 data, grouped by node ID.
+    channel_names None plots each sensor's channels from the dataset topology.
+    """
+    grouped_data = group_by_node_id(data)
+    if channel_names is None:
+        channel_names = channels_from_topology(data, grouped_data)
+    segment_tables = get_segment_tables(data, 'bristlemouth_node_id')
+    return plot_overview(grouped_data, channel_names, layout, gap_threshold_duration, True, qc_mask, plot_flagged, segment_tables)
+
+
+def plot_beta2_json_overview(data: dict, channel_names: list, layout='shared', gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD,
+                             qc_mask: int = 0, plot_flagged: bool = False):
+    """Overview counterpart of lib.plotting_functions.plot_beta2_json_channels for Beta 2 data, grouped by sensor position."""
+    grouped_data = group_by_sensor_position(data)
+    if channel_names is None:
+        channel_names = channels_from_topology(data, grouped_data)
+    segment_tables = get_segment_tables(data, 'sensorPosition')
+    return plot_overview(grouped_data, channel_names, layout, gap_threshold_duration, False, qc_mask, plot_flagged, segment_tables)
@@ -0,0 +1,203 @@
+# -------------------------------------------------------------------------------
+# Name:        parallel_decode.py
+# Purpose:     Decode DVT1 sensor-data across CPU cores for bulk backfills
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from lib.binary_decoder import (
+    decode_payload_to_structs,
+    payload_to_struct_bytes,
+    struct_description_to_dtype,
+    DVT1_DATA_CHANNELS,
+    DVT1_STRUCT_DESCRIPTION,
+)
+from lib.records import compact_decoded_value, compact_record, ChannelStats, ChannelValue
+
+# Records below this count are decoded serially, process start-up would dominate
+MIN_PARALLEL_RECORDS = 2000
+CHUNKS_PER_WORKER = 4
+
+# Per-record status in the shared buffer
+STATUS_SKIPPED = 0  # nothing decoded, the record keeps no 'decoded_value'
+STATUS_DECODED = 1  # channel values are in the shared buffer
+STATUS_SERIAL = 2   # input or output does not fit the shared arrays, the parent handles the record serially
+STATUS_PENDING = 3  # input is in the shared buffer, waiting for a worker
+
+
+def _chunk_bounds(n_records, workers, chunk_size):
+    if chunk_size is None:
+        chunk_size = max(1, -(-n_records // (workers * CHUNKS_PER_WORKER)))
+    return [(start, min(start + chunk_size, n_records)) for start in range(0, n_records, chunk_size)]
+
+
+def _create_shared(arrays):
+    """
+    Lay out named arrays in one new SharedMemory block.
+
+    Parameters:
+    - arrays (dict): name -> numpy array copied into the block, or (dtype, shape) of a zero-filled array.
+
+    Returns:
+    tuple: (shm, spec), spec being the picklable (name, dtype, shape, offset) list passed to _shared_views.
+    """
+    spec = []
+    size = 0
+    for name, array in arrays.items():
+        dtype, shape = (array.dtype, array.shape) if isinstance(array, np.ndarray) else (np.dtype(array[0]), array[1])
+        size = -(-size // 8) * 8
+        spec.append((name, dtype.str, shape, size))
+        size += dtype.itemsize * int(np.prod(shape))
+    shm = SharedMemory(create=True, size=max(1, size))
+    views = _shared_views(shm, spec)
+    for name, array in arrays.items():
+        if isinstance(array, np.ndarray):
+            views[name][...] = array
+    del views
+    return shm, spec
+
+
+def _shared_views(shm, spec):
+    """Return name -> numpy view of the arrays of a SharedMemory block laid out by _create_shared."""
+    return {name: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset) for name, dtype, shape, offset in spec}
+
+
+def _decode_dvt1_chunk(shm_name, spec, start, end):
+    """Worker: decode the pending hex payloads of records start:end of the shared input into the shared output."""
+    shm = SharedMemory(name=shm_name)
+    arrays = _shared_views(shm, spec)
+    try:
+        hex_values, values, status = arrays['hex_values'], arrays['values'], arrays['status']
+        rows = []
+        buffers = []
+        for i in range(start, end):
+            if status[i] != STATUS_PENDING:
+                continue
+            try:
+                buffers.append(payload_to_struct_bytes(hex_values[i].decode('ascii'), len(DVT1_DATA_CHANNELS), DVT1_STRUCT_DESCRIPTION))
+                rows.append(i)
+            except ValueError:
+                # The parent decodes it again and reports the error like the serial path
+                status[i] = STATUS_SERIAL
+        if rows:
+            dtype = struct_description_to_dtype(DVT1_STRUCT_DESCRIPTION)
+            structs = np.frombuffer(b"".join(buffers), dtype=dtype).reshape(len(rows), len(DVT1_DATA_CHANNELS))
+            for field_index, name in enumerate(dtype.names):
+                values[rows, :, field_index] = structs[name]
+            status[rows] = STATUS_DECODED
+    finally:
+        hex_values = values = status = None
+        arrays.clear()
+        shm.close()
+
+
+def _python_rows(values, integer_positions):
+    """Convert rows of the shared output to nested lists of Python floats, with ints at (channel, field) integer_positions."""
+    rows = values.astype(object)
+    for channel_index, field_index in integer_positions:
+        rows[:, channel_index, field_index] = values[:, channel_index, field_index].astype(np.int64).astype(object)
+    return rows.tolist()
+
+
+def _run_chunks(worker, inputs, outputs, chunk_args, workers):
+    """
+    Lay out the input and output arrays in shared memory, run worker(shm_name, spec, start, end, *args)
+    over each chunk, and return copies of the output arrays.
+    """
+    shm, spec = _create_shared({**inputs, **outputs})
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(worker, shm.name, spec, start, end, *args) for start, end, args in chunk_args]
+            for future in futures:
+                future.result()
+        arrays = _shared_views(shm, spec)
+        result = {name: arrays[name].copy() for name in outputs}
+        arrays.clear()
+        return result
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _decoded_value(channels, field_names, compact):
+    """Build a 'decoded_value' list from (channel_name, field values) pairs, as ChannelValue records if compact."""
+    if compact:
+        return [ChannelValue(ChannelStats(zip(field_names, channel_values)), channel_name) for channel_name, channel_values in channels]
+    return [{'data': dict(zip(field_names, channel_values)), 'channel_name': channel_name} for channel_name, channel_values in channels]
+
+
+def use_parallel(n_records, workers):
+    """Return True if n_records are worth spreading over workers (None meaning the CPU count)."""
+    return (workers or os.cpu_count()) > 1 and n_records >= MIN_PARALLEL_RECORDS
+
+
+def parallel_decode_sensor_data(api_response, workers=None, chunk_size=None, compact=False):
+    """
+    Decode the DVT1 hex payloads of a sensor-data response in place, across worker processes.
+
+    Produces the same 'decoded_value's as lib.api_functions.decode_sensor_data. The hex
+    payloads are copied once into a shared-memory buffer; each worker unpacks a contiguous
+    range of them with numpy and writes the channel values into a shared output buffer,
+    and the parent rebuilds the dicts in the original record order.
+
+    Parameters:
+    - api_response (dict): sensor-data response.
+    - workers (int): Number of worker processes, defaults to the CPU count.
+    - chunk_size (int): Payloads per task, defaults to spreading the records over CHUNKS_PER_WORKER tasks per worker.
+    - compact (bool): Build lib.records records directly instead of dicts.
+
+    Returns:
+    dict: The input api_response.
+    """
+    payloads = api_response.get('data', [])
+    workers = workers or os.cpu_count()
+
+    hex_values = []
+    status = []
+    for payload in payloads:
+        hex_value = payload.get('value', '')
+        if payload.get('units', None) != "hex":
+            print(f"Unexpected units type '{payload.get('units', None)}' for payload at time {payload.get('timestamp', 'Unknown')} is not type 'hex'. Skipping decoding.")
+            hex_values.append(b"")
+            status.append(STATUS_SKIPPED)
+        elif isinstance(hex_value, str) and hex_value.isascii():
+            hex_values.append(hex_value.encode('ascii'))
+            status.append(STATUS_PENDING)
+        else:
+            hex_values.append(b"")
+            status.append(STATUS_SERIAL)
+
+    n_channels, n_fields = len(DVT1_DATA_CHANNELS), len(DVT1_STRUCT_DESCRIPTION)
+    inputs = {'hex_values': np.array(hex_values, dtype=np.bytes_)}
+    outputs = {'values': (np.float64, (len(payloads), n_channels, n_fields)), 'status': np.array(status, dtype=np.int8)}
+    chunk_args = [(start, end, ()) for start, end in _chunk_bounds(len(payloads), workers, chunk_size)]
+    result = _run_chunks(_decode_dvt1_chunk, inputs, outputs, chunk_args, workers)
+    values, status = result['values'], result['status']
+
+    field_names = [name for _, name in DVT1_STRUCT_DESCRIPTION]
+    integer_positions = [(channel_index, field_index)
+                         for channel_index in range(n_channels)
+                         for field_index, (data_type, _) in enumerate(DVT1_STRUCT_DESCRIPTION) if data_type == 'uint16_t']
+    decoded = np.flatnonzero(status == STATUS_DECODED)
+    for i, row in zip(decoded.tolist(), _python_rows(values[decoded], integer_positions)):
+        payloads[i]['decoded_value'] = _decoded_value(zip(DVT1_DATA_CHANNELS, row), field_names, compact)
+    for i in np.flatnonzero(status == STATUS_SERIAL).tolist():
+        hex_value = payloads[i].get('value', '')
+        try:
+            decoded_value = decode_payload_to_structs(hex_value, DVT1_DATA_CHANNELS, DVT1_STRUCT_DESCRIPTION)
+            payloads[i]['decoded_value'] = compact_decoded_value(decoded_value) if compact else decoded_value
+        except ValueError as ve:
+            print(f"Failed to decode hex value {hex_value} at timestamp {payloads[i].get('timestamp', 'Unknown')}: {ve}")
+    if compact:
+        for i, payload in enumerate(payloads):
+            payloads[i] = compact_record(payload)
+    return api_response
@@ -2,16 +2,18 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import mplcursors
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import timedelta
 from collections import defaultdict
+from lib.segments import SegmentTable, DEFAULT_GAP_THRESHOLD, get_segment_tables
+from lib.timestamps import parse_timestamps
+from lib.topology import get_sensor_index, get_topology
 
 # Constants
-DEFAULT_GAP_THRESHOLD = timedelta(minutes=75)
 PLOT_WINDOW_HSIZE = 15
 PLOT_WINDOW_VSIZE = 8
 
 
-def extract_channel_data(data: list, channel_name: str, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True) -> tuple:
+def extract_channel_data(data: list, channel_name: str, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True, qc_mask: int = 0, segments: SegmentTable = None) -> tuple:
     """
     Extract channel specific data from input data.
 
@@ -21,53 +23,83 @@ def extract_channel_data(data: list, channel_name: str, gap_threshold_duration:
     -- Generally, this list will have been grouped by bristlemouth_node_id before calling this function. See group_by_node_id().
     - channel_name (str): The specific channel name to extract.
     - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - qc_mask (int): Samples whose 'qc_flags' share a bit with this mask are replaced by NaN.
+    -- see lib.quality_control.apply_qc_flags
+    - segments (SegmentTable): Precomputed gap index of data, built here if not given.
+    -- see lib.segments.get_segment_tables
 
     Returns:
     tuple: Containing lists for timestamps, mean_values, min_values, max_values, and std_values.
+    -- A single NaN sample is inserted at the end of each segment so plotted lines break across gaps.
     """
-    timestamps = []
-    mean_values = []
-    min_values = []
-    max_values = []
-    std_values = []
-    n_readings_values = []
-    last_timestamp = None
-
-    for payload in data:
-        timestamp = payload.get('timestamp', None)
-        if timestamp:
-            timestamp = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
-        if last_timestamp and (timestamp - last_timestamp > gap_threshold_duration):
-            timestamps.extend([last_timestamp, timestamp])
-            mean_values.extend([np.nan, np.nan])
-            if plot_min_max:
-                min_values.extend([np.nan, np.nan])
-                max_values.extend([np.nan, np.nan])
-            std_values.extend([np.nan, np.nan])
-            n_readings_values.extend([np.nan, np.nan])
+    if segments is None:
+        segments = SegmentTable.from_payloads(data)
 
+    index = []
+    stats = []
+    for i, payload in enumerate(data):
         decoded_value = payload.get('decoded_value', [])
         channel_data = next((item for item in decoded_value if item['channel_name'] == channel_name), None)
         if channel_data:
-            channel_stats = channel_data['data']
-            timestamps.append(timestamp)
-            mean_values.append(channel_stats['mean'])
-            if plot_min_max: # Beta 2 sample aggregation does not report min
-                min_values.append(channel_stats['min'])
-                max_values.append(channel_stats['max'])
-            if 'stdev' in channel_stats:
-                std_values.append(channel_stats['stdev'])
-            if 'sample_count' in channel_stats:
-                n_readings_values.append(channel_stats['sample_count'])
-            else:
-                n_readings_values.append(np.nan)
+            index.append(i)
+            stats.append(channel_data['data'])
+    index = np.array(index, dtype=np.int64)
+
+    def column(key):
+        return np.array([channel_stats.get(key, np.nan) for channel_stats in stats], dtype=np.float64)
+
+    timestamps = segments.timestamps[index]
+    mean_values = column('mean')
+    min_values = column('min') if plot_min_max else np.empty(0)  # Beta 2 sample aggregation does not report min
+    max_values = column('max') if plot_min_max else np.empty(0)
+    has_stdev = all('stdev' in channel_stats for channel_stats in stats)
+    std_values = column('stdev') if has_stdev else np.empty(0)
+    n_readings_values = column('sample_count')
+
+    if qc_mask:
+        masked = (np.array([channel_stats.get('qc_flags', 0) for channel_stats in stats], dtype=np.int64) & qc_mask) != 0
+        for values in (mean_values, min_values, max_values, std_values):
+            if len(values):
+                values[masked] = np.nan
+
+    # Break lines at gaps: one NaN sample at the last timestamp before each segment break
+    breaks = segments.break_indices(gap_threshold_duration) if len(index) else np.empty(0, dtype=np.int64)
+    insert_at = np.searchsorted(index, breaks)
+    timestamps = np.insert(timestamps, insert_at, segments.timestamps[breaks - 1])
+    mean_values, min_values, max_values, std_values, n_readings_values = [
+        np.insert(values, insert_at, np.nan) if len(values) else values
+        for values in (mean_values, min_values, max_values, std_values, n_readings_values)
+    ]
+
+    return (timestamps.astype(object).tolist(), mean_values.tolist(), min_values.tolist(), max_values.tolist(),
+            std_values.tolist(), n_readings_values.tolist())
+
+
+def extract_flagged_samples(data: list, channel_name: str, qc_mask: int) -> tuple:
+    """
+    Extract the samples of a channel that failed any of the QC tests in qc_mask.
 
-        last_timestamp = timestamp
+    Parameters:
+    - data (list): List of sample data dicts with 'decoded_value's and QC flags.
+    -- see lib.quality_control.apply_qc_flags
+    - channel_name (str): The specific channel name to extract.
+    - qc_mask (int): QC flag bits to select.
 
-    return timestamps, mean_values, min_values, max_values, std_values, n_readings_values
+    Returns:
+    tuple: Containing lists for timestamps and mean_values of flagged samples.
+    """
+    timestamps = []
+    mean_values = []
+    for payload in data:
+        decoded_value = payload.get('decoded_value', [])
+        channel_data = next((item for item in decoded_value if item['channel_name'] == channel_name), None)
+        if channel_data and channel_data['data'].get('qc_flags', 0) & qc_mask:
+            timestamps.append(payload['timestamp'])
+            mean_values.append(channel_data['data']['mean'])
+    return parse_timestamps(timestamps).astype(object).tolist(), mean_values
 
 
-def subplot_json_channel(ax, data: dict, channel_name: str, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True) -> tuple:
+def subplot_json_channel(ax, data: dict, channel_name: str, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True, qc_mask: int = 0, plot_flagged: bool = False, segments: SegmentTable = None) -> tuple:
     """
     Plot specific channel data on a given subplot.
 
@@ -76,11 +108,14 @@ def subplot_json_channel(ax, data: dict, channel_name: str, gap_threshold_durati
     - data (dict): The input data.
     - channel_name (str): The specific channel name to plot.
     - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - qc_mask (int): QC flag bits of samples to mask out of the lines.
+    - plot_flagged (bool): Mark samples flagged by qc_mask separately.
+    - segments (SegmentTable): Precomputed gap index of data.
 
     Returns:
     tuple: Containing lines and labels for legend.
     """
-    timestamps, mean_values, min_values, max_values, std_values, n_readings = extract_channel_data(data, channel_name, gap_threshold_duration, plot_min_max)
+    timestamps, mean_values, min_values, max_values, std_values, n_readings = extract_channel_data(data, channel_name, gap_threshold_duration, plot_min_max, qc_mask, segments)
 
     ax.plot(timestamps, mean_values, linewidth=1.5, label='Mean', color='black', marker='o', markersize=3)
     if plot_min_max:
@@ -92,6 +127,10 @@ def subplot_json_channel(ax, data: dict, channel_name: str, gap_threshold_durati
         fill_lower_bound = np.array(mean_values) - np.array(std_values)
         ax.fill_between(timestamps, fill_lower_bound, fill_upper_bound, color='cyan', alpha=0.2, label='Stdev')
 
+    if plot_flagged and qc_mask:
+        flagged_timestamps, flagged_values = extract_flagged_samples(data, channel_name, qc_mask)
+        ax.scatter(flagged_timestamps, flagged_values, color='red', marker='x', s=20, zorder=3, label='QC Flagged')
+
     ax2 = ax.twinx()  # instantiate a second axes that shares the same x-axis
     ax2.plot(timestamps, n_readings, color='darkgrey', linewidth=0.5, marker='o', markersize=2, zorder=-1, label='N readings')
     ax2.set_ylabel('Reading Count', color='grey')
@@ -114,6 +153,7 @@ def subplot_json_channel(ax, data: dict, channel_name: str, gap_threshold_durati
 def group_by_node_id(data: dict) -> defaultdict:
     """
     Group data by the bristlemouth_node_id.
+    Uses the dataset's categorical sensor index, built on first use. See lib.topology.SensorIndex.
 
     Parameters:
     - data (dict): The input data.
@@ -121,15 +161,12 @@ def group_by_node_id(data: dict) -> defaultdict:
     Returns:
     defaultdict: Grouped data by node ID.
     """
-    grouped_data = defaultdict(list)
-    for payload in data.get('data', []):
-        node_id = payload.get('bristlemouth_node_id', 'None')
-        grouped_data[node_id].append(payload)
-    return grouped_data
+    return defaultdict(list, get_sensor_index(data, 'bristlemouth_node_id').partition(data.get('data', [])))
 
 def group_by_sensor_position(data: dict) -> defaultdict:
     """
     Group data by the sensor_position in a bus-topology network.
+    Uses the dataset's categorical sensor index, built on first use. See lib.topology.SensorIndex.
 
     Parameters:
     - data (dict): The input data.
@@ -137,77 +174,137 @@ def group_by_sensor_position(data: dict) -> defaultdict:
     Returns:
     defaultdict: Grouped data by sensor position.
     """
-    grouped_data = defaultdict(list)
-    for payload in data.get('data', []):
-        sensor_position = payload.get('sensorPosition', 'None')
-        grouped_data[sensor_position].append(payload)
-    return grouped_data
+    return defaultdict(list, get_sensor_index(data, 'sensorPosition').partition(data.get('data', [])))
+
+
+def plot_sensor_figure(sensor_key, data_group: list, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True, qc_mask: int = 0, plot_flagged: bool = False, segments: SegmentTable = None, title: str = None):
+    """
+    Plot every channel of one sensor in its own figure, with reading counts and hover cursors.
+
+    Parameters:
+    - sensor_key: Node ID or sensor position, used in the title.
+    - data_group (list): The sensor's payloads, in time order.
+    - channel_names (list): List of channel names to plot.
+    - segments (SegmentTable): Precomputed gap index of data_group.
+    - title (str): Figure title, defaults to 'Plots for sensor <sensor_key>'.
+    - See plot_grouped_data for the other parameters.
+
+    Returns:
+    matplotlib.figure.Figure: The new figure.
+    """
+    fig, axes = plt.subplots(len(channel_names), 1, figsize=(PLOT_WINDOW_HSIZE, PLOT_WINDOW_VSIZE), sharex=True)
+
+    if len(channel_names) == 1:
+        axes = [axes]
+
+    lines = []
+    labels = []
+    for i, channel_name in enumerate(channel_names):
+        lines, labels = subplot_json_channel(axes[i], data_group, channel_name, gap_threshold_duration, plot_min_max, qc_mask, plot_flagged, segments)
+
+    # Only show x axis label for bottom plot
+    for ax in axes[:-1]:
+        ax.set_xlabel("")
 
-def plot_grouped_data(grouped_data: defaultdict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True) -> None:
+    # Add a single legend for the entire figure
+    fig.legend(lines, labels, loc='upper right', bbox_to_anchor=(1, 1))  # moved legend a bit to the right
+
+    fig.suptitle(title or f'Plots for sensor {sensor_key}', fontsize=16)
+    mplcursors.cursor(fig, hover=True)
+    fig.tight_layout(rect=(0, 0, 0.9, 1))  # Adjust for the suptitle
+    fig.subplots_adjust(hspace=0.1)
+    return fig
+
+
+def plot_grouped_data(grouped_data: defaultdict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, plot_min_max: bool = True, qc_mask: int = 0, plot_flagged: bool = False, segment_tables: dict = None) -> None:
     """
     Plot data for each node ID.
 
     Parameters:
     - grouped_data (defaultdict): Data grouped by node ID.
-    - channel_names (list): List of channel names to plot.
+    - channel_names (list): List of channel names to plot, or a dict of group key -> list of channel names.
     - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - qc_mask (int): QC flag bits of samples to mask out of the lines.
+    - plot_flagged (bool): Mark samples flagged by qc_mask separately.
+    - segment_tables (dict): Precomputed SegmentTable per group key, see lib.segments.get_segment_tables.
     """
+    segment_tables = segment_tables or {}
+    channel_names_by_sensor = channel_names if isinstance(channel_names, dict) else None
     for sensor_position, data_group in grouped_data.items():
         has_decoded_values = any([payload.get('decoded_value', []) for payload in data_group])
 
         if not has_decoded_values:
             continue
 
-        fig, axes = plt.subplots(len(channel_names), 1, figsize=(PLOT_WINDOW_HSIZE, PLOT_WINDOW_VSIZE), sharex=True)
+        if channel_names_by_sensor is not None:
+            channel_names = channel_names_by_sensor.get(sensor_position)
+            if not channel_names:
+                continue
 
-        if len(channel_names) == 1:
-            axes = [axes]
+        # One gap index per sensor, shared by all of its channels
+        segments = segment_tables.get(sensor_position)
+        if segments is None or len(segments) != len(data_group):
+            segments = SegmentTable.from_payloads(data_group)
 
-        lines = []
-        labels = []
-        for i, channel_name in enumerate(channel_names):
-            lines, labels = subplot_json_channel(axes[i], data_group, channel_name, gap_threshold_duration, plot_min_max)
+        plot_sensor_figure(sensor_position, data_group, channel_names, gap_threshold_duration, plot_min_max, qc_mask, plot_flagged, segments)
+    # show all node plots
+    plt.show()
 
-        # Only show x axis label for bottom plot
-        for ax in axes[:-1]:
-            ax.set_xlabel("")
 
-        # Add a single legend for the entire figure
-        fig.legend(lines, labels, loc='upper right', bbox_to_anchor=(1, 1))  # moved legend a bit to the right
+def channels_from_topology(data: dict, grouped_data: dict) -> dict:
+    """
+    Pick the channels to plot for each sensor group from the dataset's topology.
 
-        fig.suptitle(f'Plots for sensor {sensor_position}', fontsize=16)
-        mplcursors.cursor(hover=True)
-        plt.tight_layout(rect=(0, 0, 0.9, 1))  # Adjust for the suptitle
-        fig.subplots_adjust(hspace=0.1)
-    # show all node plots
-    plt.show()
+    Parameters:
+    - data (dict): The decoded dataset, see lib.topology.get_topology.
+    - grouped_data (dict): Data grouped by node ID or sensor position.
+
+    Returns:
+    dict: group key -> list of channel names of the sensor's type that the group reports.
+    """
+    topology = get_topology(data)
+    channel_names = {}
+    for key, data_group in grouped_data.items():
+        reported = {channel['channel_name'] for payload in data_group for channel in payload.get('decoded_value') or []}
+        channel_names[key] = [channel_name for channel_name in topology.channels(key) if channel_name in reported]
+    return channel_names
 
 
-def plot_json_channels(data: dict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD) -> None:
+def plot_json_channels(data: dict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, qc_mask: int = 0, plot_flagged: bool = False) -> None:
     """
     Main function to plot JSON channel data.
 
     Parameters:
     - data (dict): The input data, formatted as sensor-data response json with decoded-values.
     -- see lib.api_functions.fetch_and_decode_sensor_data
-    - channel_names (list): List of channel names to plot.
+    - channel_names (list): List of channel names to plot, None for each sensor's channels from the dataset topology.
     -- see lib.binary_decoder.DVT1_DATA_CHANNELS
     - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - qc_mask (int): QC flag bits of samples to mask out of the lines.
+    - plot_flagged (bool): Mark samples flagged by qc_mask separately.
     """
     grouped_data = group_by_node_id(data)
-    plot_grouped_data(grouped_data, channel_names, gap_threshold_duration, True)
+    if channel_names is None:
+        channel_names = channels_from_topology(data, grouped_data)
+    segment_tables = get_segment_tables(data, 'bristlemouth_node_id')
+    plot_grouped_data(grouped_data, channel_names, gap_threshold_duration, True, qc_mask, plot_flagged, segment_tables)
 
-def plot_beta2_json_channels(data: dict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD) -> None:
+def plot_beta2_json_channels(data: dict, channel_names: list, gap_threshold_duration: timedelta = DEFAULT_GAP_THRESHOLD, qc_mask: int = 0, plot_flagged: bool = False) -> None:
     """
     Main function to plot JSON channel data for Beta 2 systems.
 
     Parameters:
     - data (dict): The input data, formatted as sensor-data response json with decoded-values.
     -- see lib.api_functions.fetch_and_decode_sensor_data
-    - channel_names (list): List of channel names to plot.
+    - channel_names (list): List of channel names to plot, None for each sensor's channels from the dataset topology.
     -- see lib.binary_decoder.DVT1_DATA_CHANNELS
     - gap_threshold_duration (timedelta): Threshold to consider data as missing and introduce gaps.
+    - qc_mask (int): QC flag bits of samples to mask out of the lines.
+    - plot_flagged (bool): Mark samples flagged by qc_mask separately.
     """
     grouped_data = group_by_sensor_position(data)
-    plot_grouped_data(grouped_data, channel_names, gap_threshold_duration, False)
+    if channel_names is None:
+        channel_names = channels_from_topology(data, grouped_data)
+    segment_tables = get_segment_tables(data, 'sensorPosition')
+    plot_grouped_data(grouped_data, channel_names, gap_threshold_duration, False, qc_mask, plot_flagged, segment_tables)
 
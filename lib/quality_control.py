@@ -0,0 +1,362 @@
+# -------------------------------------------------------------------------------
+# Name:        quality_control.py
+# Purpose:     Vectorized data-quality tests and bitmask flags for Current Meter channels
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from collections import defaultdict
+from itertools import chain
+from operator import itemgetter
+
+import numpy as np
+
+from lib.timestamps import parse_timestamps
+from lib.topology import sensor_key
+
+# QC flag bits, combined into one uint8 per sample and channel
+QC_RANGE = 1 << 0       # mean outside the physical range of the channel
+QC_SPIKE = 1 << 1       # rate of change into and out of the sample exceeds the channel limit
+QC_STUCK = 1 << 2       # value repeated for too many consecutive samples
+QC_LOW_COUNT = 1 << 3   # too few instrument readings aggregated into the sample
+QC_TILT = 1 << 4        # instrument tilted too far for reliable current measurements
+QC_STDEV = 1 << 5       # stdev negative or inconsistent with min/max/mean
+QC_ALL = QC_RANGE | QC_SPIKE | QC_STUCK | QC_LOW_COUNT | QC_TILT | QC_STDEV
+
+QC_FLAG_NAMES = {
+    QC_RANGE: "range",
+    QC_SPIKE: "spike",
+    QC_STUCK: "stuck",
+    QC_LOW_COUNT: "low_count",
+    QC_TILT: "tilt",
+    QC_STDEV: "stdev",
+}
+
+# Valid (min, max) of the mean for each channel
+CHANNEL_RANGES = {
+    "Abs Speed[cm/s]": (0.0, 300.0),
+    "Direction[Deg.M]": (0.0, 360.0),
+    "North[cm/s]": (-300.0, 300.0),
+    "East[cm/s]": (-300.0, 300.0),
+    "Heading[Deg.M]": (0.0, 360.0),
+    "Tilt X[Deg]": (-90.0, 90.0),
+    "Tilt Y[Deg]": (-90.0, 90.0),
+    "Ping Count": (0.0, np.inf),
+    "Abs Tilt[Deg]": (0.0, 90.0),
+    "Temperature[ºC]": (-5.0, 40.0),
+}
+
+# Maximum plausible rate of change of the mean, in channel units per hour
+SPIKE_RATE_LIMITS = {
+    "Abs Speed[cm/s]": 100.0,
+    "North[cm/s]": 100.0,
+    "East[cm/s]": 100.0,
+    "Temperature[ºC]": 5.0,
+}
+
+# Channels whose values wrap around at 360 degrees
+CIRCULAR_CHANNELS = {"Direction[Deg.M]", "Heading[Deg.M]"}
+
+DEFAULT_STUCK_RUN_LENGTH = 6
+
+# Consecutive identical means that flag a stuck sensor, for channels that keep changing in normal
+# operation. Counts and coarsely quantised channels (Ping Count, Temperature) repeat legitimately.
+STUCK_RUN_LENGTHS = {
+    "Abs Speed[cm/s]": DEFAULT_STUCK_RUN_LENGTH,
+    "Direction[Deg.M]": DEFAULT_STUCK_RUN_LENGTH,
+    "North[cm/s]": DEFAULT_STUCK_RUN_LENGTH,
+    "East[cm/s]": DEFAULT_STUCK_RUN_LENGTH,
+}
+
+TILT_CHANNEL_NAME = "Abs Tilt[Deg]"
+
+# Channels invalidated by excessive instrument tilt: the current measurements and the tilt itself
+TILT_FLAGGED_CHANNELS = {
+    "Abs Speed[cm/s]",
+    "Direction[Deg.M]",
+    "North[cm/s]",
+    "East[cm/s]",
+    "Tilt X[Deg]",
+    "Tilt Y[Deg]",
+    "Abs Tilt[Deg]",
+}
+DEFAULT_MIN_READING_COUNT = 3
+DEFAULT_MAX_TILT_DEG = 35.0
+
+
+def range_test(mean, valid_range):
+    """Flag samples whose mean is outside valid_range (min, max)."""
+    low, high = valid_range
+    with np.errstate(invalid='ignore'):
+        return ((mean < low) | (mean > high)).astype(np.uint8) * QC_RANGE
+
+
+def spike_test(timestamps, mean, rate_limit, circular=False):
+    """
+    Flag samples where the rate of change both into and out of the sample exceeds rate_limit
+    (units per hour) with opposite signs, i.e. an isolated spike rather than a step.
+    """
+    flags = np.zeros(len(mean), dtype=np.uint8)
+    if len(mean) < 3:
+        return flags
+    delta = np.diff(mean)
+    if circular:
+        delta = (delta + 180.0) % 360.0 - 180.0
+    hours = np.diff(timestamps).astype('timedelta64[ms]').astype(np.float64) / 3.6e6
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = delta / hours
+    rate_in, rate_out = rate[:-1], rate[1:]
+    with np.errstate(invalid='ignore'):
+        spikes = (np.abs(rate_in) > rate_limit) & (np.abs(rate_out) > rate_limit) & (np.sign(rate_in) != np.sign(rate_out))
+    flags[1:-1][spikes] = QC_SPIKE
+    return flags
+
+
+def stuck_test(mean, run_length=DEFAULT_STUCK_RUN_LENGTH):
+    """Flag every sample in a run of at least run_length identical consecutive values."""
+    flags = np.zeros(len(mean), dtype=np.uint8)
+    if len(mean) < run_length:
+        return flags
+    run_starts = np.concatenate(([0], np.flatnonzero(mean[1:] != mean[:-1]) + 1))
+    run_lengths = np.diff(np.append(run_starts, len(mean)))
+    stuck = np.repeat(run_lengths >= run_length, run_lengths)
+    stuck &= ~np.isnan(mean)
+    flags[stuck] = QC_STUCK
+    return flags
+
+
+def low_count_test(sample_count, min_count=DEFAULT_MIN_READING_COUNT):
+    """Flag samples aggregated from fewer than min_count instrument readings."""
+    with np.errstate(invalid='ignore'):
+        return (sample_count < min_count).astype(np.uint8) * QC_LOW_COUNT
+
+
+def tilt_test(tilt, max_tilt=DEFAULT_MAX_TILT_DEG):
+    """Flag samples where the instrument's absolute tilt exceeds max_tilt degrees."""
+    with np.errstate(invalid='ignore'):
+        return (np.abs(tilt) > max_tilt).astype(np.uint8) * QC_TILT
+
+
+def stdev_test(mean, stdev, minimum=None, maximum=None):
+    """Flag negative stdev, and where min/max are reported, stdev wider than max - min or mean outside [min, max]."""
+    with np.errstate(invalid='ignore'):
+        bad = stdev < 0
+        if minimum is not None and maximum is not None:
+            bad |= (stdev > (maximum - minimum)) | (mean < minimum) | (mean > maximum)
+    return bad.astype(np.uint8) * QC_STDEV
+
+
+def qc_channel(channel_name, timestamps, mean, stdev=None, sample_count=None, tilt=None, minimum=None, maximum=None,
+               stuck_run_lengths=None, min_reading_count=DEFAULT_MIN_READING_COUNT,
+               max_tilt=DEFAULT_MAX_TILT_DEG):
+    """
+    Run every applicable QC test over the arrays of one channel of one sensor.
+
+    Parameters:
+    - channel_name (str): Channel being tested, selects range, spike and stuck limits.
+    - timestamps (np.ndarray): datetime64 sample times, ascending.
+    - mean (np.ndarray): Channel mean per sample.
+    - stdev, sample_count, tilt, minimum, maximum (np.ndarray): Optional arrays aligned with mean.
+    -- Tests whose inputs are not given are skipped.
+    - stuck_run_lengths (dict): channel name -> stuck run length, defaults to STUCK_RUN_LENGTHS.
+    -- Channels not listed are not tested for stuck values.
+
+    Returns:
+    np.ndarray: uint8 bitmask of QC_* flags per sample.
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+    flags = np.zeros(len(mean), dtype=np.uint8)
+    if channel_name in CHANNEL_RANGES:
+        flags |= range_test(mean, CHANNEL_RANGES[channel_name])
+    if channel_name in SPIKE_RATE_LIMITS or channel_name in CIRCULAR_CHANNELS:
+        rate_limit = SPIKE_RATE_LIMITS.get(channel_name, 180.0)
+        flags |= spike_test(timestamps, mean, rate_limit, channel_name in CIRCULAR_CHANNELS)
+    stuck_run_length = (STUCK_RUN_LENGTHS if stuck_run_lengths is None else stuck_run_lengths).get(channel_name)
+    if stuck_run_length:
+        flags |= stuck_test(mean, stuck_run_length)
+    if sample_count is not None:
+        flags |= low_count_test(np.asarray(sample_count, dtype=np.float64), min_reading_count)
+    if tilt is not None:
+        flags |= tilt_test(np.asarray(tilt, dtype=np.float64), max_tilt)
+    if stdev is not None:
+        flags |= stdev_test(mean, np.asarray(stdev, dtype=np.float64),
+                            None if minimum is None else np.asarray(minimum, dtype=np.float64),
+                            None if maximum is None else np.asarray(maximum, dtype=np.float64))
+    return flags
+
+
+# Channel 'data' statistics gathered into arrays by sensor_channel_arrays
+CHANNEL_STAT_FIELDS = ('mean', 'min', 'max', 'stdev', 'sample_count')
+
+
+def _stat_columns(stats):
+    """Return CHANNEL_STAT_FIELDS -> float64 array of a list of channel 'data' dicts."""
+    keys = [key for key in CHANNEL_STAT_FIELDS if key in stats[0]]
+    columns = dict.fromkeys(CHANNEL_STAT_FIELDS)
+    if keys and len(set(map(len, stats))) == 1:
+        # Same keys in every dict (the usual case): read all fields in one C-level pass
+        getter = itemgetter(*keys) if len(keys) > 1 else (lambda channel_stats: (channel_stats[keys[0]],))
+        try:
+            values = np.fromiter(chain.from_iterable(map(getter, stats)), dtype=np.float64,
+                                 count=len(stats) * len(keys)).reshape(len(stats), len(keys))
+        except (KeyError, TypeError):
+            # A field missing from some dicts, or reported as None
+            values = None
+        if values is not None:
+            for i, key in enumerate(keys):
+                columns[key] = values[:, i]
+    for key in CHANNEL_STAT_FIELDS:
+        if columns[key] is None:
+            columns[key] = np.array([channel_stats.get(key, np.nan) for channel_stats in stats], dtype=np.float64)
+    return columns
+
+
+def _same_channel_columns(data, wanted):
+    """
+    Fast path of sensor_channel_arrays for the usual case of every payload reporting the same
+    channels in the same order: the channel data are transposed by slicing one flat list.
+    Returns channel name -> (index, stats), or None if the payloads differ.
+    """
+    decoded_values = [payload.get('decoded_value') for payload in data]
+    if not decoded_values or not decoded_values[0]:
+        return None
+    layout = [item['channel_name'] for item in decoded_values[0]]
+    n_channels = len(layout)
+    if len(set(layout)) != n_channels or any(len(decoded_value or ()) != n_channels for decoded_value in decoded_values):
+        return None
+    items = [item for decoded_value in decoded_values for item in decoded_value]
+    if [item['channel_name'] for item in items] != layout * len(decoded_values):
+        return None
+    stats = [item['data'] for item in items]
+    index = range(len(decoded_values))
+    return {channel_name: (index, stats[i::n_channels])
+            for i, channel_name in enumerate(layout) if wanted is None or channel_name in wanted}
+
+
+def sensor_channel_arrays(data, channel_names=None):
+    """
+    Collect the channels of a single sensor's payloads into numpy arrays, in one pass over the payloads.
+
+    Parameters:
+    - data (list): payloads with 'decoded_value's, all from the same sensor.
+    - channel_names (list): Channels to collect, defaults to every channel present.
+
+    Returns:
+    dict: channel name -> dict of 'index' (position of each sample's payload in data), 'timestamp' (datetime64[ms]),
+          float64 arrays 'mean', 'min', 'max', 'stdev', 'sample_count' (NaN where not reported),
+          and 'stats', the list of channel 'data' dicts the arrays were read from.
+    """
+    wanted = None if channel_names is None else set(channel_names)
+    columns = _same_channel_columns(data, wanted)
+    if columns is None:
+        columns = {}
+        for i, payload in enumerate(data):
+            for item in payload.get('decoded_value') or ():
+                channel_name = item['channel_name']
+                column = columns.get(channel_name)
+                if column is None:
+                    if wanted is not None and channel_name not in wanted:
+                        continue
+                    column = columns[channel_name] = ([], [])
+                column[0].append(i)
+                column[1].append(item['data'])
+
+    timestamps = parse_timestamps([payload['timestamp'] for payload in data]) if columns else None
+    arrays = {}
+    for channel_name, (index, stats) in columns.items():
+        index = np.arange(len(index)) if isinstance(index, range) else np.array(index, dtype=np.int64)
+        arrays[channel_name] = {"index": index, "timestamp": timestamps[index], "stats": stats}
+        arrays[channel_name].update(_stat_columns(stats))
+    return arrays
+
+
+def channel_arrays(data, channel_name):
+    """
+    Collect one channel of a single sensor's payloads into numpy arrays, see sensor_channel_arrays.
+    To read several channels of the same payloads, call sensor_channel_arrays once instead.
+    """
+    arrays = sensor_channel_arrays(data, [channel_name]).get(channel_name)
+    if arrays is None:
+        arrays = {"index": np.empty(0, dtype=np.int64), "timestamp": np.empty(0, dtype='datetime64[ms]'), "stats": []}
+        arrays.update((key, np.empty(0)) for key in CHANNEL_STAT_FIELDS)
+    return arrays
+
+
+def qc_sensor_data(data, channel_names=None, **kwargs):
+    """
+    Run QC over every channel of a single sensor's payloads, storing flags in place.
+
+    Each channel's 'data' dict gets a 'qc_flags' int. Tilt flags derived from the
+    'Abs Tilt[Deg]' channel apply to the TILT_FLAGGED_CHANNELS of the same payload.
+
+    Parameters:
+    - data (list): payloads with 'decoded_value's, all from the same sensor, in time order.
+    - channel_names (list): Channels to test, defaults to every channel present.
+    - kwargs: Overrides for qc_channel thresholds.
+
+    Returns:
+    dict: channel name -> uint8 flags array, aligned with channel_arrays(data, channel_name).
+    """
+    if channel_names is None:
+        gathered = sensor_channel_arrays(data)
+        channel_names = list(gathered)
+    else:
+        gathered = sensor_channel_arrays(data, list(channel_names) + [TILT_CHANNEL_NAME])
+    payload_tilt = None
+    if TILT_CHANNEL_NAME in gathered:
+        payload_tilt = np.full(len(data), np.nan)
+        payload_tilt[gathered[TILT_CHANNEL_NAME]['index']] = gathered[TILT_CHANNEL_NAME]['mean']
+
+    channel_flags = {}
+    for channel_name in channel_names:
+        arrays = gathered.get(channel_name)
+        if arrays is None:
+            channel_flags[channel_name] = np.empty(0, dtype=np.uint8)
+            continue
+        has_min_max = not np.all(np.isnan(arrays['min']))
+        flags = qc_channel(
+            channel_name,
+            arrays['timestamp'],
+            arrays['mean'],
+            stdev=arrays['stdev'],
+            sample_count=arrays['sample_count'],
+            tilt=None if payload_tilt is None or channel_name not in TILT_FLAGGED_CHANNELS else payload_tilt[arrays['index']],
+            minimum=arrays['min'] if has_min_max else None,
+            maximum=arrays['max'] if has_min_max else None,
+            **kwargs
+        )
+        for channel_stats, flag in zip(arrays['stats'], flags.tolist()):
+            channel_stats['qc_flags'] = flag
+        channel_flags[channel_name] = flags
+    return channel_flags
+
+
+def apply_qc_flags(data, channel_names=None, **kwargs):
+    """
+    Run QC over a decoded sensor-data response, sensor by sensor, storing flags in place.
+
+    Parameters:
+    - data (dict): The decoded response, see lib.api_functions.fetch_and_decode_sensor_data
+                   and lib.api_functions.fetch_and_decode_beta2_data.
+    - channel_names (list): Channels to test, defaults to every channel present.
+    - kwargs: Overrides for qc_channel thresholds.
+
+    Returns:
+    dict: The input data, with 'qc_flags' added to each channel's 'data'.
+    """
+    sensors = defaultdict(list)
+    for payload in data.get('data', []):
+        if payload.get('decoded_value'):
+            sensors[sensor_key(payload)].append(payload)
+    for sensor_data in sensors.values():
+        order = np.argsort(parse_timestamps([payload['timestamp'] for payload in sensor_data]), kind='stable')
+        qc_sensor_data([sensor_data[i] for i in order.tolist()], channel_names, **kwargs)
+    return data
+
+
+def describe_flags(flags):
+    """Return the names of the QC tests set in a flags value."""
+    return [name for bit, name in QC_FLAG_NAMES.items() if flags & bit]
@@ -0,0 +1,302 @@
+# -------------------------------------------------------------------------------
+# Name:        records.py
+# Purpose:     Compact, dict-compatible record types for decoded sensor-data
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from array import array
+from collections.abc import MutableMapping, Sequence
+from sys import intern
+
+_MISSING = object()
+
+
+class SlottedRecord(MutableMapping):
+    """
+    Base of the compact records: a fixed set of fields stored in __slots__, read and
+    written like dict keys so code written against the dict-shaped output keeps working.
+
+    A field that was never assigned is a missing key. Keys outside the record's
+    FIELDS go to an overflow dict, created on first use, and iterate after the
+    fields. Use to_dict() where a real dict is needed, e.g.
+    json.dumps(..., default=record_to_json).
+    """
+
+    __slots__ = ('_extra',)
+    FIELDS = ()
+
+    def __init__(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def _extra_fields(self):
+        return getattr(self, '_extra', None) or {}
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return self._extra_fields()[key]
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        return self._extra_fields().get(key, default)
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key, _MISSING) is not _MISSING
+        return key in self._extra_fields()
+
+    def __setitem__(self, key, value):
+        if key in self.FIELDS:
+            setattr(self, key, value)
+            return
+        extra = getattr(self, '_extra', None)
+        if extra is None:
+            extra = self._extra = {}
+        extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self.FIELDS:
+            delattr(self, key)
+        else:
+            del self._extra[key]
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if getattr(self, key, _MISSING) is not _MISSING:
+                yield key
+        yield from self._extra_fields()
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """Return the record as plain dicts and lists, recursively."""
+        return {key: _to_plain(value) for key, value in self.items()}
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+
+def _to_plain(value):
+    if isinstance(value, SlottedRecord):
+        return value.to_dict()
+    if isinstance(value, (list, SampleValues)):
+        return [_to_plain(item) for item in value]
+    return value
+
+
+def record_to_json(value):
+    """json.dumps default hook serializing compact records as dicts."""
+    if isinstance(value, SlottedRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# (units, unit_type, data_type_name) -> the one shared tuple
+_sample_metadata = {}
+
+
+def sample_metadata(units, unit_type, data_type_name):
+    """Return the shared, interned (units, unit_type, data_type_name) tuple."""
+    key = (units, unit_type, data_type_name)
+    metadata = _sample_metadata.get(key)
+    if metadata is None:
+        metadata = _sample_metadata[key] = tuple(intern(item) if isinstance(item, str) else item for item in key)
+    return metadata
+
+
+class _SampleMetadataFields(SlottedRecord):
+    """Records whose units / unit_type / data_type_name are one shared tuple instead of three strings."""
+
+    __slots__ = ()
+
+    def _set_metadata(self, index, value):
+        metadata = list(getattr(self, '_metadata', (None, None, None)))
+        metadata[index] = value
+        self._metadata = sample_metadata(*metadata)
+
+    units = property(lambda self: self._metadata[0], lambda self, value: self._set_metadata(0, value))
+    unit_type = property(lambda self: self._metadata[1], lambda self, value: self._set_metadata(1, value))
+    data_type_name = property(lambda self: self._metadata[2], lambda self, value: self._set_metadata(2, value))
+
+
+class SampleValue(_SampleMetadataFields):
+    """One Beta 2 sample value, see lib.beta2_data.group_sensor_data."""
+
+    __slots__ = ('_metadata', 'value')
+    FIELDS = ('units', 'value', 'unit_type', 'data_type_name')
+
+    def __init__(self, units, value, unit_type, data_type_name):
+        self._metadata = sample_metadata(units, unit_type, data_type_name)
+        self.value = value
+
+
+# (sample metadata, value is int) of every sample value of a datum -> the one shared tuple
+_sample_layouts = {}
+
+
+class SampleValues(Sequence):
+    """
+    Read-only, array-backed 'sample_values' list of one LocatedDatum.
+
+    Numeric values are packed in a float64 array; the metadata of the datum's
+    sample values is one tuple shared by every datum reporting the same
+    data_type_names. Items are SampleValue records built on access.
+    """
+
+    __slots__ = ('_layout', '_values')
+
+    def __init__(self, sample_values):
+        layout = []
+        values = []
+        for sample_value in sample_values:
+            value = sample_value['value']
+            layout.append((sample_metadata(sample_value['units'], sample_value['unit_type'], sample_value['data_type_name']),
+                           type(value) is int))
+            values.append(value)
+        layout = tuple(layout)
+        self._layout = _sample_layouts.setdefault(layout, layout)
+        if all(type(value) in (int, float) for value in values):
+            self._values = array('d', values)
+        else:
+            self._values = tuple(values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def _item(self, index):
+        metadata, is_int = self._layout[index]
+        value = self._values[index]
+        if is_int and isinstance(self._values, array):
+            value = int(value)
+        return SampleValue(metadata[0], value, metadata[1], metadata[2])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("sample value index out of range")
+        return self._item(index)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, SampleValues)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class SensorPayload(_SampleMetadataFields):
+    """One raw sensor-data payload, e.g. a DVT1 hex payload, see lib.api_functions.decode_sensor_data."""
+
+    __slots__ = ('_metadata', 'latitude', 'longitude', 'timestamp', 'sensorPosition', 'bristlemouth_node_id',
+                 'value', 'decoded_value')
+    FIELDS = ('latitude', 'longitude', 'timestamp', 'sensorPosition', 'bristlemouth_node_id',
+              'units', 'value', 'unit_type', 'data_type_name', 'decoded_value')
+
+    def __init__(self, payload):
+        self._metadata = sample_metadata(payload.get('units'), payload.get('unit_type'), payload.get('data_type_name'))
+        for key, value in payload.items():
+            if key in ('units', 'unit_type', 'data_type_name'):
+                continue
+            if key == 'bristlemouth_node_id' and isinstance(value, str):
+                value = intern(value)
+            elif key == 'decoded_value' and value is not None:
+                value = compact_decoded_value(value)
+            self[key] = value
+
+
+class LocatedDatum(SlottedRecord):
+    """The sample values of one sensor at one time and place, see lib.beta2_data.group_sensor_data."""
+
+    __slots__ = ('timestamp', 'latitude', 'longitude', 'sensorPosition', 'bristlemouth_node_id', 'sample_values',
+                 'decoded_value')
+    FIELDS = __slots__
+
+    def __init__(self, timestamp, latitude, longitude, sensorPosition, bristlemouth_node_id, sample_values):
+        """sample_values are dicts or SampleValue records, packed into SampleValues."""
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.sensorPosition = sensorPosition
+        self.bristlemouth_node_id = intern(bristlemouth_node_id) if isinstance(bristlemouth_node_id, str) else bristlemouth_node_id
+        self.sample_values = sample_values if isinstance(sample_values, SampleValues) else SampleValues(sample_values)
+
+
+class ChannelStats(SlottedRecord):
+    """The 'data' of one decoded channel. Keys iterate in a fixed order, matching both DVT1 and Beta 2 output."""
+
+    __slots__ = ('sample_count', 'min', 'max', 'mean', 'stdev', 'qc_flags')
+    FIELDS = __slots__
+
+
+class ChannelValue(SlottedRecord):
+    """One entry of a 'decoded_value' list: a channel name, interned, and its ChannelStats."""
+
+    __slots__ = ('data', 'channel_name')
+    FIELDS = __slots__
+
+    def __init__(self, data, channel_name):
+        self.data = data
+        self.channel_name = intern(channel_name)
+
+
+def compact_decoded_value(decoded_value):
+    """Convert a 'decoded_value' list of channel dicts to ChannelValue records."""
+    return [ChannelValue(ChannelStats(channel['data']), channel['channel_name']) for channel in decoded_value]
+
+
+def compact_record(record):
+    """
+    Return a decoded or grouped sensor-data dict as a compact record.
+
+    Parameters:
+    - record (dict): a raw payload (see lib.api_functions.decode_sensor_data) or a
+                     grouped Beta 2 datum (see lib.beta2_data.group_sensor_data).
+
+    Returns:
+    SlottedRecord: A SensorPayload or LocatedDatum. A record that is already compact is
+                   returned with its 'decoded_value' compacted.
+    """
+    if isinstance(record, SlottedRecord):
+        decoded_value = record.get('decoded_value')
+        if decoded_value and not isinstance(decoded_value[0], ChannelValue):
+            record['decoded_value'] = compact_decoded_value(decoded_value)
+        return record
+    if 'sample_values' in record:
+        located_datum = LocatedDatum(
+            record['timestamp'], record['latitude'], record['longitude'], record['sensorPosition'],
+            record.get('bristlemouth_node_id'), record['sample_values'])
+        for key, value in record.items():
+            if key not in LocatedDatum.FIELDS:
+                located_datum[key] = value
+        if record.get('decoded_value') is not None:
+            located_datum.decoded_value = compact_decoded_value(record['decoded_value'])
+        return located_datum
+    return SensorPayload(record)
+
+
+def compact_records(records):
+    """
+    Convert decoded or grouped sensor-data dicts to compact records in place, see compact_record.
+
+    Returns:
+    list: The input list, each dict replaced by a SensorPayload or LocatedDatum.
+    """
+    for i, record in enumerate(records):
+        records[i] = compact_record(record)
+    return records
@@ -10,8 +10,14 @@
 
 import re
 from lib.binary_decoder import DVT1_DATA_CHANNELS
+from lib.quality_control import QC_ALL
 import argparse
 
+QC_MODES = ['off', 'mask', 'plot']
+
+# Layouts of lib.overview_plot.OverviewPlot, kept here so parsing arguments does not import matplotlib
+OVERVIEW_LAYOUTS = ['shared', 'grid']
+
 
 def get_plot_handles_for_channels(channels):
     """
@@ -92,6 +98,46 @@ def get_channels_from_args(args, full_plot_handles):
     return selected_channels
 
 
+def add_qc_arg(parser):
+    """
+    Add an argparse argument to the provided parser for selecting how QC flagged samples are shown.
+
+    'mask' removes flagged samples from the plotted lines, 'plot' also marks them separately.
+    """
+    parser.add_argument("-qc", "--qc",
+                        choices=QC_MODES,
+                        default='off',
+                        help="Run data-quality tests and 'mask' flagged samples or also 'plot' them separately.")
+
+
+def get_qc_options_from_args(qc_mode):
+    """
+    Return the (qc_mask, plot_flagged) plotting options for a --qc mode.
+    See lib.plotting_functions.plot_grouped_data
+    """
+    if qc_mode == 'mask':
+        return QC_ALL, False
+    if qc_mode == 'plot':
+        return QC_ALL, True
+    return 0, False
+
+
+def add_overview_arg(parser):
+    """
+    Add an argparse argument to the provided parser for plotting every sensor in one overview figure.
+
+    'shared' (the default with a bare --overview) overlays the sensors on one axes per channel, 'grid' draws
+    a small plot per channel and sensor, paged over several figures for many sensors.
+    See lib.overview_plot.OverviewPlot
+    """
+    parser.add_argument("--overview",
+                        nargs='?',
+                        const='shared',
+                        choices=OVERVIEW_LAYOUTS,
+                        default=None,
+                        help="Plot all sensors in a single overview figure ('shared' axes, the default, or a 'grid'), click for detail.")
+
+
 # Test
 if __name__ == "__main__":
     print(get_plot_handles_for_channels(DVT1_DATA_CHANNELS))
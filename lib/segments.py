@@ -0,0 +1,112 @@
+# -------------------------------------------------------------------------------
+# Name:        segments.py
+# Purpose:     Gap index and segment tables of contiguous sensor-data runs
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from datetime import timedelta
+
+import numpy as np
+
+from lib.dataset_cache import cached_index
+from lib.timestamps import parse_timestamps
+from lib.topology import get_sensor_index
+
+DEFAULT_GAP_THRESHOLD = timedelta(minutes=75)
+
+
+class SegmentTable:
+    """
+    Gap index of one sensor's samples.
+
+    The time differences between consecutive samples are computed once. Segments
+    (contiguous runs with no gap longer than a threshold) are derived from them on
+    demand and cached per threshold, so plotting, resampling and export can share
+    one table across every channel of the sensor.
+
+    Parameters:
+    - timestamps (np.ndarray): datetime64 sample times of the sensor, ascending, one per payload.
+    """
+
+    def __init__(self, timestamps):
+        self.timestamps = np.asarray(timestamps, dtype='datetime64[ms]')
+        self.gaps = np.diff(self.timestamps)
+        self._breaks = {}
+
+    @classmethod
+    def from_payloads(cls, data):
+        """Build the table of a list of payloads, see lib.plotting_functions.group_by_sensor_position."""
+        return cls(parse_timestamps(payload['timestamp'] for payload in data))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def break_indices(self, gap_threshold=DEFAULT_GAP_THRESHOLD):
+        """Return the sample indices that start a new segment after a gap longer than gap_threshold."""
+        threshold = np.timedelta64(gap_threshold).astype('timedelta64[ms]')
+        if threshold not in self._breaks:
+            self._breaks[threshold] = np.flatnonzero(self.gaps > threshold) + 1
+        return self._breaks[threshold]
+
+    def segments(self, gap_threshold=DEFAULT_GAP_THRESHOLD):
+        """
+        Return the segment table for gap_threshold.
+
+        Returns:
+        np.ndarray: (n_segments, 2) array of [start, end) sample indices.
+        """
+        if not len(self):
+            return np.empty((0, 2), dtype=np.int64)
+        breaks = self.break_indices(gap_threshold)
+        return np.column_stack((np.concatenate(([0], breaks)), np.append(breaks, len(self))))
+
+    def segment_ids(self, gap_threshold=DEFAULT_GAP_THRESHOLD):
+        """Return the segment number of every sample, usable as a mask or group key."""
+        segment_ids = np.zeros(len(self), dtype=np.int64)
+        segment_ids[self.break_indices(gap_threshold)] = 1
+        return np.cumsum(segment_ids)
+
+    def iter_segments(self, gap_threshold=DEFAULT_GAP_THRESHOLD):
+        """Yield a slice per segment, to index arrays aligned with the sensor's samples without copying."""
+        for start, end in self.segments(gap_threshold).tolist():
+            yield slice(start, end)
+
+
+def get_segment_tables(dataset, group_field):
+    """
+    Return the segment tables of a decoded dataset, one SegmentTable per sensor.
+
+    The tables are computed once and kept in lib.dataset_cache, not in the dataset,
+    until the sensors or timestamps of dataset['data'] change.
+
+    Parameters:
+    - dataset (dict): decoded sensor-data, see lib.api_functions.decode_beta2_data.
+    - group_field (str): payload field identifying the sensor, 'sensorPosition' or 'bristlemouth_node_id'.
+    -- must match the grouping used to plot, see lib.plotting_functions.group_by_sensor_position
+
+    Returns:
+    dict: sensor -> SegmentTable.
+    """
+    data = dataset.get('data', [])
+    timestamps = [payload['timestamp'] for payload in data]
+    sensors = [payload.get(group_field, 'None') for payload in data]
+
+    def build():
+        sensor_index = get_sensor_index(dataset, group_field)
+        sample_times = parse_timestamps(timestamps)
+        return {sensor: SegmentTable(sample_times[sensor_index.indices(sensor)]) for sensor in sensor_index.categories}
+
+    return cached_index(('segments', group_field), data, (sensors, timestamps), build)
+
+
+def segment_bounds(timestamps, gap_threshold=DEFAULT_GAP_THRESHOLD):
+    """
+    Return (start_timestamp, end_timestamp, n_samples) rows of the segments of sorted timestamp strings.
+    Used to keep the segment table of the local store up to date.
+    """
+    table = SegmentTable(parse_timestamps(timestamps))
+    return [(timestamps[start], timestamps[end - 1], end - start) for start, end in table.segments(gap_threshold).tolist()]
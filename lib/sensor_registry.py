@@ -0,0 +1,235 @@
+# -------------------------------------------------------------------------------
+# Name:        sensor_registry.py
+# Purpose:     Registry of Bristlemouth sensor module types and their decoders
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+from math import degrees
+
+from lib.binary_decoder import (
+    decode_payload_to_structs,
+    get_struct_size_bytes,
+    BETA_2_DATA_CHANNELS,
+    DVT1_DATA_CHANNELS,
+    DVT1_STRUCT_DESCRIPTION,
+    RBR_CODA_DATA_CHANNELS,
+    RBR_CODA_STRUCT_DESCRIPTION,
+    SOFT_DATA_CHANNELS,
+)
+
+SENSOR_TYPE_AANDERAA = "aanderaa"
+SENSOR_TYPE_AANDERAA_DVT1 = "aanderaa_dvt1"
+SENSOR_TYPE_SOFT = "soft"
+SENSOR_TYPE_RBR_CODA = "rbr_coda"
+SENSOR_TYPE_UNKNOWN = "unknown"
+
+
+class SensorType:
+    """
+    Declaration of one sensor module type.
+
+    Beta 2 modules report one sample value per data_type_name, which 'fields' maps
+    onto channel data; binary modules report hex payloads of 'struct_description'
+    structs, one per channel.
+
+    Parameters:
+    - name (str): One of the SENSOR_TYPE_* constants, or a new type name.
+    - channels (list of str): Channel names of the module, see lib.binary_decoder.
+    - data_type_prefix (str): Prefix of the module's Beta 2 data_type_names, e.g. 'bm_soft_'.
+    - fields (list): (channel_name, [(field, data_type_name, conversion)]) in decoded order,
+    -- conversion is a function applied to the sample value (e.g. math.degrees for radians) or None.
+    - required (list of str): data_type_names without which a datum is skipped.
+    - check (function): check(located_datum, sample_values_dict) -> bool, False skips the datum.
+    - struct_description (list): Binary schema of the module's hex payloads.
+    """
+
+    def __init__(self, name, channels, data_type_prefix=None, fields=None, required=None, check=None,
+                 struct_description=None):
+        self.name = name
+        self.channels = list(channels)
+        self.data_type_prefix = data_type_prefix
+        self.fields = fields or []
+        self.required = required or []
+        self.check = check
+        self.struct_description = struct_description
+
+    @property
+    def channel_names(self):
+        """Channel names of both encodings: the binary channels, then the Beta 2 channels not among them."""
+        return list(dict.fromkeys(self.channels + [channel_name for channel_name, _ in self.fields]))
+
+    @property
+    def payload_size_bytes(self):
+        """Size of a hex payload carrying one struct per channel, or None for Beta 2 modules."""
+        if self.struct_description is None:
+            return None
+        return len(self.channels) * get_struct_size_bytes(self.struct_description)
+
+    def format_datum(self, located_datum):
+        """
+        Format the sample values of one grouped Beta 2 datum into this module's channel data.
+
+        Parameters:
+        located_datum (dict): one element of the output of lib.beta2_data.group_sensor_data
+
+        Returns:
+        list of dict: the 'decoded_value' channel list, or None if the datum is skipped.
+        """
+        sample_values_dict = {}
+        for sample_value in located_datum["sample_values"]:
+            sample_values_dict[sample_value["data_type_name"]] = sample_value
+
+        if any(data_type_name not in sample_values_dict for data_type_name in self.required):
+            return None
+        if self.check is not None and not self.check(located_datum, sample_values_dict):
+            return None
+
+        decoded_value = []
+        for channel_name, channel_fields in self.fields:
+            channel_data = {}
+            for field, data_type_name, conversion in channel_fields:
+                value = sample_values_dict[data_type_name]["value"]
+                channel_data[field] = conversion(value) if conversion else value
+            decoded_value.append({"data": channel_data, "channel_name": channel_name})
+        return decoded_value
+
+    def decode_payload(self, hex_payload):
+        """Decode a hex payload into this module's channel data, see lib.binary_decoder.decode_payload_to_structs."""
+        return decode_payload_to_structs(hex_payload, self.channels, self.struct_description)
+
+    def decode(self, record):
+        """Decode a grouped Beta 2 datum or a raw hex payload, returning its 'decoded_value' or None."""
+        if 'sample_values' in record:
+            return self.format_datum(record) if self.fields else None
+        if self.struct_description is not None and record.get('units') == 'hex':
+            return self.decode_payload(record.get('value', ''))
+        return None
+
+
+SENSOR_TYPES = {}
+
+
+def register_sensor_type(sensor_type):
+    """Add a SensorType to the registry, replacing any type of the same name. Returns the sensor_type."""
+    SENSOR_TYPES[sensor_type.name] = sensor_type
+    return sensor_type
+
+
+def get_sensor_type(name):
+    """Return the registered SensorType called name, or None."""
+    return SENSOR_TYPES.get(name)
+
+
+def detect_sensor_type(record):
+    """
+    Return the sensor type name of a record.
+
+    Parameters:
+    - record (dict): a grouped Beta 2 datum (see lib.beta2_data.group_sensor_data),
+                     or a raw sensor-data payload.
+
+    Returns:
+    str: A registered sensor type name, or SENSOR_TYPE_UNKNOWN.
+    """
+    if 'sample_values' in record:
+        data_type_names = [sample_value['data_type_name'] for sample_value in record['sample_values']]
+    elif record.get('units') == 'hex':
+        hex_payload = record.get('value', '').replace(" ", "").replace("\n", "")
+        for sensor_type in SENSOR_TYPES.values():
+            if sensor_type.payload_size_bytes == len(hex_payload) // 2:
+                return sensor_type.name
+        return SENSOR_TYPE_UNKNOWN
+    else:
+        data_type_names = [record.get('data_type_name', '')]
+    for data_type_name in data_type_names:
+        for sensor_type in SENSOR_TYPES.values():
+            if sensor_type.data_type_prefix and data_type_name.startswith(sensor_type.data_type_prefix):
+                return sensor_type.name
+    return SENSOR_TYPE_UNKNOWN
+
+
+def decode_record(record, sensor_type_name):
+    """Decode a record with the decoder of its sensor type, returning its 'decoded_value' or None."""
+    sensor_type = SENSOR_TYPES.get(sensor_type_name)
+    if sensor_type is None:
+        return None
+    return sensor_type.decode(record)
+
+
+def _aanderaa_orientation_check(located_datum, sample_values_dict):
+    """Skip Aanderaa data from horizontal sensors, or without tilt data."""
+    if (
+        "aanderaa_abs_speed_mean_15bits" not in sample_values_dict
+        and "aanderaa_abs_tilt_mean_8bits" in sample_values_dict
+        and degrees(sample_values_dict["aanderaa_abs_tilt_mean_8bits"]["value"])
+        > 75.0
+    ):
+        print(f"Sensor {located_datum['sensorPosition']} horizontal at {located_datum['timestamp']}")
+        return False
+    elif "aanderaa_abs_tilt_mean_8bits" not in sample_values_dict:
+        position, timestamp = located_datum["sensorPosition"], located_datum["timestamp"]
+        print(f"Sensor {position} has no tilt data at {timestamp}")
+        return False
+    return True
+
+
+# Aanderaa current meter, Beta 2 encoding. Angles are reported in radians.
+register_sensor_type(SensorType(
+    SENSOR_TYPE_AANDERAA,
+    BETA_2_DATA_CHANNELS,
+    data_type_prefix="aanderaa_",
+    fields=[
+        ("Abs Speed[cm/s]", [
+            ("sample_count", "aanderaa_reading_count_10bits", None),
+            ("mean", "aanderaa_abs_speed_mean_15bits", None),
+            ("stdev", "aanderaa_abs_speed_std_15bits", None),
+        ]),
+        ("Abs Tilt[Deg]", [
+            ("sample_count", "aanderaa_reading_count_10bits", None),
+            ("mean", "aanderaa_abs_tilt_mean_8bits", degrees),
+            ("stdev", "aanderaa_std_tilt_mean_8bits", degrees),
+        ]),
+        ("Direction[Deg.M]", [
+            ("sample_count", "aanderaa_reading_count_10bits", None),
+            ("mean", "aanderaa_direction_circ_mean_13bits", degrees),
+            ("stdev", "aanderaa_direction_circ_std_13bits", degrees),
+        ]),
+        ("Temperature[ºC]", [
+            ("sample_count", "aanderaa_reading_count_10bits", None),
+            ("mean", "aanderaa_temperature_mean_13bits", None),
+        ]),
+    ],
+    check=_aanderaa_orientation_check,
+))
+
+# Feb '24 DVT SOFT temperature module
+register_sensor_type(SensorType(
+    SENSOR_TYPE_SOFT,
+    SOFT_DATA_CHANNELS,
+    data_type_prefix="bm_soft_",
+    fields=[
+        ("Temperature[ºC]", [
+            ("mean", "bm_soft_temperature_mean_13bits", None),
+        ]),
+    ],
+    required=["bm_soft_temperature_mean_13bits"],
+))
+
+# Aanderaa current meter, DVT1 binary encoding
+register_sensor_type(SensorType(
+    SENSOR_TYPE_AANDERAA_DVT1,
+    DVT1_DATA_CHANNELS,
+    struct_description=DVT1_STRUCT_DESCRIPTION,
+))
+
+# Feb '24 DVT RBR Coda temperature / pressure module, binary encoding only: its Beta 2
+# data_type_names are not documented yet, so its grouped sample values are not decoded.
+register_sensor_type(SensorType(
+    SENSOR_TYPE_RBR_CODA,
+    RBR_CODA_DATA_CHANNELS,
+    struct_description=RBR_CODA_STRUCT_DESCRIPTION,
+))
@@ -0,0 +1,163 @@
+# -------------------------------------------------------------------------------
+# Name:        spatial_query.py
+# Purpose:     Spatial and temporal queries over archived Spotter positions
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import numpy as np
+
+from lib.timestamps import parse_timestamps, to_datetime64
+from lib.topology import sensor_key
+
+EARTH_RADIUS_KM = 6371.0088
+# Same sphere as haversine_km, so query bounding boxes never fall short of the radius
+KM_PER_DEGREE_LAT = 2 * np.pi * EARTH_RADIUS_KM / 360.0
+DEFAULT_CELL_SIZE_DEG = 0.1
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km between points given in degrees, vectorized over numpy arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class PositionIndex:
+    """
+    Grid and time index over the positions reported with sensor-data.
+
+    Positions are bucketed into cell_size_deg lat/lon grid cells and sorted by
+    (cell, time). A query only visits the cells overlapping its bounding box and
+    binary-searches the time range inside each of them, then filters the candidates
+    by exact great-circle distance. Results are returned as columnar numpy arrays.
+
+    Parameters:
+    - spotter_ids, sensor_keys (array-like of str): Spotter and sensor of each position.
+    - timestamps (array-like): datetime64 time of each position.
+    - latitudes, longitudes (array-like of float): Position in degrees.
+    - cell_size_deg (float): Grid cell size in degrees.
+    """
+
+    def __init__(self, spotter_ids, sensor_keys, timestamps, latitudes, longitudes, cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        self.cell_size_deg = cell_size_deg
+        self.n_lon_cells = int(np.ceil(360.0 / cell_size_deg))
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        timestamps = np.asarray(timestamps, dtype='datetime64[ms]')
+        valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+
+        cells = self._cells(latitudes[valid], longitudes[valid])
+        order = np.lexsort((timestamps[valid], cells))
+        self.cells = cells[order]
+        self.timestamps = timestamps[valid][order]
+        self.latitudes = latitudes[valid][order]
+        self.longitudes = longitudes[valid][order]
+        self.spotter_ids = np.asarray(spotter_ids, dtype=object)[valid][order]
+        self.sensor_keys = np.asarray(sensor_keys, dtype=object)[valid][order]
+        self.cell_keys, self.cell_starts = np.unique(self.cells, return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(self.cells))
+
+    @classmethod
+    def from_store(cls, store, start_date=None, end_date=None, cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        """Build the index from the positions archived in a lib.local_store.LocalStore."""
+        rows = store.read_positions(start_date, end_date)
+        spotter_ids, sensor_keys, timestamps, latitudes, longitudes = zip(*rows) if rows else ([], [], [], [], [])
+        return cls(spotter_ids, sensor_keys, parse_timestamps(timestamps),
+                   np.array(latitudes, dtype=np.float64), np.array(longitudes, dtype=np.float64), cell_size_deg)
+
+    @classmethod
+    def from_grouped_data(cls, spotter_id, data, cell_size_deg=DEFAULT_CELL_SIZE_DEG):
+        """Build the index from the output of lib.beta2_data.group_sensor_data for one Spotter."""
+        data = [located_datum for located_datum in data
+                if located_datum.get('latitude') is not None and located_datum.get('longitude') is not None]
+        return cls([spotter_id] * len(data),
+                   [sensor_key(located_datum) for located_datum in data],
+                   parse_timestamps(located_datum['timestamp'] for located_datum in data),
+                   np.array([located_datum['latitude'] for located_datum in data], dtype=np.float64),
+                   np.array([located_datum['longitude'] for located_datum in data], dtype=np.float64),
+                   cell_size_deg)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def _lat_cells(self, latitudes):
+        return np.floor((np.clip(latitudes, -90.0, 90.0) + 90.0) / self.cell_size_deg).astype(np.int64)
+
+    def _lon_cells(self, longitudes):
+        return np.floor(((longitudes + 180.0) % 360.0) / self.cell_size_deg).astype(np.int64) % self.n_lon_cells
+
+    def _cells(self, latitudes, longitudes):
+        return self._lat_cells(latitudes) * self.n_lon_cells + self._lon_cells(longitudes)
+
+    def _candidates(self, lat_min, lat_max, lon_min, lon_span, start, end):
+        """Indices of positions in the cells covering the box and inside [start, end]."""
+        lat_cells = np.arange(self._lat_cells(lat_min), self._lat_cells(lat_max) + 1)
+        n_lon = min(self.n_lon_cells, int(np.ceil(lon_span / self.cell_size_deg)) + 2)
+        lon_cells = (self._lon_cells(lon_min) + np.arange(n_lon)) % self.n_lon_cells
+        cells = (lat_cells[:, None] * self.n_lon_cells + np.unique(lon_cells)[None, :]).ravel()
+
+        found = np.searchsorted(self.cell_keys, cells)
+        found = found[(found < len(self.cell_keys)) & (self.cell_keys[np.minimum(found, len(self.cell_keys) - 1)] == cells)]
+        ranges = []
+        for cell_start, cell_end in zip(self.cell_starts[found].tolist(), self.cell_ends[found].tolist()):
+            cell_times = self.timestamps[cell_start:cell_end]
+            lo = cell_start + (np.searchsorted(cell_times, start, 'left') if start is not None else 0)
+            hi = cell_start + (np.searchsorted(cell_times, end, 'right') if end is not None else len(cell_times))
+            if hi > lo:
+                ranges.append(np.arange(lo, hi))
+        return np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+    def _result(self, index, distances=None):
+        order = np.argsort(self.timestamps[index], kind='stable')
+        index = index[order]
+        result = {
+            "spotter_id": self.spotter_ids[index],
+            "sensor_key": self.sensor_keys[index],
+            "timestamp": self.timestamps[index],
+            "latitude": self.latitudes[index],
+            "longitude": self.longitudes[index],
+        }
+        if distances is not None:
+            result["distance_km"] = distances[order]
+        return result
+
+    def query_radius(self, latitude, longitude, radius_km, start_date=None, end_date=None):
+        """
+        Find all positions within radius_km of (latitude, longitude) between start_date and end_date.
+
+        Parameters:
+        - latitude, longitude (float): Query point in degrees.
+        - radius_km (float): Search radius in km.
+        - start_date, end_date: Optional inclusive time bounds, ISO-8601 strings or datetimes.
+
+        Returns:
+        dict: Columnar numpy arrays 'spotter_id', 'sensor_key', 'timestamp', 'latitude',
+              'longitude' and 'distance_km', sorted by timestamp.
+        """
+        dlat = radius_km / KM_PER_DEGREE_LAT
+        cos_lat = np.cos(np.radians(min(89.9, abs(latitude) + dlat)))
+        lon_span = 360.0 if cos_lat <= 0 else min(360.0, 2 * radius_km / (KM_PER_DEGREE_LAT * cos_lat))
+        candidates = self._candidates(latitude - dlat, latitude + dlat, longitude - lon_span / 2, lon_span,
+                                      to_datetime64(start_date), to_datetime64(end_date))
+        distances = haversine_km(latitude, longitude, self.latitudes[candidates], self.longitudes[candidates])
+        inside = distances <= radius_km
+        return self._result(candidates[inside], distances[inside])
+
+    def query_box(self, lat_min, lat_max, lon_min, lon_max, start_date=None, end_date=None):
+        """
+        Find all positions inside a lat/lon box between start_date and end_date.
+        Boxes crossing the antimeridian are given with lon_min > lon_max.
+
+        Returns:
+        dict: Columnar numpy arrays as query_radius, without 'distance_km'.
+        """
+        lon_span = (lon_max - lon_min) % 360.0 or (360.0 if lon_max != lon_min else 0.0)
+        candidates = self._candidates(lat_min, lat_max, lon_min, lon_span,
+                                      to_datetime64(start_date), to_datetime64(end_date))
+        latitudes, longitudes = self.latitudes[candidates], self.longitudes[candidates]
+        inside = (latitudes >= lat_min) & (latitudes <= lat_max) & (((longitudes - lon_min) % 360.0) <= lon_span)
+        return self._result(candidates[inside])
@@ -0,0 +1,134 @@
+# -------------------------------------------------------------------------------
+# Name:        timestamps.py
+# Purpose:     Memoized ISO-8601 timestamp parsing and datetime64 conversion
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import re
+import warnings
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import numpy as np
+from iso8601 import parse_date
+
+# Format of the start / end dates sent to the API, e.g. 2024-01-30T16:00:00Z
+API_QUERY_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+# UTC timestamps as the API takes and returns them, with or without fractional seconds,
+# e.g. 2024-01-30T16:00:00Z and 2024-01-21T20:20:08.000Z
+ISO_8601_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?Z$')
+
+# Unique timestamp strings remembered by parse_timestamps, cleared when full
+MAX_CACHED_TIMESTAMPS = 1000000
+_datetime64_cache = {}
+
+
+def validate_iso_8601_timestamp(timestamp):
+    """Validate if a given string is a valid ISO-8601 UTC timestamp, with optional fractional seconds."""
+    return ISO_8601_PATTERN.match(timestamp) is not None
+
+
+@lru_cache(maxsize=65536)
+def parse_timestamp(timestamp):
+    """
+    Parse an ISO-8601 timestamp string once, returning a naive UTC datetime.
+    Accepts the API's fractional seconds (2024-01-21T20:20:08.000Z) and explicit offsets;
+    timestamps without an offset are taken as UTC. Raises iso8601.ParseError if invalid.
+    """
+    return parse_date(timestamp).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+@lru_cache(maxsize=65536)
+def timestamp_ms(timestamp):
+    """Milliseconds since the epoch of an ISO-8601 timestamp string, for sort keys and SQLite functions."""
+    return int(np.datetime64(parse_timestamp(timestamp), 'ms').astype(np.int64))
+
+
+def max_timestamp(timestamps):
+    """Return the latest of ISO-8601 timestamp strings by parsed time, not text order. None values are ignored."""
+    timestamps = [timestamp for timestamp in timestamps if timestamp is not None]
+    if not timestamps:
+        return None
+    return timestamps[int(np.argmax(parse_timestamps(timestamps)))]
+
+
+def _parse_unique(timestamps):
+    """Parse unique timestamp strings to int64 milliseconds since the epoch, in bulk where numpy can."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            return np.array([timestamp[:-1] if timestamp.endswith('Z') else timestamp for timestamp in timestamps],
+                            dtype='datetime64[ms]').astype(np.int64)
+    except (ValueError, Warning):
+        # Offsets and other forms numpy does not parse
+        return np.array([parse_timestamp(timestamp) for timestamp in timestamps], dtype='datetime64[ms]').astype(np.int64)
+
+
+def parse_timestamps(timestamps):
+    """
+    Convert timestamp strings (e.g. 2024-01-21T20:20:08.000Z) to a datetime64[ms] array.
+
+    Each unique string is parsed once and remembered across calls, so the grouping,
+    QC, plotting and export of the same data share the work. Beta 2 data repeats
+    every timestamp across the sample values and sensors of a datum.
+
+    Parameters:
+    - timestamps (iterable of str): ISO-8601 timestamps.
+
+    Returns:
+    np.ndarray: datetime64[ms] array, aligned with timestamps.
+    """
+    timestamps = timestamps if isinstance(timestamps, (list, tuple)) else list(timestamps)
+    cache = _datetime64_cache
+    missing = list(dict.fromkeys(timestamp for timestamp in timestamps if timestamp not in cache))
+    if missing:
+        if len(cache) + len(missing) > MAX_CACHED_TIMESTAMPS:
+            cache.clear()
+        cache.update(zip(missing, _parse_unique(missing).tolist()))
+    return np.fromiter((cache[timestamp] for timestamp in timestamps), dtype=np.int64,
+                       count=len(timestamps)).view('datetime64[ms]')
+
+
+def to_datetime64(timestamp):
+    """Convert an ISO-8601 string, datetime or datetime64 to datetime64[ms]. None stays None."""
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        return parse_timestamps([timestamp])[0]
+    if isinstance(timestamp, datetime) and timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return np.datetime64(timestamp, 'ms')
+
+
+def text_bounds(start=None, end=None):
+    """
+    Second resolution strings bracketing every API form of the timestamps from start to end inclusive.
+
+    Text comparisons are only a coarse pre-filter: 2024-01-21T20:20:59Z sorts after
+    2024-01-21T20:20:59.999Z, so an end bound of '...:59.999Z' would drop it. Every UTC
+    timestamp the API returns within [start, end] satisfies lower <= timestamp < upper as
+    text; apply the exact bounds to the parsed times.
+
+    Parameters:
+    - start, end (np.datetime64): Inclusive bounds, or None.
+
+    Returns:
+    tuple: (lower, upper) strings, None where the bound is None.
+    """
+    lower = str(np.datetime64(start, 's')) if start is not None else None
+    upper = str(np.datetime64(end, 's') + np.timedelta64(1, 's')) if end is not None else None
+    return lower, upper
+
+
+def convert_to_iso8601(date_str):
+    """Parse a user-supplied date/time (e.g. 2024-01-30T16:00Z) into the UTC format the API accepts."""
+    try:
+        parsed_date = parse_date(date_str)
+        return parsed_date.astimezone(timezone.utc).strftime(API_QUERY_FORMAT)
+    except Exception:
+        raise ValueError("Invalid date/time format")
@@ -0,0 +1,216 @@
+# -------------------------------------------------------------------------------
+# Name:        topology.py
+# Purpose:     Bristlemouth node / sensorPosition / sensor type topology and sensor index
+#
+# Author:      evanShap
+#
+# Copyright:   (c) 2024 Sofar Ocean
+# License:     Apache License, Version 2.0
+# -------------------------------------------------------------------------------
+
+import logging
+
+import numpy as np
+
+from lib.dataset_cache import cached_index, store_index
+from lib.records import compact_decoded_value, compact_record
+from lib.timestamps import parse_timestamps, to_datetime64
+from lib.sensor_registry import (
+    decode_record,
+    detect_sensor_type,
+    SENSOR_TYPES,
+    SENSOR_TYPE_UNKNOWN,
+)
+
+
+def sensor_key(record):
+    """
+    Return the key of the sensor that produced a record, used by QC, the topology and the local store.
+
+    That is where the sensor sits on the Spotter: its sensorPosition, as Beta 2 data is
+    plotted (see lib.plotting_functions.group_by_sensor_position), or its bristlemouth_node_id
+    for DVT1 systems without positions, as DVT1 data is plotted (group_by_node_id).
+    """
+    sensor_position = record.get('sensorPosition')
+    return str(sensor_position) if sensor_position is not None else str(record.get('bristlemouth_node_id'))
+
+
+class SensorIndex:
+    """
+    Categorical index of records by a sensor field, built once.
+
+    Each distinct value of the field gets an integer code; a stable argsort of the
+    codes partitions the records by sensor while keeping their order, so
+    demultiplexing is array slicing instead of a dict scan per plot.
+
+    Parameters:
+    - records (list of dict): payloads or grouped data.
+    - field (str): 'sensorPosition' or 'bristlemouth_node_id'. Missing fields are grouped under 'None'.
+    - keys (list): The field value of each record, if already collected.
+    """
+
+    def __init__(self, records, field, keys=None):
+        self.field = field
+        if keys is None:
+            keys = [record.get(field, 'None') for record in records]
+        category_codes = {}
+        self.codes = np.fromiter(
+            (category_codes.setdefault(key, len(category_codes)) for key in keys),
+            dtype=np.int64, count=len(keys))
+        self.categories = list(category_codes)
+        self.order = np.argsort(self.codes, kind='stable')
+        self.bounds = np.searchsorted(self.codes[self.order], np.arange(len(self.categories) + 1))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def indices(self, category):
+        """Return the record indices of one sensor, in record order."""
+        code = self.categories.index(category)
+        return self.order[self.bounds[code]:self.bounds[code + 1]]
+
+    def partition(self, records):
+        """Return a dict of sensor -> list of its records, in first-seen sensor order."""
+        return {
+            category: [records[i] for i in self.order[self.bounds[code]:self.bounds[code + 1]].tolist()]
+            for code, category in enumerate(self.categories)
+        }
+
+
+def get_sensor_index(dataset, field):
+    """
+    Return the SensorIndex of dataset['data'] for field.
+
+    Built once and kept in lib.dataset_cache, not in the dataset, until the field
+    values of the data change (records sorted, filtered, replaced or edited).
+    """
+    data = dataset.get('data', [])
+    keys = [record.get(field, 'None') for record in data]
+    return cached_index(('sensor_index', field), data, keys, lambda: SensorIndex(data, field, keys))
+
+
+class SensorTopology:
+    """
+    Which sensor sat where on a Spotter, and when.
+
+    Entries are dicts with 'slot' (see sensor_key), 'bristlemouth_node_id', 'sensorPosition',
+    'sensor_type' and the inclusive 'valid_from' / 'valid_to' timestamps during which that
+    sensor was seen in the slot. A new entry starts whenever the node or sensor type in a slot changes.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = list(entries or [])
+
+    @classmethod
+    def from_records(cls, records, sensor_types=None):
+        """
+        Build the topology of one Spotter's records.
+
+        Parameters:
+        - records (list of dict): payloads or grouped data, in time order.
+        - sensor_types (list of str): Sensor type of each record, detected if not given.
+        """
+        if sensor_types is None:
+            sensor_types = [detect_sensor_type(record) for record in records]
+        entries = []
+        current = {}
+        for record, sensor_type in zip(records, sensor_types):
+            slot = sensor_key(record)
+            node_id = record.get('bristlemouth_node_id')
+            timestamp = record.get('timestamp')
+            entry = current.get(slot)
+            if entry is not None and entry['bristlemouth_node_id'] == node_id:
+                # Records with no recognizable data_type_name do not end the sensor's interval
+                if entry['sensor_type'] == SENSOR_TYPE_UNKNOWN:
+                    entry['sensor_type'] = sensor_type
+                if sensor_type in (entry['sensor_type'], SENSOR_TYPE_UNKNOWN):
+                    entry['valid_to'] = timestamp
+                    continue
+            entry = current[slot] = {
+                'slot': slot,
+                'bristlemouth_node_id': node_id,
+                'sensorPosition': record.get('sensorPosition'),
+                'sensor_type': sensor_type,
+                'valid_from': timestamp,
+                'valid_to': timestamp,
+            }
+            entries.append(entry)
+        return cls(entries)
+
+    def lookup(self, slot, timestamp=None):
+        """
+        Return the entry for a slot at timestamp (ISO-8601 string, datetime or datetime64), or its latest
+        entry if timestamp is None. Validity intervals are compared as parsed times.
+        """
+        candidates = [entry for entry in self.entries if entry['slot'] == str(slot)]
+        if not candidates:
+            return None
+        valid_to = parse_timestamps([entry['valid_to'] for entry in candidates])
+        if timestamp is not None:
+            timestamp = to_datetime64(timestamp)
+            valid_from = parse_timestamps([entry['valid_from'] for entry in candidates])
+            valid = np.flatnonzero((valid_from <= timestamp) & (timestamp <= valid_to))
+            if not len(valid):
+                return None
+            return candidates[valid[np.argmax(valid_to[valid])]]
+        return candidates[int(np.argmax(valid_to))]
+
+    def sensor_type(self, slot, timestamp=None):
+        entry = self.lookup(slot, timestamp)
+        return entry['sensor_type'] if entry else SENSOR_TYPE_UNKNOWN
+
+    def channels(self, slot, timestamp=None):
+        """Return the channel names of the sensor in a slot, or [] if its type is unknown."""
+        sensor_type = SENSOR_TYPES.get(self.sensor_type(slot, timestamp))
+        return sensor_type.channel_names if sensor_type else []
+
+
+def _topology_fingerprint(records):
+    return [(id(record), sensor_key(record), record.get('bristlemouth_node_id'), record.get('timestamp')) for record in records]
+
+
+def get_topology(dataset, sensor_types=None):
+    """
+    Return the SensorTopology of dataset['data'], kept in lib.dataset_cache like get_sensor_index.
+
+    Parameters:
+    - dataset (dict): decoded sensor-data with a 'data' list in time order.
+    - sensor_types (list of str): Sensor type of each record. Given, the topology is rebuilt
+    -- from them; otherwise it is built with detected types when missing or stale.
+    """
+    data = dataset.get('data', [])
+    fingerprint = _topology_fingerprint(data)
+    if sensor_types is not None:
+        topology = SensorTopology.from_records(data, sensor_types)
+        store_index(('topology',), data, fingerprint, topology)
+        return topology
+    return cached_index(('topology',), data, fingerprint, lambda: SensorTopology.from_records(data))
+
+
+def decode_records(records, sensor_types=None, compact=False):
+    """
+    Decode a mixed list of records in place in a single pass, each with the decoder
+    of its sensor type in lib.sensor_registry.
+
+    Parameters:
+    - records (list of dict): grouped Beta 2 data and/or raw hex payloads.
+    - sensor_types (list of str): Sensor type of each record, detected if not given.
+    - compact (bool): Store each record as a lib.records record, with ChannelValue 'decoded_value's.
+
+    Returns:
+    list of dict: The input records, with 'decoded_value's added where a decoder applies.
+    """
+    if sensor_types is None:
+        sensor_types = [detect_sensor_type(record) for record in records]
+    for i, (record, sensor_type) in enumerate(zip(records, sensor_types)):
+        try:
+            decoded_value = decode_record(record, sensor_type)
+        except Exception as e:
+            print(f"Could not decode {sensor_type} data for sensor {sensor_key(record)}, at {record.get('timestamp', 'Unknown')}")
+            logging.error(f"Error: {e}", exc_info=True)
+            decoded_value = None
+        if decoded_value is not None:
+            record['decoded_value'] = compact_decoded_value(decoded_value) if compact else decoded_value
+        if compact:
+            records[i] = compact_record(record)
+    return records
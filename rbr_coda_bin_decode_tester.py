@@ -8,19 +8,12 @@
 # License:     Apache License, Version 2.0
 # -------------------------------------------------------------------------------
 
-from lib.binary_decoder import decode_payload_to_structs, print_decoded_struct
-
-RBR_CODA_STRUCT_DESCRIPTION = [
-    ("uint16_t", "sample_count"),
-    ("double", "min"),
-    ("double", "max"),
-    ("double", "mean"),
-    ("double", "stdev"),
-]
-
-RBR_CODA_DATA_CHANNELS = [
-    "Temperature[ºC] or Pressure[dbar]",
-]
+from lib.binary_decoder import (
+    decode_payload_to_structs,
+    print_decoded_struct,
+    RBR_CODA_DATA_CHANNELS,
+    RBR_CODA_STRUCT_DESCRIPTION,
+)
 
 if __name__ == "__main__":
     user_input = input("Please enter the hex payload: ")
@@ -9,34 +9,28 @@
 # -------------------------------------------------------------------------------
 
 import argparse
-from iso8601 import parse_date
 from lib.api_functions import fetch_and_decode_soft_data
 from lib.plotting_functions import plot_beta2_json_channels
+from lib.overview_plot import plot_beta2_json_overview
+from lib.binary_decoder import SOFT_DATA_CHANNELS
+from lib.quality_control import apply_qc_flags
+from lib.timestamps import convert_to_iso8601
 from lib.script_functions import (
     get_plot_handles_for_channels,
     add_plot_arg_from_handles,
     get_channels_from_args,
+    add_qc_arg,
+    get_qc_options_from_args,
+    add_overview_arg,
 )
 import logging
 
 # Configure logging (this is a basic configuration, adjust as needed)
 logging.basicConfig(level=logging.INFO)
 
-SOFT_DATA_CHANNELS = [
-    "Temperature[ºC]",
-]
-
 soft_plot_handles = get_plot_handles_for_channels(SOFT_DATA_CHANNELS)
 
 
-def convert_to_iso8601(date_str):
-    try:
-        parsed_date = parse_date(date_str)
-        return parsed_date.strftime("%Y-%m-%dT%H:%M:%SZ")
-    except Exception:
-        raise ValueError("Invalid date/time format")
-
-
 def main():
     parser = argparse.ArgumentParser(
         description="Retrieve and decode SOFT data from the Sofar API."
@@ -50,6 +44,8 @@ def main():
         "-e", "--end_date", type=convert_to_iso8601, help="End date (optional)"
     )
     add_plot_arg_from_handles(parser, soft_plot_handles)
+    add_qc_arg(parser)
+    add_overview_arg(parser)
     args = parser.parse_args()
     channels_to_plot = get_channels_from_args(args.plot_channels, soft_plot_handles)
     print(channels_to_plot)
@@ -59,8 +55,18 @@ def main():
             args.spotter_id, args.api_token, args.start_date, args.end_date
         )
         print(f"Retrieved {len(decoded_api_response['data'])} samples.")
+        qc_mask, plot_flagged = get_qc_options_from_args(args.qc)
+        if qc_mask:
+            apply_qc_flags(decoded_api_response)
         print(f"Plotting channels {channels_to_plot}")
-        plot_beta2_json_channels(decoded_api_response, channels_to_plot)
+        if args.overview:
+            plot_beta2_json_overview(
+                decoded_api_response, channels_to_plot, args.overview, qc_mask=qc_mask, plot_flagged=plot_flagged
+            )
+        else:
+            plot_beta2_json_channels(
+                decoded_api_response, channels_to_plot, qc_mask=qc_mask, plot_flagged=plot_flagged
+            )
 
     except Exception as e:
         logging.error(f"Failed to retrieve or decode data: {e}", exc_info=True)
@@ -0,0 +1,27 @@
+import copy
+import json
+import os
+
+import pytest
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs')
+
+
+def load_example(name):
+    with open(os.path.join(DOCS_DIR, name)) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def beta1_response():
+    """The DVT1 example response, with hex payloads not yet decoded."""
+    response = load_example('example_beta1_sensor-data_payload.json')
+    for payload in response['data']:
+        payload.pop('decoded_value', None)
+    return response
+
+
+@pytest.fixture
+def beta2_response():
+    """The Beta 2 example response."""
+    return copy.deepcopy(load_example('example_beta2_sensor-data_playload.json'))
@@ -0,0 +1,41 @@
+import json
+
+from lib.api_functions import decode_beta2_data, decode_mixed_data, decode_sensor_data
+from lib.segments import get_segment_tables
+from lib.topology import get_sensor_index, get_topology
+
+
+def test_decoded_datasets_are_json_serializable(beta1_response, beta2_response):
+    for dataset in (decode_sensor_data(beta1_response), decode_beta2_data(beta2_response)):
+        assert not {'sensor_index', 'segments', 'topology'} & set(dataset)
+        json.dumps(dataset)
+
+
+def test_sensor_index_is_cached_until_data_changes(beta2_response):
+    dataset = decode_mixed_data(beta2_response)
+    sensor_index = get_sensor_index(dataset, 'sensorPosition')
+    assert get_sensor_index(dataset, 'sensorPosition') is sensor_index
+
+    # Same length, different sensors: the partition must follow the edit
+    dataset['data'][0]['sensorPosition'] = 7
+    rebuilt = get_sensor_index(dataset, 'sensorPosition')
+    assert rebuilt is not sensor_index
+    assert rebuilt.partition(dataset['data'])[7] == [dataset['data'][0]]
+
+
+def test_segment_tables_follow_in_place_sort(beta2_response):
+    dataset = decode_beta2_data(beta2_response)
+    tables = get_segment_tables(dataset, 'sensorPosition')
+    assert get_segment_tables(dataset, 'sensorPosition') is tables
+
+    dataset['data'].sort(key=lambda datum: datum['timestamp'], reverse=True)
+    resorted = get_segment_tables(dataset, 'sensorPosition')
+    assert resorted is not tables
+    assert resorted[1].timestamps[0] == tables[1].timestamps[-1]
+
+
+def test_topology_of_decoded_dataset(beta1_response):
+    dataset = decode_sensor_data(beta1_response)
+    topology = get_topology(dataset)
+    assert [entry['sensor_type'] for entry in topology.entries] == ['aanderaa_dvt1']
+    assert topology.channels('0xc12f1ff07208adf7')
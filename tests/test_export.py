@@ -0,0 +1,169 @@
+import csv
+import json
+import threading
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+from conftest import load_example
+from lib.export import CsvExporter, NetCDFExporter, QC_FLAGS_FILL_VALUE, export_batches, iter_api_batches
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SAMPLE_INTERVAL = timedelta(minutes=10)
+SENSOR_POSITIONS = [1, 2, 3]
+
+
+class GeneratedSensorDataServer(HTTPServer):
+    """
+    Serves Beta 2 Aanderaa data every SAMPLE_INTERVAL for SENSOR_POSITIONS, between the
+    requested startDate and endDate inclusive like the API, built from the example's first datum.
+    """
+
+    def __init__(self):
+        example = load_example('example_beta2_sensor-data_playload.json')['data']
+        first = example[0]
+        self.sample_values = [item for item in example
+                              if item['timestamp'] == first['timestamp'] and item['sensorPosition'] == first['sensorPosition']]
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), GeneratedSensorDataHandler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/sensor-data'
+
+    def response(self, start_date, end_date):
+        start = np.datetime64(start_date.rstrip('Z'), 'ms')
+        end = np.datetime64(end_date.rstrip('Z'), 'ms')
+        interval = np.timedelta64(SAMPLE_INTERVAL).astype('timedelta64[ms]')
+        first = start + (-(start - np.datetime64(0, 'ms')) % interval)
+        timestamps = np.datetime_as_string(np.arange(first, end + np.timedelta64(1, 'ms'), interval), unit='ms')
+        return {'data': [dict(item, timestamp=f'{timestamp}Z', sensorPosition=position)
+                         for timestamp in timestamps
+                         for position in SENSOR_POSITIONS
+                         for item in self.sample_values]}
+
+
+class GeneratedSensorDataHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        self.server.requests.append(query)
+        payload = json.dumps(self.server.response(query['startDate'], query['endDate'])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_server():
+    server = GeneratedSensorDataServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def api_export(mock_server, path, n_windows):
+    batches = iter_api_batches(['SPOT-1'], 'test-token', 'beta2', START, START + n_windows * timedelta(days=1),
+                               timedelta(days=1), mock_server.url)
+    return export_batches(batches, CsvExporter(str(path)))
+
+
+def test_window_boundaries_are_exported_once(mock_server, tmp_path):
+    n_rows = api_export(mock_server, tmp_path / 'export.csv', 3)
+
+    assert len(mock_server.requests) == 3
+    with open(tmp_path / 'export.csv', newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    keys = [(row['sensor_key'], row['channel_name'], row['timestamp']) for row in rows]
+    assert len(keys) == len(set(keys)) == n_rows
+    # Samples from START to START + 3 days inclusive, 4 channels of 3 sensors each
+    assert n_rows == (3 * 144 + 1) * 4 * len(SENSOR_POSITIONS)
+
+
+def test_export_memory_does_not_grow_with_windows(mock_server, tmp_path):
+    api_export(mock_server, tmp_path / 'warm_up.csv', 2)
+
+    peaks = []
+    for n_windows in (2, 8):
+        tracemalloc.start()
+        api_export(mock_server, tmp_path / f'export_{n_windows}.csv', n_windows)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    # Peak memory is about one window, not the whole export; the timestamp parse cache grows a little per window
+    assert peaks[1] < 1.08 * peaks[0]
+
+
+def sensor_row(spotter_id, sensor_key, minute, channel_name, mean, qc_flags=0.0):
+    """Build a sensor_data row at START + minute with every statistic derived from mean."""
+    timestamp = (START + timedelta(minutes=minute)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+    return (spotter_id, sensor_key, timestamp, sensor_key, None, 37.0 + minute / 1000, -122.0, channel_name,
+            10.0, mean, mean - 1, mean + 1, 0.5, qc_flags)
+
+
+def test_netcdf_round_trip(tmp_path):
+    netCDF4 = pytest.importorskip('netCDF4')
+    speed, temperature = 'Abs Speed[cm/s]', 'Temperature[ºC]'
+    batches = [
+        # Sensor 1 reports both channels every minute, sensor 2 only speed every other minute;
+        # the temperature of sensor 1 is missing at minute 1 and its QC flags at minute 2
+        [sensor_row('SPOT-1', '1', 0, speed, 10.0, 4.0), sensor_row('SPOT-1', '1', 0, temperature, 20.0),
+         sensor_row('SPOT-2', '2', 0, speed, 50.0),
+         sensor_row('SPOT-1', '1', 1, speed, 11.0)],
+        [sensor_row('SPOT-1', '1', 2, speed, 12.0, float('nan')), sensor_row('SPOT-1', '1', 2, temperature, 22.0),
+         sensor_row('SPOT-2', '2', 2, speed, 52.0)],
+        [sensor_row('SPOT-1', '1', minute, speed, 10.0 + minute) for minute in range(3, 7)],
+    ]
+    path = tmp_path / 'export.nc'
+    n_rows = export_batches(batches, NetCDFExporter(str(path), obs_chunk=4))
+    assert n_rows == sum(len(rows) for rows in batches)
+
+    with netCDF4.Dataset(path) as dataset:
+        dataset.set_auto_mask(False)
+        assert dataset.featureType == 'timeSeries'
+        assert dataset.dimensions['sensor'].size == 2
+        assert dataset.dimensions['obs'].size == 7
+        assert list(dataset['sensor_id'][:]) == ['SPOT-1/1', 'SPOT-2/2']
+
+        time = dataset['time'][:]
+        start_ms = START.timestamp() * 1000
+        np.testing.assert_array_equal(time[0], start_ms + 60000 * np.arange(7))
+        np.testing.assert_array_equal(time[1, :2], [start_ms, start_ms + 120000])
+        assert np.all(np.isnan(time[1, 2:]))
+
+        speed_mean = dataset['abs_speed_mean']
+        assert speed_mean.dtype == np.float32
+        assert speed_mean.standard_name == 'sea_water_speed'
+        assert speed_mean.units == 'cm s-1'
+        assert speed_mean.chunking() == [1, 4]
+        np.testing.assert_array_equal(speed_mean[0], 10.0 + np.arange(7))
+        np.testing.assert_array_equal(speed_mean[1, :2], [50.0, 52.0])
+        assert np.all(np.isnan(speed_mean[1, 2:]))
+
+        temperature_mean = dataset['temperature_mean'][:]
+        np.testing.assert_array_equal(temperature_mean[0, [0, 2]], [20.0, 22.0])
+        assert np.all(np.isnan(temperature_mean[0, [1, 3, 4, 5, 6]]))
+        assert np.all(np.isnan(temperature_mean[1]))
+
+        speed_flags = dataset['abs_speed_qc_flags']
+        assert speed_flags.dtype == np.uint8
+        assert speed_flags._FillValue == QC_FLAGS_FILL_VALUE
+        np.testing.assert_array_equal(speed_flags[0], [4, 0, QC_FLAGS_FILL_VALUE, 0, 0, 0, 0])
+        np.testing.assert_array_equal(speed_flags[1], [0, 0] + [QC_FLAGS_FILL_VALUE] * 5)
+
+
+def test_netcdf_rejects_rows_out_of_time_order(tmp_path):
+    pytest.importorskip('netCDF4')
+    with NetCDFExporter(str(tmp_path / 'export.nc')) as exporter:
+        exporter.write_rows([sensor_row('SPOT-1', '1', 1, 'Abs Speed[cm/s]', 1.0)])
+        with pytest.raises(ValueError):
+            exporter.write_rows([sensor_row('SPOT-1', '1', 0, 'Abs Speed[cm/s]', 1.0)])
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from lib.ingest_daemon import IngestDaemon
+from lib.local_store import LocalStore
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs',
+                            'example_beta2_sensor-data_playload.json')
+
+SPOTTER_IDS = ['SPOT-1', 'SPOT-2', 'SPOT-3']
+
+
+class MockSensorDataServer(HTTPServer):
+    """Serves the Beta 2 example response for every Spotter and records the requests' query parameters."""
+
+    def __init__(self):
+        with open(EXAMPLE_PATH, 'rb') as f:
+            self.payload = f.read()
+        self.requests = []
+        super().__init__(('127.0.0.1', 0), MockSensorDataHandler)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/api/sensor-data'
+
+
+class MockSensorDataHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append({key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.server.payload)))
+        self.end_headers()
+        self.wfile.write(self.server.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def mock_server():
+    server = MockSensorDataServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run_daemon(daemon, until, timeout=20):
+    """Run the daemon until until() is true, then request shutdown and wait for run() to return."""
+    async def main():
+        task = asyncio.create_task(daemon.run())
+        deadline = time.monotonic() + timeout
+        while not until() and time.monotonic() < deadline and not task.done():
+            await asyncio.sleep(0.05)
+        daemon.request_shutdown()
+        await asyncio.wait_for(task, timeout)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    return asyncio.run(main())
+
+
+def test_one_poll_cycle_into_store(mock_server, tmp_path):
+    store_path = str(tmp_path / 'fleet.db')
+    daemon = IngestDaemon([(spotter_id, 'beta2') for spotter_id in SPOTTER_IDS], 'test-token', store_path,
+                          poll_interval=timedelta(seconds=0.2), workers=1, flush_interval=timedelta(seconds=0.1),
+                          base_url=mock_server.url)
+
+    pending_tasks = run_daemon(daemon, lambda: len(mock_server.requests) >= len(SPOTTER_IDS))
+
+    # Clean shutdown: no tasks left behind, and the last connection closed checkpointed the WAL
+    assert not pending_tasks
+    assert not os.path.exists(store_path + '-wal')
+
+    assert {request['spotterId'] for request in mock_server.requests} == set(SPOTTER_IDS)
+    assert all(request['token'] == 'test-token' and 'startDate' in request for request in mock_server.requests)
+
+    store = LocalStore(store_path)
+    try:
+        counts = dict(store.connection.execute("SELECT spotter_id, count(*) FROM sensor_data GROUP BY spotter_id"))
+        # 24 located data of 4 Aanderaa channels in the example response
+        assert counts == {spotter_id: 96 for spotter_id in SPOTTER_IDS}
+        assert store.get_poll_state() == {spotter_id: '2024-01-22T19:20:08.000Z' for spotter_id in SPOTTER_IDS}
+        assert store.read_segments('SPOT-1') == [('1', '2024-01-21T20:20:08.000Z', '2024-01-22T19:20:08.000Z', 24)]
+        assert [entry['sensor_type'] for entry in store.read_topology('SPOT-1')] == ['aanderaa']
+    finally:
+        store.close()
+
+
+def test_polls_resume_from_poll_state(mock_server, tmp_path):
+    store_path = str(tmp_path / 'fleet.db')
+    daemon = IngestDaemon([('SPOT-1', 'beta2')], 'test-token', store_path, poll_interval=timedelta(seconds=0.05),
+                          workers=1, flush_interval=timedelta(seconds=0.05), base_url=mock_server.url)
+    run_daemon(daemon, lambda: len(mock_server.requests) >= 3)
+
+    assert mock_server.requests[-1]['startDate'] == '2024-01-22T19:20:08Z'
+    store = LocalStore(store_path)
+    try:
+        # Overlapping polls are idempotent
+        assert store.connection.execute("SELECT count(*) FROM sensor_data").fetchone()[0] == 96
+        assert store.read_segments('SPOT-1')[0][3] == 24
+    finally:
+        store.close()
+
+
+def test_slow_writer_throttles_polling(mock_server, tmp_path, monkeypatch):
+    write_batch = LocalStore.write_batch
+
+    def slow_write_batch(self, *args, **kwargs):
+        time.sleep(0.5)
+        return write_batch(self, *args, **kwargs)
+
+    monkeypatch.setattr(LocalStore, 'write_batch', slow_write_batch)
+    spotter_ids = [f'SPOT-{i}' for i in range(5)]
+    daemon = IngestDaemon([(spotter_id, 'beta2') for spotter_id in spotter_ids], 'test-token', str(tmp_path / 'fleet.db'),
+                          poll_interval=timedelta(seconds=0.01), workers=1, max_pending_batches=1, write_batch_rows=1,
+                          flush_interval=timedelta(seconds=0.05), base_url=mock_server.url)
+    started = time.monotonic()
+    run_daemon(daemon, lambda: time.monotonic() - started > 1.5)
+
+    # Unthrottled, 5 pollers at 10 ms would fetch hundreds of times in 1.5 s. With one pending batch
+    # allowed, each poller waits on the queue: roughly one fetch per poller plus one per write.
+    assert len(mock_server.requests) < 3 * len(spotter_ids)
+
+
+def test_failed_write_does_not_advance_poll_cursor(mock_server, tmp_path, monkeypatch):
+    def failing_write_batch(self, *args, **kwargs):
+        # Polls keep running while the write is in flight
+        time.sleep(0.2)
+        raise OSError('disk full')
+
+    monkeypatch.setattr(LocalStore, 'write_batch', failing_write_batch)
+    store_path = str(tmp_path / 'fleet.db')
+    daemon = IngestDaemon([('SPOT-1', 'beta2')], 'test-token', store_path, poll_interval=timedelta(seconds=0.05),
+                          workers=1, flush_interval=timedelta(seconds=0.01), base_url=mock_server.url)
+    pending_tasks = run_daemon(daemon, lambda: len(mock_server.requests) >= 4)
+
+    assert not pending_tasks
+    assert len(mock_server.requests) >= 4
+    # Every poll re-fetches the lost window instead of resuming after the uncommitted data
+    assert all(request['startDate'] != '2024-01-22T19:20:08Z' for request in mock_server.requests)
+    store = LocalStore(store_path)
+    try:
+        assert store.get_poll_state() == {}
+    finally:
+        store.close()
+
+
+def test_writer_failure_stops_pollers(mock_server, tmp_path, monkeypatch):
+    async def crashing_writer(self, store, store_executor):
+        await self._queue.get()
+        raise RuntimeError('writer crashed')
+
+    monkeypatch.setattr(IngestDaemon, '_write_batches', crashing_writer)
+    spotter_ids = [f'SPOT-{i}' for i in range(5)]
+    daemon = IngestDaemon([(spotter_id, 'beta2') for spotter_id in spotter_ids], 'test-token', str(tmp_path / 'fleet.db'),
+                          poll_interval=timedelta(seconds=0.01), workers=1, max_pending_batches=1,
+                          base_url=mock_server.url)
+
+    async def main():
+        # No shutdown is requested: with the queue full and no writer, run() must not hang
+        with pytest.raises(RuntimeError, match='writer crashed'):
+            await asyncio.wait_for(daemon.run(), 20)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert not asyncio.run(main())
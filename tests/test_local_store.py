@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from lib.local_store import LocalStore, SENSOR_DATA_COLUMNS
+from lib.segments import segment_bounds
+
+START = datetime(2024, 1, 21, 20, 20, 8)
+
+
+def timestamp(minutes):
+    return (START + timedelta(minutes=minutes)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def rows_at(minutes, spotter_id='SPOT-1', key='1', latitude=None, longitude=None):
+    rows = []
+    for minute in minutes:
+        for channel_name in ('Temperature[ºC]', 'Abs Speed[cm/s]'):
+            row = dict.fromkeys(SENSOR_DATA_COLUMNS)
+            row.update(spotter_id=spotter_id, sensor_key=key, timestamp=timestamp(minute), channel_name=channel_name, mean=1.0,
+                       latitude=latitude, longitude=longitude)
+            rows.append(tuple(row[column] for column in SENSOR_DATA_COLUMNS))
+    return rows
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalStore(str(tmp_path / 'store.db'))
+    yield store
+    store.close()
+
+
+def expected_segments(minutes, key='1'):
+    timestamps = sorted({timestamp(minute) for minute in minutes})
+    return [(key,) + bounds for bounds in segment_bounds(timestamps)]
+
+
+def test_in_order_batches_extend_tail_without_rescanning(store):
+    statements = []
+    store.connection.set_trace_callback(statements.append)
+    ingested = []
+    for batch in range(10):
+        # Every poll fetches the sample at its start boundary again
+        minutes = range(batch * 300, batch * 300 + 301, 60)
+        store.write_batch(rows_at(minutes), {})
+        ingested.extend(minutes)
+    assert store.read_segments('SPOT-1') == expected_segments(ingested)
+    assert not [statement for statement in statements if 'DISTINCT timestamp' in statement]
+
+
+def test_gap_starts_new_segment(store):
+    store.write_batch(rows_at([0, 60, 120]), {})
+    store.write_batch(rows_at([120, 600, 660]), {})
+    assert store.read_segments('SPOT-1') == expected_segments([0, 60, 120, 600, 660])
+
+
+@pytest.mark.parametrize('late', [[30], [300, 360, 420, 480, 540], [-600], [-60, 30, 900]])
+def test_out_of_order_samples(store, late):
+    batches = [[0, 60, 120], [600, 660], [1200]]
+    for minutes in batches:
+        store.write_batch(rows_at(minutes), {})
+    store.write_batch(rows_at(late), {})
+    ingested = [minute for minutes in batches for minute in minutes] + late
+    assert store.read_segments('SPOT-1') == expected_segments(ingested)
+
+
+def test_position_index_cached_until_ingest(store, tmp_path):
+    store.write_batch(rows_at([0, 60], latitude=51.68, longitude=4.59), {'SPOT-1': timestamp(60)})
+    index = store.get_position_index()
+    assert len(index) == 2
+    assert store.get_position_index() is index
+
+    store.write_batch(rows_at([120], latitude=51.69, longitude=4.59), {'SPOT-1': timestamp(120)})
+    index = store.get_position_index()
+    assert len(index) == 3
+    assert store.get_position_index() is index
+
+    # A commit from another connection, e.g. the ingest daemon, also moves the watermark
+    other = LocalStore(str(tmp_path / 'store.db'))
+    try:
+        other.write_batch(rows_at([0], spotter_id='SPOT-2', latitude=51.7, longitude=4.6), {'SPOT-2': timestamp(0)})
+    finally:
+        other.close()
+    assert len(store.get_position_index()) == 4
+    assert len(store.get_position_index().query_radius(51.68, 4.59, 5.0, timestamp(60), timestamp(120))['timestamp']) == 2
+
+
+def test_time_bounds_compare_parsed_times(store):
+    # The API writes whole seconds with or without fractional digits
+    whole_second = timestamp(1).replace('.000Z', 'Z')
+    rows = [row[:2] + (whole_second,) + row[3:] if row[2] == timestamp(1) else row for row in rows_at([0, 1, 2])]
+    store.write_batch(rows, {'SPOT-1': whole_second})
+    store.write_batch([], {'SPOT-1': timestamp(0)})
+
+    # '...:08Z' sorts after '...:08.999Z' as text
+    end_of_second = timestamp(1).replace('.000Z', '.999Z')
+    exported = [row for batch in store.iter_sensor_data(None, timestamp(1), end_of_second) for row in batch]
+    assert {row[2] for row in exported} == {whole_second}
+    assert [row[2] for row in store.read_sensor_data('SPOT-1', timestamp(0), end_of_second)][:2] == [timestamp(0), whole_second]
+    assert store.get_poll_state() == {'SPOT-1': whole_second}
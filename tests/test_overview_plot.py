@@ -0,0 +1,61 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import matplotlib
+import matplotlib.dates as mdates
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from lib.api_functions import decode_beta2_data
+from lib.overview_plot import OverviewPlot, MAX_GRID_COLUMNS
+from lib.plotting_functions import group_by_sensor_position
+
+matplotlib.use('Agg')
+
+CHANNELS = ["Temperature[ºC]", "Abs Speed[cm/s]"]
+
+
+@pytest.fixture
+def grouped_data(beta2_response):
+    return dict(group_by_sensor_position(decode_beta2_data(beta2_response)))
+
+
+@pytest.fixture(autouse=True)
+def close_figures():
+    yield
+    plt.close('all')
+
+
+def test_bins_follow_axes_width_and_zoom(grouped_data):
+    overview = OverviewPlot(grouped_data, CHANNELS)
+    figure, = overview.draw()
+    ax = next(ax for ax, (channel_name, _) in overview.axes.items() if channel_name == CHANNELS[0])
+    sensor_key = next(iter(overview.sensors))
+    assert overview._views[ax][2] == int(ax.get_window_extent().width)
+
+    timestamps, _ = overview.series[(CHANNELS[0], sensor_key)]
+    start, end = timestamps[4], timestamps[10]
+    ax.set_xlim(mdates.date2num(start.astype(object)), mdates.date2num(end.astype(object)))
+    for shared_ax in overview.axes:
+        envelope = overview.envelopes[(overview.axes[shared_ax][0], sensor_key)]
+        assert envelope["count"].sum() == 7
+        assert start <= envelope["time"].min() and envelope["time"].max() <= end
+
+    figure.set_size_inches(7, 4)
+    overview.on_resize(type('ResizeEvent', (), {'canvas': figure.canvas})())
+    assert overview._views[ax][2] == int(ax.get_window_extent().width)
+
+
+def test_grid_is_paged(grouped_data):
+    data = next(iter(grouped_data.values()))
+    many = {position: data for position in range(MAX_GRID_COLUMNS * 2 + 1)}
+    figures = OverviewPlot(many, CHANNELS, layout='grid').draw()
+    assert [len(figure.axes) for figure in figures] == [MAX_GRID_COLUMNS * 2, MAX_GRID_COLUMNS * 2, 2]
+
+
+def test_script_functions_does_not_import_matplotlib():
+    code = "import sys, lib.script_functions; print('matplotlib' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                          cwd=Path(__file__).parents[1]).stdout.strip() == 'False'
@@ -0,0 +1,28 @@
+import copy
+
+import pytest
+
+import lib.parallel_decode
+from lib.api_functions import decode_sensor_data
+
+
+@pytest.fixture(autouse=True)
+def parallel_small_responses(monkeypatch):
+    monkeypatch.setattr(lib.parallel_decode, 'MIN_PARALLEL_RECORDS', 1)
+
+
+def test_dvt1_parallel_matches_serial(beta1_response):
+    beta1_response['data'][3]['units'] = 'ascii'
+    beta1_response['data'][5]['value'] = 'abc'
+    beta1_response['data'][7]['value'] = beta1_response['data'][7]['value'][:-4]
+    serial = decode_sensor_data(copy.deepcopy(beta1_response))
+    parallel = decode_sensor_data(copy.deepcopy(beta1_response), workers=2)
+    assert parallel['data'] == serial['data']
+    assert [type(channel['data']['sample_count']) for channel in parallel['data'][0]['decoded_value']] == [int] * 9
+
+
+@pytest.mark.parametrize('chunk_size', [1, 5, 1000])
+def test_dvt1_chunks_merge_in_record_order(beta1_response, chunk_size):
+    serial = decode_sensor_data(copy.deepcopy(beta1_response))
+    parallel = lib.parallel_decode.parallel_decode_sensor_data(copy.deepcopy(beta1_response), 2, chunk_size)
+    assert parallel['data'] == serial['data']
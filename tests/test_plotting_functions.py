@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from lib.plotting_functions import extract_channel_data
+from lib.quality_control import QC_SPIKE, QC_STUCK, QC_TILT
+from lib.segments import SegmentTable
+
+START = datetime(2024, 1, 1)
+GAP_THRESHOLD = timedelta(minutes=15)
+CHANNEL = 'Temperature[ºC]'
+
+
+def payload(minute, mean=None, qc_flags=0, stdev=True):
+    """A payload at START + minute; without a mean it only carries another channel."""
+    decoded_value = [{'channel_name': 'Abs Speed[cm/s]', 'data': {'mean': 1.0, 'min': 0.0, 'max': 2.0}}]
+    if mean is not None:
+        data = {'sample_count': 60, 'mean': mean, 'min': mean - 1, 'max': mean + 1, 'qc_flags': qc_flags}
+        if stdev:
+            data['stdev'] = 0.5
+        decoded_value.append({'channel_name': CHANNEL, 'data': data})
+    return {'timestamp': (START + timedelta(minutes=minute)).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'decoded_value': decoded_value}
+
+
+def at(*minutes):
+    return [START + timedelta(minutes=minute) for minute in minutes]
+
+
+def assert_values(actual, expected):
+    np.testing.assert_array_equal(np.array(actual, dtype=np.float64), np.array(expected, dtype=np.float64))
+
+
+def test_one_nan_per_gap_at_the_last_timestamp_before_it():
+    # Gaps of 40 and 130 minutes after minutes 20 and 70
+    data = [payload(minute, mean) for minute, mean in ((0, 10), (10, 11), (20, 12), (60, 13), (70, 14), (200, 15))]
+    timestamps, mean_values, min_values, max_values, std_values, n_readings_values = \
+        extract_channel_data(data, CHANNEL, GAP_THRESHOLD)
+
+    assert timestamps == at(0, 10, 20, 20, 60, 70, 70, 200)
+    assert_values(mean_values, [10, 11, 12, np.nan, 13, 14, np.nan, 15])
+    assert_values(min_values, [9, 10, 11, np.nan, 12, 13, np.nan, 14])
+    assert_values(max_values, [11, 12, 13, np.nan, 14, 15, np.nan, 16])
+    assert_values(std_values, [0.5, 0.5, 0.5, np.nan, 0.5, 0.5, np.nan, 0.5])
+    assert_values(n_readings_values, [60, 60, 60, np.nan, 60, 60, np.nan, 60])
+
+    # No gap at or below the threshold, and a given segment table gives the same result
+    assert extract_channel_data(data, CHANNEL, timedelta(minutes=130))[0] == at(0, 10, 20, 60, 70, 200)
+    segments = SegmentTable.from_payloads(data)
+    assert extract_channel_data(data, CHANNEL, GAP_THRESHOLD, segments=segments)[0] == timestamps
+
+
+def test_gaps_are_found_on_every_payload_not_only_the_channel():
+    # The payloads at minutes 10 and 60 do not report the channel: the gap is 20 -> 60, not 0 -> 70
+    data = [payload(0, 10), payload(10), payload(20, 12), payload(60), payload(70, 14)]
+    timestamps, mean_values, min_values, max_values, std_values, n_readings_values = \
+        extract_channel_data(data, CHANNEL, GAP_THRESHOLD)
+
+    assert timestamps == at(0, 20, 20, 70)
+    assert_values(mean_values, [10, 12, np.nan, 14])
+
+    # A gap right after a payload without the channel still breaks the line at its timestamp
+    data = [payload(0, 10), payload(10), payload(60, 13)]
+    assert extract_channel_data(data, CHANNEL, GAP_THRESHOLD)[0] == at(0, 10, 60)
+    assert_values(extract_channel_data(data, CHANNEL, GAP_THRESHOLD)[1], [10, np.nan, 13])
+
+
+def test_qc_mask_hides_flagged_statistics():
+    data = [payload(0, 10), payload(10, 11, QC_SPIKE), payload(20, 12, QC_STUCK), payload(30, 13, QC_SPIKE | QC_TILT),
+            payload(80, 14, QC_TILT)]
+    timestamps, mean_values, min_values, max_values, std_values, n_readings_values = \
+        extract_channel_data(data, CHANNEL, GAP_THRESHOLD, qc_mask=QC_SPIKE | QC_TILT)
+
+    # Masked samples keep their timestamp so they do not close a gap; the sample count is not a QC'd statistic
+    assert timestamps == at(0, 10, 20, 30, 30, 80)
+    assert_values(mean_values, [10, np.nan, 12, np.nan, np.nan, np.nan])
+    assert_values(min_values, [9, np.nan, 11, np.nan, np.nan, np.nan])
+    assert_values(max_values, [11, np.nan, 13, np.nan, np.nan, np.nan])
+    assert_values(std_values, [0.5, np.nan, 0.5, np.nan, np.nan, np.nan])
+    assert_values(n_readings_values, [60, 60, 60, 60, np.nan, 60])
+
+    # Without a mask the flags are ignored
+    assert_values(extract_channel_data(data, CHANNEL, GAP_THRESHOLD)[1], [10, 11, 12, 13, np.nan, 14])
+
+
+@pytest.mark.parametrize('qc_mask', [0, QC_SPIKE])
+def test_missing_min_max_and_stdev_stay_empty(qc_mask):
+    data = [payload(0, 10, QC_SPIKE, stdev=False), payload(10, 11, stdev=False), payload(60, 12, stdev=False)]
+    timestamps, mean_values, min_values, max_values, std_values, n_readings_values = \
+        extract_channel_data(data, CHANNEL, GAP_THRESHOLD, plot_min_max=False, qc_mask=qc_mask)
+
+    assert timestamps == at(0, 10, 10, 60)
+    assert_values(mean_values, [np.nan if qc_mask else 10, 11, np.nan, 12])
+    assert min_values == max_values == std_values == []
+    assert_values(n_readings_values, [60, 60, np.nan, 60])
+
+
+def test_channel_absent_from_every_payload():
+    data = [payload(0), payload(60)]
+    timestamps, mean_values, min_values, max_values, std_values, n_readings_values = \
+        extract_channel_data(data, CHANNEL, GAP_THRESHOLD)
+
+    # No line to break, so every list stays empty and of the same length
+    assert timestamps == mean_values == min_values == max_values == std_values == n_readings_values == []
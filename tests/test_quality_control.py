@@ -0,0 +1,141 @@
+import copy
+
+import numpy as np
+
+from lib.api_functions import decode_beta2_data, decode_sensor_data
+from lib.plotting_functions import group_by_sensor_position
+from lib.quality_control import (
+    apply_qc_flags,
+    channel_arrays,
+    qc_channel,
+    qc_sensor_data,
+    sensor_channel_arrays,
+    QC_LOW_COUNT,
+    QC_RANGE,
+    QC_SPIKE,
+    QC_STDEV,
+    QC_STUCK,
+    QC_TILT,
+)
+
+TIMESTAMPS = np.datetime64('2024-01-21T20:00', 'ms') + np.arange(12).astype('timedelta64[h]')
+
+
+def flagged(flags, bit):
+    return np.flatnonzero(flags & bit).tolist()
+
+
+def test_range_flags_means_outside_channel_range():
+    mean = np.array([-6.0, -5.0, 12.0, 40.0, 41.0, np.nan, 20.0, 20.5, 21.0, 21.5, 22.0, 22.5])
+    assert flagged(qc_channel("Temperature[ºC]", TIMESTAMPS, mean), QC_RANGE) == [0, 4]
+    # Channels without a declared range are not range tested
+    assert flagged(qc_channel("Unknown Channel", TIMESTAMPS, mean), QC_RANGE) == []
+
+
+def test_spike_flags_isolated_jumps_not_steps():
+    mean = np.array([10.0, 10.5, 30.0, 11.0, 11.5, 12.0, 40.0, 40.5, 41.0, 41.5, 42.0, 42.5])
+    # Hourly samples, limit 100 cm/s per hour: 3.0 -> 180 -> 3 is a spike, the step to 40 is not
+    speed = qc_channel("Abs Speed[cm/s]", TIMESTAMPS, mean * 6)
+    assert flagged(speed, QC_SPIKE) == [2]
+    # Direction differences wrap at 360 degrees: 350 -> 10 -> 355 is not a spike
+    quarter_hourly = TIMESTAMPS[0] + np.arange(12).astype('timedelta64[m]') * 15
+    direction = np.array([350.0, 355.0, 10.0, 355.0, 350.0, 345.0, 340.0, 335.0, 330.0, 325.0, 320.0, 315.0])
+    assert flagged(qc_channel("Direction[Deg.M]", quarter_hourly, direction), QC_SPIKE) == []
+    direction[5] = 80.0
+    assert flagged(qc_channel("Direction[Deg.M]", quarter_hourly, direction), QC_SPIKE) == [5]
+
+
+def test_low_count_flags_few_readings():
+    mean = np.linspace(10.0, 11.0, len(TIMESTAMPS))
+    sample_count = np.array([0, 1, 2, 3, 4, 177, np.nan, 177, 177, 177, 177, 177])
+    flags = qc_channel("Temperature[ºC]", TIMESTAMPS, mean, sample_count=sample_count)
+    assert flagged(flags, QC_LOW_COUNT) == [0, 1, 2]
+    flags = qc_channel("Temperature[ºC]", TIMESTAMPS, mean, sample_count=sample_count, min_reading_count=5)
+    assert flagged(flags, QC_LOW_COUNT) == [0, 1, 2, 3, 4]
+
+
+def test_stdev_flags_inconsistent_statistics():
+    mean = np.full(len(TIMESTAMPS), 10.0)
+    mean[3] = 12.0
+    stdev = np.full(len(TIMESTAMPS), 0.5)
+    stdev[1] = -0.1
+    stdev[5] = 3.0
+    minimum, maximum = np.full(len(TIMESTAMPS), 9.0), np.full(len(TIMESTAMPS), 11.0)
+    flags = qc_channel("Temperature[ºC]", TIMESTAMPS, mean, stdev=stdev, minimum=minimum, maximum=maximum)
+    # Negative stdev, mean above max, stdev wider than max - min
+    assert flagged(flags, QC_STDEV) == [1, 3, 5]
+    # Without min/max only the sign can be checked
+    assert flagged(qc_channel("Temperature[ºC]", TIMESTAMPS, mean, stdev=stdev), QC_STDEV) == [1]
+
+
+def test_flags_are_independent_bits():
+    mean = np.array([10.0, 10.5, 50.0, 11.0, 11.5, 12.0, 12.5, 13.0, 13.5, 14.0, 14.5, 15.0])
+    sample_count = np.full(len(TIMESTAMPS), 177.0)
+    sample_count[2] = 1
+    flags = qc_channel("Temperature[ºC]", TIMESTAMPS, mean, sample_count=sample_count)
+    assert flags[2] == QC_RANGE | QC_SPIKE | QC_LOW_COUNT
+    assert not np.any(np.delete(flags, 2))
+
+
+def test_stuck_test_only_runs_on_listed_channels():
+    constant = np.full(len(TIMESTAMPS), 12.0)
+    assert not np.any(qc_channel("Ping Count", TIMESTAMPS, constant) & QC_STUCK)
+    assert not np.any(qc_channel("Temperature[ºC]", TIMESTAMPS, constant) & QC_STUCK)
+    assert np.all(qc_channel("Abs Speed[cm/s]", TIMESTAMPS, constant) & QC_STUCK)
+
+
+def test_stuck_run_lengths_override():
+    constant = np.full(len(TIMESTAMPS), 12.0)
+    flags = qc_channel("Temperature[ºC]", TIMESTAMPS, constant, stuck_run_lengths={"Temperature[ºC]": 12})
+    assert np.all(flags & QC_STUCK)
+    flags = qc_channel("Abs Speed[cm/s]", TIMESTAMPS, constant, stuck_run_lengths={})
+    assert not np.any(flags & QC_STUCK)
+
+
+def test_tilt_flags_current_channels_only(beta1_response):
+    dataset = decode_sensor_data(beta1_response)
+    for payload in dataset['data']:
+        for channel in payload['decoded_value']:
+            if channel['channel_name'] == "Abs Tilt[Deg]":
+                channel['data']['mean'] = 80.0
+    apply_qc_flags(dataset)
+    tilt_flagged = {channel['channel_name'] for payload in dataset['data'] for channel in payload['decoded_value']
+                    if channel['data']['qc_flags'] & QC_TILT}
+    assert tilt_flagged == {"Abs Speed[cm/s]", "Direction[Deg.M]", "North[cm/s]", "East[cm/s]",
+                            "Tilt X[Deg]", "Tilt Y[Deg]", "Abs Tilt[Deg]"}
+
+
+def test_sensor_channel_arrays_match_per_channel_scan(beta1_response):
+    data = decode_sensor_data(beta1_response)['data']
+    # Mixed shapes: a missing field, a None value and a payload without the channel
+    del data[0]['decoded_value'][0]['data']['stdev']
+    data[1]['decoded_value'][1]['data']['mean'] = None
+    data[2]['decoded_value'] = data[2]['decoded_value'][1:]
+
+    gathered = sensor_channel_arrays(data)
+    for channel_name, arrays in gathered.items():
+        index = [i for i, payload in enumerate(data)
+                 if any(item['channel_name'] == channel_name for item in payload['decoded_value'])]
+        assert arrays['index'].tolist() == index
+        for key in ('mean', 'min', 'max', 'stdev', 'sample_count'):
+            expected = [next(item['data'] for item in data[i]['decoded_value'] if item['channel_name'] == channel_name).get(key)
+                        for i in index]
+            expected = np.array([np.nan if value is None else value for value in expected], dtype=np.float64)
+            np.testing.assert_array_equal(arrays[key], expected)
+        np.testing.assert_array_equal(channel_arrays(data, channel_name)['mean'], arrays['mean'])
+    assert len(channel_arrays(data, "No Such Channel")['index']) == 0
+
+
+def test_qc_groups_sensors_like_plotting(beta2_response):
+    # Beta 2 sensors sharing a node id are still separate sensors, one per position
+    for item in beta2_response['data']:
+        item['bristlemouth_node_id'] = '0xc12f1ff07208adf7'
+    positions = sorted({item['sensorPosition'] for item in beta2_response['data']})
+    second = [dict(item, sensorPosition=positions[-1] + 1, value=item['value'] * 0.5) for item in beta2_response['data']]
+    beta2_response['data'].extend(second)
+    dataset = apply_qc_flags(decode_beta2_data(beta2_response))
+
+    expected = copy.deepcopy(dataset)
+    for data_group in group_by_sensor_position(expected).values():
+        qc_sensor_data(data_group)
+    assert dataset['data'] == expected['data']
@@ -0,0 +1,68 @@
+import copy
+import json
+import tracemalloc
+from functools import partial
+
+import pytest
+
+import lib.parallel_decode
+from lib.api_functions import decode_beta2_data, decode_sensor_data
+from lib.records import compact_record, record_to_json, LocatedDatum, SensorPayload
+
+
+def repeated(response, times):
+    return {'data': [dict(payload) for _ in range(times) for payload in response['data']]}
+
+
+def traced_memory(decode, response, compact):
+    """Return (retained, peak) bytes allocated while decoding a copy of response."""
+    response = copy.deepcopy(response)
+    tracemalloc.start()
+    decoded = decode(response, compact=compact)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    return retained, peak
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_compact_records_equal_dicts(beta1_response, beta2_response, monkeypatch, workers):
+    monkeypatch.setattr(lib.parallel_decode, 'MIN_PARALLEL_RECORDS', 1)
+    decode_beta1 = partial(decode_sensor_data, workers=workers)
+    for decode, response in ((decode_beta1, beta1_response), (decode_beta2_data, beta2_response)):
+        as_dicts = decode(copy.deepcopy(response))['data']
+        as_records = decode(copy.deepcopy(response), compact=True)['data']
+        assert as_records == as_dicts
+        assert all(isinstance(record, (SensorPayload, LocatedDatum)) for record in as_records)
+        assert json.loads(json.dumps(as_records, default=record_to_json)) == json.loads(json.dumps(as_dicts))
+
+
+def test_keys_outside_fields_overflow(beta1_response):
+    payload = dict(beta1_response['data'][0], quality='good')
+    record = compact_record(dict(payload))
+    assert isinstance(record, SensorPayload)
+    assert record == payload
+    assert list(record)[-1] == 'quality'
+    assert record['quality'] == 'good'
+
+    record['note'] = 1
+    del record['quality']
+    assert 'quality' not in record
+    with pytest.raises(KeyError):
+        record['quality']
+    payload.pop('quality')
+    assert record.to_dict() == dict(payload, note=1)
+
+
+def test_compact_decode_memory(beta1_response, beta2_response):
+    beta2 = repeated(beta2_response, 20)
+    dict_retained, dict_peak = traced_memory(decode_beta2_data, beta2, False)
+    compact_retained, compact_peak = traced_memory(decode_beta2_data, beta2, True)
+    assert compact_retained < 0.25 * dict_retained
+    # Records are compacted as they are formatted, so the dicts of the whole response never coexist
+    assert compact_peak < 0.5 * dict_peak
+
+    beta1 = repeated(beta1_response, 20)
+    dict_retained, _ = traced_memory(decode_sensor_data, beta1, False)
+    compact_retained, _ = traced_memory(decode_sensor_data, beta1, True)
+    assert compact_retained < 0.75 * dict_retained
@@ -0,0 +1,80 @@
+import copy
+import struct
+
+import numpy as np
+import pytest
+
+from lib.api_functions import decode_mixed_data
+from lib.binary_decoder import RBR_CODA_DATA_CHANNELS
+from lib.sensor_registry import (
+    detect_sensor_type,
+    SENSOR_TYPES,
+    SENSOR_TYPE_AANDERAA,
+    SENSOR_TYPE_AANDERAA_DVT1,
+    SENSOR_TYPE_RBR_CODA,
+    SENSOR_TYPE_SOFT,
+)
+from lib.timestamps import parse_timestamps
+from lib.topology import get_topology
+
+
+@pytest.fixture
+def mixed_response(beta1_response, beta2_response):
+    """
+    The Beta 2 example (Aanderaa at position 1) with a SOFT module at position 2, interleaved
+    with the DVT1 example's hex payloads, as one Spotter carrying both generations would report.
+    """
+    aanderaa = [datum for datum in beta2_response['data'] if datum['data_type_name'] == 'aanderaa_temperature_mean_13bits']
+    soft = [dict(datum, sensorPosition=2, data_type_name='bm_soft_temperature_mean_13bits', value=10.5) for datum in aanderaa]
+    payloads = [dict(payload) for payload in beta1_response['data']]
+    for payload in payloads:
+        payload.pop('decoded_value', None)
+    records = soft + payloads
+    beta2 = beta2_response['data']
+    return {'data': [item for pair in zip(records, beta2) for item in pair] + beta2[len(records):]}
+
+
+def decoded_by_sensor(dataset):
+    by_sensor = {}
+    for record in dataset['data']:
+        key = record.get('bristlemouth_node_id') or record['sensorPosition']
+        by_sensor.setdefault(key, []).append(record.get('decoded_value'))
+    return by_sensor
+
+
+def test_mixed_stream_decodes_every_record(mixed_response, beta1_response):
+    dataset = decode_mixed_data(copy.deepcopy(mixed_response))
+    assert len(dataset['data']) == 24 + 24 + len(beta1_response['data'])
+    assert all(record.get('decoded_value') for record in dataset['data'])
+
+    by_sensor = decoded_by_sensor(dataset)
+    assert [channel['channel_name'] for channel in by_sensor[1][0]] == [
+        "Abs Speed[cm/s]", "Abs Tilt[Deg]", "Direction[Deg.M]", "Temperature[ºC]"]
+    assert by_sensor[2][8] == [{"data": {"mean": 10.5}, "channel_name": "Temperature[ºC]"}]
+    node_id = beta1_response['data'][0]['bristlemouth_node_id']
+    assert len(by_sensor[node_id][0]) == 9
+
+    topology = get_topology(dataset)
+    assert topology.sensor_type(1) == SENSOR_TYPE_AANDERAA
+    assert topology.sensor_type(2) == SENSOR_TYPE_SOFT
+
+
+def test_mixed_stream_is_in_time_order(mixed_response):
+    timestamps = parse_timestamps([record['timestamp'] for record in decode_mixed_data(copy.deepcopy(mixed_response))['data']])
+    assert np.all(np.diff(timestamps) >= np.timedelta64(0))
+
+
+def test_mixed_stream_compact_matches_dicts(mixed_response):
+    assert decode_mixed_data(copy.deepcopy(mixed_response), compact=True)['data'] == \
+        decode_mixed_data(copy.deepcopy(mixed_response))['data']
+
+
+def test_hex_payloads_dispatch_on_size(beta1_response):
+    assert detect_sensor_type(beta1_response['data'][0]) == SENSOR_TYPE_AANDERAA_DVT1
+    # One RBR Coda struct: uint16 sample count, then double min, max, mean and stdev
+    rbr_payload = {'units': 'hex', 'value': struct.pack('<Hdddd', 60, 9.5, 10.5, 10.0, 0.25).hex()}
+    assert detect_sensor_type(rbr_payload) == SENSOR_TYPE_RBR_CODA
+    assert SENSOR_TYPES[SENSOR_TYPE_RBR_CODA].decode(rbr_payload) == [{
+        "data": {"sample_count": 60, "min": 9.5, "max": 10.5, "mean": 10.0, "stdev": 0.25},
+        "channel_name": RBR_CODA_DATA_CHANNELS[0],
+    }]
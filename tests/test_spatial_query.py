@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from lib.spatial_query import EARTH_RADIUS_KM, PositionIndex, haversine_km
+from lib.timestamps import to_datetime64
+
+START = np.datetime64('2024-01-01T00:00:00', 'ms')
+CELL_SIZES_DEG = [0.1, 1.0, 7.0]
+
+
+def random_positions(n=20000, seed=0):
+    """Positions spread over the globe, with clusters straddling the antimeridian and around both poles."""
+    rng = np.random.default_rng(seed)
+    latitudes = np.concatenate([
+        np.degrees(np.arcsin(rng.uniform(-1, 1, n))),
+        rng.uniform(-30, 30, n // 4),
+        rng.uniform(80, 90, n // 4),
+        rng.uniform(-90, -80, n // 4),
+    ])
+    longitudes = np.concatenate([
+        rng.uniform(-180, 180, n),
+        rng.choice([-1, 1], n // 4) * rng.uniform(175, 180, n // 4),
+        rng.uniform(-180, 180, n // 4),
+        rng.uniform(-180, 180, n // 4),
+    ])
+    longitudes[longitudes == 180] = -180
+    timestamps = START + rng.integers(0, 10 * 86400, len(latitudes)) * np.timedelta64(1000, 'ms')
+    return timestamps, latitudes, longitudes
+
+
+def build_index(timestamps, latitudes, longitudes, cell_size_deg):
+    """Index positions with their row number as spotter id, so results can be compared as sets."""
+    return PositionIndex([str(i) for i in range(len(latitudes))], ['1'] * len(latitudes), timestamps,
+                         latitudes, longitudes, cell_size_deg)
+
+
+def found_rows(result):
+    return sorted(int(spotter_id) for spotter_id in result['spotter_id'])
+
+
+def in_time_range(timestamps, start, end):
+    inside = np.ones(len(timestamps), dtype=bool)
+    if start is not None:
+        inside &= timestamps >= to_datetime64(start)
+    if end is not None:
+        inside &= timestamps <= to_datetime64(end)
+    return inside
+
+
+def destination(latitude, longitude, bearings, distance_km):
+    """Points distance_km from (latitude, longitude) along each bearing, in degrees."""
+    lat, lon, bearings = np.radians(latitude), np.radians(longitude), np.radians(bearings)
+    angle = distance_km / EARTH_RADIUS_KM
+    lat2 = np.arcsin(np.sin(lat) * np.cos(angle) + np.cos(lat) * np.sin(angle) * np.cos(bearings))
+    lon2 = lon + np.arctan2(np.sin(bearings) * np.sin(angle) * np.cos(lat), np.cos(angle) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lon2) + 180.0) % 360.0 - 180.0
+
+
+@pytest.fixture(scope='module')
+def positions():
+    return random_positions()
+
+
+@pytest.mark.parametrize('cell_size_deg', CELL_SIZES_DEG)
+@pytest.mark.parametrize('lat_min, lat_max, lon_min, lon_max', [
+    (-10.0, 25.0, -40.0, 15.5),
+    (-5.0, 5.0, 170.0, -170.0),      # Crosses the antimeridian
+    (-30.0, 30.0, 179.95, -179.95),
+    (-30.0, 30.0, -180.0, -175.0),   # Ends on the antimeridian
+    (-30.0, 30.0, 175.0, 180.0),
+    (84.0, 90.0, -180.0, 180.0),     # Polar caps
+    (-90.0, -86.3, 100.0, -100.0),
+    (-90.0, 90.0, -180.0, 180.0),    # Whole globe
+])
+def test_box_query_matches_brute_force(positions, cell_size_deg, lat_min, lat_max, lon_min, lon_max):
+    timestamps, latitudes, longitudes = positions
+    index = build_index(timestamps, latitudes, longitudes, cell_size_deg)
+
+    if lon_min <= lon_max:
+        in_lon = (longitudes >= lon_min) & (longitudes <= lon_max)
+    else:
+        in_lon = (longitudes >= lon_min) | (longitudes <= lon_max)
+    inside = (latitudes >= lat_min) & (latitudes <= lat_max) & in_lon
+    assert inside.any()
+    assert found_rows(index.query_box(lat_min, lat_max, lon_min, lon_max)) == np.flatnonzero(inside).tolist()
+
+    start, end = '2024-01-03T00:00:00Z', '2024-01-05T12:00:00Z'
+    expected = np.flatnonzero(inside & in_time_range(timestamps, start, end)).tolist()
+    result = index.query_box(lat_min, lat_max, lon_min, lon_max, start, end)
+    assert found_rows(result) == expected
+    assert np.all(np.diff(result['timestamp']) >= np.timedelta64(0))
+
+
+@pytest.mark.parametrize('cell_size_deg', CELL_SIZES_DEG)
+@pytest.mark.parametrize('latitude, longitude, radius_km', [
+    (0.0, 0.0, 500.0),
+    (10.0, 179.9, 300.0),            # Crosses the antimeridian
+    (-20.0, -179.95, 1000.0),
+    (85.0, 0.0, 300.0),              # Near the pole
+    (89.5, 30.0, 200.0),             # Circle contains the pole
+    (-88.0, 100.0, 600.0),
+    (-90.0, 0.0, 100.0),             # At the pole
+    (40.0, -70.0, 5000.0),
+])
+def test_radius_query_matches_haversine(positions, cell_size_deg, latitude, longitude, radius_km):
+    timestamps, latitudes, longitudes = positions
+    index = build_index(timestamps, latitudes, longitudes, cell_size_deg)
+
+    distances = haversine_km(latitude, longitude, latitudes, longitudes)
+    inside = distances <= radius_km
+    assert inside.any()
+    result = index.query_radius(latitude, longitude, radius_km)
+    assert found_rows(result) == np.flatnonzero(inside).tolist()
+    np.testing.assert_allclose(result['distance_km'], distances[result['spotter_id'].astype(int)])
+
+    start, end = '2024-01-02T00:00:00Z', None
+    expected = np.flatnonzero(inside & in_time_range(timestamps, start, end)).tolist()
+    assert found_rows(index.query_radius(latitude, longitude, radius_km, start, end)) == expected
+
+
+@pytest.mark.parametrize('cell_size_deg', CELL_SIZES_DEG)
+@pytest.mark.parametrize('latitude, longitude, radius_km', [
+    (0.0, 0.0, 300.0),
+    (0.003, 0.0, 300.0),             # Northernmost point just across a 0.1 degree cell boundary
+    (45.0, 179.99, 3000.0),
+    (87.0, -120.0, 300.0),
+    (-60.0, -180.0, 1200.0),
+])
+def test_radius_query_finds_points_on_the_circle(cell_size_deg, latitude, longitude, radius_km):
+    # Points just inside the circle in every direction, where a bounding box that is too tight loses them
+    bearings = np.linspace(0.0, 360.0, 720, endpoint=False)
+    latitudes, longitudes = destination(latitude, longitude, bearings, radius_km * (1 - 1e-9))
+    timestamps = np.full(len(bearings), START)
+    index = build_index(timestamps, latitudes, longitudes, cell_size_deg)
+
+    assert found_rows(index.query_radius(latitude, longitude, radius_km)) == list(range(len(bearings)))
+    outside_latitudes, outside_longitudes = destination(latitude, longitude, bearings, radius_km * 1.001)
+    outside = build_index(timestamps, outside_latitudes, outside_longitudes, cell_size_deg)
+    assert found_rows(outside.query_radius(latitude, longitude, radius_km)) == []
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from iso8601 import ParseError
+
+from lib.beta2_data import group_sensor_data
+from lib.timestamps import max_timestamp, parse_timestamp, text_bounds
+from lib.topology import SensorTopology
+
+
+def test_parse_timestamp_returns_naive_utc():
+    assert parse_timestamp('2024-01-21T20:20:08.000Z') == datetime(2024, 1, 21, 20, 20, 8)
+    assert parse_timestamp('2024-01-21T21:20:08+01:00') == datetime(2024, 1, 21, 20, 20, 8)
+    assert parse_timestamp('2024-01-21T20:20:08') == datetime(2024, 1, 21, 20, 20, 8)
+    with pytest.raises(ParseError):
+        parse_timestamp('21/01/2024 20:20')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_group_sensor_data_groups_on_parsed_time(beta2_response, compact):
+    first = beta2_response['data'][0]
+    items = [dict(item) for item in beta2_response['data']
+             if item['timestamp'] == first['timestamp'] and item['sensorPosition'] == first['sensorPosition']]
+    # The same instant written three ways, and an earlier datum that sorts after it as a string
+    seconds = first['timestamp'][:19]
+    for item, timestamp in zip(items, (f'{seconds}Z', f'{seconds}.000Z', f'{seconds}+00:00')):
+        item['timestamp'] = timestamp
+    earlier = dict(items[0], timestamp='2024-01-21T19:20:08.5Z')
+
+    grouped = group_sensor_data(items + [earlier], compact=compact)
+    assert [datum['timestamp'] for datum in grouped] == ['2024-01-21T19:20:08.5Z', f'{seconds}Z']
+    assert [len(datum['sample_values']) for datum in grouped] == [1, len(items)]
+
+
+def test_max_timestamp_and_text_bounds():
+    assert max_timestamp(['2024-01-21T20:20:08.5Z', '2024-01-21T20:20:08Z', None]) == '2024-01-21T20:20:08.5Z'
+    assert max_timestamp([None]) is None
+    lower, upper = text_bounds(np.datetime64('2024-01-21T20:20:08.500'), np.datetime64('2024-01-21T20:20:59.999'))
+    for inside in ('2024-01-21T20:20:08Z', '2024-01-21T20:20:59Z', '2024-01-21T20:20:59.999Z'):
+        assert lower <= inside < upper
+    assert not '2024-01-21T20:21:00Z' < upper
+
+
+def test_topology_lookup_compares_parsed_times():
+    topology = SensorTopology([
+        {'slot': '1', 'bristlemouth_node_id': None, 'sensorPosition': 1, 'sensor_type': 'aanderaa',
+         'valid_from': '2024-01-21T20:20:08.000Z', 'valid_to': '2024-01-21T20:20:09Z'},
+        {'slot': '1', 'bristlemouth_node_id': None, 'sensorPosition': 1, 'sensor_type': 'soft',
+         'valid_from': '2024-01-21T20:20:09.5Z', 'valid_to': '2024-01-21T20:20:10Z'},
+    ])
+    # As text, '...:09Z' sorts after '...:09.000Z'-'...:09.999Z'
+    assert topology.sensor_type('1', '2024-01-21T20:20:08.500Z') == 'aanderaa'
+    assert topology.sensor_type('1', '2024-01-21T20:20:09.000Z') == 'aanderaa'
+    assert topology.sensor_type('1', '2024-01-21T20:20:09.700Z') == 'soft'
+    assert topology.sensor_type('1') == 'soft'
+    assert topology.lookup('1', '2024-01-21T20:20:11Z') is None